@@ -0,0 +1,168 @@
+## Protected under the GPL V2 License
+##
+## The benchmarked functions. Each case reads its inputs from the synthetic
+## files in its setup, which is not timed, and returns the call to time.
+
+import os
+import tempfile
+import numpy
+from netCDF4 import Dataset
+
+CASES = {}
+
+LEVELS = [ 1000., 925., 850., 700., 500., 300., 250., 200. ]
+
+def case( name ):
+    def register( setup ):
+        CASES[ name ] = setup
+        return setup
+    return register
+
+def _read( path, *names ):
+    f = Dataset( path )
+    values = [ f.variables[ name ][:] for name in names ]
+    f.close()
+    return [ numpy.asarray( value ) for value in values ]
+
+def _thermo( wrf ):
+    T, P, PB, QVAPOR = _read( wrf, 'T', 'P', 'PB', 'QVAPOR' )
+    THETA = T + 300.
+    PRES = ( P + PB ) * .01
+    TEMP = THETA * ( PRES / 1000. )**0.2854
+    return THETA, PRES, TEMP, QVAPOR
+
+def _mass_winds( wrf ):
+    U, V = _read( wrf, 'U', 'V' )
+    return 0.5 * ( U[..., :-1] + U[..., 1:] ), 0.5 * ( V[..., :-1, :] + V[..., 1:, :] )
+
+@case( 'interp.wrf_to_pres' )
+def bench_wrf_to_pres( wrf, mpas ):
+    from wrftools.interp import wrf_to_pres
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    return lambda: wrf_to_pres( TEMP, PRES, LEVELS, log=True )
+
+@case( 'interp.wrf_to_pres.parallel' )
+def bench_wrf_to_pres_parallel( wrf, mpas ):
+    from wrftools.interp import wrf_to_pres
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    workers = min( os.cpu_count() or 1, 8 )
+    return lambda: wrf_to_pres( TEMP, PRES, LEVELS, log=True, workers=workers )
+
+@case( 'interp.wrf_to_isen' )
+def bench_wrf_to_isen( wrf, mpas ):
+    from wrftools.interp import vcoord_surfaces
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    return lambda: vcoord_surfaces( [ PRES, TEMP, QVAPOR ], THETA, numpy.arange( 290., 335., 5. ) )
+
+@case( 'interp.InterpPlan' )
+def bench_interp_plan( wrf, mpas ):
+    from wrftools.interp import InterpPlan
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    def run():
+        plan = InterpPlan( PRES, LEVELS, log=True )
+        return plan.apply_many( [ THETA, TEMP, QVAPOR ] )
+    return run
+
+@case( 'interp.wrf_to_pv' )
+def bench_wrf_to_pv( wrf, mpas ):
+    from wrftools.interp import wrf_to_pv
+    from wrftools.variables import wrf_pv
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    U, V = _mass_winds( wrf )
+    F, MAPFAC_M = _read( wrf, 'F', 'MAPFAC_M' )
+    PV = wrf_pv( U, V, F[0], THETA, PRES, MAPFAC_M[0], 3000. )
+    return lambda: wrf_to_pv( PRES, PV, [ 1.5, 2., 3. ] )
+
+@case( 'variables.wrf_pv' )
+def bench_wrf_pv( wrf, mpas ):
+    from wrftools.variables import wrf_pv
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    U, V = _mass_winds( wrf )
+    F, MAPFAC_M = _read( wrf, 'F', 'MAPFAC_M' )
+    return lambda: wrf_pv( U, V, F[0], THETA, PRES, MAPFAC_M[0], 3000. )
+
+@case( 'variables.wrf_dewp' )
+def bench_wrf_dewp( wrf, mpas ):
+    from wrftools.variables import wrf_dewp
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    return lambda: wrf_dewp( TEMP, PRES, QVAPOR )
+
+@case( 'variables.wrf_thermo' )
+def bench_wrf_thermo( wrf, mpas ):
+    from wrftools.variables import wrf_thermo
+    T, P, PB, QVAPOR = _read( wrf, 'T', 'P', 'PB', 'QVAPOR' )
+    return lambda: wrf_thermo( T, P, PB, QVAPOR )
+
+@case( 'variables.wrf_kinematics' )
+def bench_wrf_kinematics( wrf, mpas ):
+    from wrftools.variables import wrf_kinematics
+    U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, F = _read( wrf, 'U', 'V', 'MAPFAC_U', 'MAPFAC_V', 'MAPFAC_M', 'F' )
+    return lambda: wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, 3000., 3000., F=F[0] )
+
+@case( 'variables.wrf_parcel' )
+def bench_wrf_parcel( wrf, mpas ):
+    from wrftools.variables import wrf_parcel
+    THETA, PRES, TEMP, QVAPOR = _thermo( wrf )
+    PH, PHB = _read( wrf, 'PH', 'PHB' )
+    HGT = ( PH + PHB ) / 9.81
+    return lambda: wrf_parcel( TEMP, PRES, HGT, QVAPOR, parcel='mu' )
+
+@case( 'variables.wrf_shear' )
+def bench_wrf_shear( wrf, mpas ):
+    from wrftools.variables import wrf_shear
+    U, V = _mass_winds( wrf )
+    PH, PHB = _read( wrf, 'PH', 'PHB' )
+    HGT = ( PH + PHB ) / 9.81
+    return lambda: wrf_shear( U, V, HGT )
+
+@case( 'derive.wrf_derive' )
+def bench_wrf_derive( wrf, mpas ):
+    from wrftools.derive import wrf_derive
+    return lambda: wrf_derive( wrf, [ 'TEMP@850,500hPa', 'RH@850hPa', 'PV', 'DEWP2', 'SLP', 'SRH3' ] )
+
+@case( 'utils.find_cells' )
+def bench_find_cells( wrf, mpas ):
+    from wrftools.utils import find_cells
+    XLAT, XLONG = _read( wrf, 'XLAT', 'XLONG' )
+    return lambda: find_cells( mpas, XLAT[0], XLONG[0], degrees=True )
+
+@case( 'utils.MPASRemapper' )
+def bench_mpas_remapper( wrf, mpas ):
+    from wrftools.utils import MPASRemapper
+    XLAT, XLONG = _read( wrf, 'XLAT', 'XLONG' )
+    def run():
+        remapper = MPASRemapper.from_file( mpas, XLAT[0], XLONG[0], method='barycentric', degrees=True )
+        return list( remapper.iter_remap( mpas, 't2m' ) )
+    return run
+
+@case( 'utils.wrf_copy_pres_fields' )
+def bench_wrf_copy_pres_fields( wrf, mpas ):
+    from wrftools.utils import wrf_copy_attributes, wrf_copy_pres_fields
+    outdir = tempfile.mkdtemp()
+    outfilename = os.path.join( outdir, 'post.nc' )
+    def run():
+        wrf_copy_attributes( wrf, outfilename, len( LEVELS ) )
+        wrf_copy_pres_fields( wrf, outfilename, [ 'TEMP', 'RH', 'GHT', 'U', 'V' ], LEVELS )
+        os.remove( outfilename )
+    return run
+
+@case( 'utils.wrf_copy_sfc_fields' )
+def bench_wrf_copy_sfc_fields( wrf, mpas ):
+    from wrftools.utils import wrf_copy_attributes, wrf_copy_sfc_fields
+    outdir = tempfile.mkdtemp()
+    outfilename = os.path.join( outdir, 'post.nc' )
+    def run():
+        wrf_copy_attributes( wrf, outfilename, len( LEVELS ) )
+        wrf_copy_sfc_fields( wrf, outfilename )
+        os.remove( outfilename )
+    return run
+
+@case( 'utils.wrf_tiled_fields' )
+def bench_wrf_tiled_fields( wrf, mpas ):
+    from wrftools.utils import wrf_tiled_fields
+    outdir = tempfile.mkdtemp()
+    outfilename = os.path.join( outdir, 'tiled.nc' )
+    def run():
+        wrf_tiled_fields( wrf, outfilename, fields=( 'PV', 'ABSVORT' ), tile=( 64, 64 ) )
+        os.remove( outfilename )
+    return run
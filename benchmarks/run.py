@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+## Protected under the GPL V2 License
+##
+## Runs the wrftools benchmarks on synthetic data. Every case runs in its
+## own process, so that its peak memory is its own. Results are written as
+## JSON, and can be compared against the results of an earlier run:
+##
+##    python benchmarks/run.py -s small medium -o baseline.json
+##    ... change wrftools ...
+##    python benchmarks/run.py -s small medium -o new.json --baseline baseline.json
+##
+## The comparison exits with a nonzero status if any case got slower, or
+## used more memory, by more than the threshold.
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import platform
+import argparse
+import subprocess
+import tempfile
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+ROOT = os.path.dirname( HERE )
+
+def _max_rss_mb():
+    import resource
+    rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    ## kilobytes on Linux, bytes on macOS
+    return rss / ( 1024.**2 if sys.platform == 'darwin' else 1024. )
+
+def run_case( name, size, datadir, repeat ):
+    '''
+    Runs one case in this process and returns its measurements: the best
+    and median wall time of repeat calls in seconds, the peak resident
+    memory of the process in MB, and how far the calls raised it above the
+    peak reached while setting up the inputs.
+    '''
+    sys.path.insert( 0, ROOT )
+    sys.path.insert( 0, HERE )
+    import gc
+    import synthetic
+    import cases
+    timer = getattr( time, 'perf_counter', time.time )
+    wrf, mpas = synthetic.ensure( datadir, size )
+    func = cases.CASES[ name ]( wrf, mpas )
+    gc.collect()
+    setup_rss = _max_rss_mb()
+    times = []
+    for i in range( repeat ):
+        start = timer()
+        result = func()
+        times.append( timer() - start )
+        del result
+        gc.collect()
+    times.sort()
+    peak_rss = _max_rss_mb()
+    return { 'wall_s': times[0], 'median_s': times[ len( times ) // 2 ], 'repeat': repeat,
+        'peak_rss_mb': peak_rss, 'rss_increase_mb': peak_rss - setup_rss }
+
+def compare( results, baseline, threshold, min_seconds=0.01, min_mb=10. ):
+    '''
+    Compares results against baseline and returns a list of the cases that
+    regressed. A case regressed if its best wall time, or its increase in
+    peak memory, grew by more than the fraction threshold, ignoring changes
+    smaller than min_seconds and min_mb, which are within the noise.
+    '''
+    regressions = []
+    for key in sorted( results ):
+        new, old = results[ key ], baseline.get( key )
+        if old is None or 'error' in new or 'error' in old:
+            continue
+        if new['wall_s'] > old['wall_s'] * ( 1. + threshold ) and new['wall_s'] - old['wall_s'] > min_seconds:
+            regressions.append( ( key, 'wall_s', old['wall_s'], new['wall_s'] ) )
+        if ( new['rss_increase_mb'] > old['rss_increase_mb'] * ( 1. + threshold )
+                and new['rss_increase_mb'] - old['rss_increase_mb'] > min_mb ):
+            regressions.append( ( key, 'rss_increase_mb', old['rss_increase_mb'], new['rss_increase_mb'] ) )
+    return regressions
+
+def main( argv=None ):
+    sys.path.insert( 0, HERE )
+    import cases
+    parser = argparse.ArgumentParser( description='Benchmark wrftools on synthetic WRF and MPAS data.' )
+    parser.add_argument( '-s', '--sizes', nargs='+', default=[ 'small' ], choices=[ 'small', 'medium', 'large' ],
+        help='domain sizes to run (default: small)' )
+    parser.add_argument( '-k', '--cases', nargs='+', default=[ '*' ],
+        help='glob patterns of the cases to run, e.g. "interp.*" (default: all)' )
+    parser.add_argument( '-r', '--repeat', type=int, default=3, help='calls timed per case (default: 3)' )
+    parser.add_argument( '-o', '--output', default=None, help='file to write the JSON results to' )
+    parser.add_argument( '--baseline', default=None, help='JSON results of an earlier run to compare against' )
+    parser.add_argument( '--threshold', type=float, default=0.25,
+        help='fractional slowdown or memory growth that fails the comparison (default: 0.25)' )
+    parser.add_argument( '--data', default=os.path.join( tempfile.gettempdir(), 'wrftools_bench' ),
+        help='directory the synthetic files are written to and reused from' )
+    parser.add_argument( '--list', action='store_true', help='list the cases and exit' )
+    parser.add_argument( '--child', nargs=2, metavar=( 'CASE', 'SIZE' ), help=argparse.SUPPRESS )
+    args = parser.parse_args( argv )
+
+    if args.child:
+        sys.stdout.write( json.dumps( run_case( args.child[0], args.child[1], args.data, args.repeat ) ) + '\n' )
+        return 0
+    names = sorted( name for name in cases.CASES if any( fnmatch.fnmatch( name, pattern ) for pattern in args.cases ) )
+    if args.list:
+        sys.stdout.write( '\n'.join( names ) + '\n' )
+        return 0
+
+    import numpy
+    results = {}
+    failed = 0
+    for size in args.sizes:
+        for name in names:
+            key = '%s/%s' % ( size, name )
+            proc = subprocess.Popen( [ sys.executable, os.path.abspath( __file__ ), '--child', name, size,
+                '--data', args.data, '--repeat', str( args.repeat ) ], stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+            out, err = proc.communicate()
+            if proc.returncode != 0:
+                lines = err.decode( 'utf-8', 'replace' ).strip().splitlines()
+                results[ key ] = { 'error': lines[-1] if lines else 'exit status %d' % proc.returncode }
+                failed += 1
+                sys.stdout.write( '%-40s failed: %s\n' % ( key, results[ key ]['error'] ) )
+                continue
+            results[ key ] = json.loads( out.decode( 'utf-8' ).strip().splitlines()[-1] )
+            sys.stdout.write( '%-40s %9.4f s %9.1f MB peak %9.1f MB added\n' % ( key, results[ key ]['wall_s'],
+                results[ key ]['peak_rss_mb'], results[ key ]['rss_increase_mb'] ) )
+            sys.stdout.flush()
+
+    report = { 'meta': { 'python': platform.python_version(), 'numpy': numpy.__version__,
+        'platform': platform.platform(), 'date': time.strftime( '%Y-%m-%dT%H:%M:%S' ), 'repeat': args.repeat },
+        'results': results }
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( report, f, indent=2, sort_keys=True )
+    if args.baseline:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )['results']
+        regressions = compare( results, baseline, args.threshold )
+        for key, metric, old, new in regressions:
+            sys.stdout.write( 'REGRESSION %s %s: %.4f -> %.4f\n' % ( key, metric, old, new ) )
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit( main() )
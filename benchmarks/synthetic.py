@@ -0,0 +1,169 @@
+## Protected under the GPL V2 License
+##
+## Synthetic WRF-ARW output and MPAS meshes for the benchmarks. The fields
+## are smooth and physically consistent (hydrostatic heights, a tropopause,
+## a moist boundary layer, and a jet), so that the interpolation and parcel
+## code follows the same branches it does on real model output.
+
+import os
+import numpy
+from netCDF4 import Dataset
+
+## domain sizes: times, levels, rows, columns, and MPAS cells
+SIZES = {
+    'small': { 'nt': 2, 'nz': 30, 'ny': 100, 'nx': 100, 'ncells': 2562 },
+    'medium': { 'nt': 2, 'nz': 40, 'ny': 250, 'nx': 250, 'ncells': 10242 },
+    'large': { 'nt': 2, 'nz': 50, 'ny': 500, 'nx': 500, 'ncells': 40962 },
+}
+
+Rd = 287.04
+g = 9.81
+K = 0.2854
+
+def _sat_mixing_ratio( TEMP, PRES ):
+    e_s = 6.112 * numpy.exp( 17.67 * ( TEMP - 273.15 ) / ( TEMP - 29.65 ) )
+    return 0.622 * e_s / ( PRES - e_s )
+
+def make_wrf( path, nt=2, nz=30, ny=100, nx=100, dx=3000., seed=0 ):
+    '''
+    Writes a synthetic wrfout file with the variables used by wrftools on
+    an nx by ny grid with nz mass levels and nt times.
+    '''
+    rng = numpy.random.RandomState( seed )
+    f = Dataset( path, 'w', format='NETCDF4' )
+    for name, size in ( ( 'Time', None ), ( 'bottom_top', nz ), ( 'bottom_top_stag', nz + 1 ),
+        ( 'south_north', ny ), ( 'south_north_stag', ny + 1 ), ( 'west_east', nx ), ( 'west_east_stag', nx + 1 ) ):
+        f.createDimension( name, size )
+    f.setncattr( 'SOUTH-NORTH_PATCH_END_UNSTAG', ny )
+    f.setncattr( 'WEST-EAST_PATCH_END_UNSTAG', nx )
+    f.setncattr( 'DX', dx )
+    f.setncattr( 'DY', dx )
+    f.setncattr( 'MAP_PROJ', 1 )
+
+    def var( name, dims ):
+        return f.createVariable( name, 'f4', ( 'Time', ) + dims )
+    d2 = ( 'south_north', 'west_east' )
+    d3 = ( 'bottom_top', ) + d2
+
+    y, x = numpy.mgrid[ 0:ny, 0:nx ].astype( float )
+    x /= nx
+    y /= ny
+    XLAT = 35. + ( y - 0.5 ) * ny * dx / 111e3
+    XLONG = -97. + ( x - 0.5 ) * nx * dx / ( 111e3 * numpy.cos( numpy.radians( 35. ) ) )
+    HGT = 200. + 1500. * numpy.exp( -( ( x - 0.3 )**2 + ( y - 0.6 )**2 ) / 0.02 )
+    PSFC0 = 101325. * numpy.exp( -HGT / 8000. )
+    ptop = 5000.
+    eta_w = numpy.linspace( 1., 0., nz + 1 )**1.4
+    eta = 0.5 * ( eta_w[:-1] + eta_w[1:] )
+    for name in ( 'XLAT', 'XLONG', 'HGT', 'F', 'MAPFAC_M', 'SINALPHA', 'COSALPHA', 'MU', 'MUB', 'T2', 'Q2',
+        'PSFC', 'TH2', 'U10', 'V10', 'SNOWH', 'SEAICE', 'RAINNC', 'SNOWNC', 'OLR' ):
+        var( name, d2 )
+    var( 'MAPFAC_U', ( 'south_north', 'west_east_stag' ) )
+    var( 'MAPFAC_V', ( 'south_north_stag', 'west_east' ) )
+    for name in ( 'T', 'P', 'PB', 'QVAPOR', 'REFL_10CM' ):
+        var( name, d3 )
+    for name in ( 'PH', 'PHB', 'W' ):
+        var( name, ( 'bottom_top_stag', ) + d2 )
+    var( 'U', ( 'bottom_top', 'south_north', 'west_east_stag' ) )
+    var( 'V', ( 'bottom_top', 'south_north_stag', 'west_east' ) )
+    f.createVariable( 'XTIME', 'f4', ( 'Time', ) )
+
+    for t in range( nt ):
+        phase = 2 * numpy.pi * t / max( nt, 1 )
+        wave = numpy.sin( 2 * numpy.pi * ( 3 * x + 2 * y ) + phase )
+        PSFC = PSFC0 + 300. * wave
+        PB = eta[:, None, None] * ( PSFC0 - ptop ) + ptop
+        P = eta[:, None, None] * 300. * wave
+        PRES = PB + P
+        ## temperature from a standard atmosphere with a tropopause at 11 km
+        z = -7500. * numpy.log( PRES / 101325. )
+        TEMP = 288.15 - 6.5e-3 * numpy.minimum( z, 11000. ) + 2. * wave + 0.3 * rng.randn( nz, ny, nx )
+        rh = 0.85 * numpy.exp( -z / 3000. ) * ( 0.8 + 0.2 * wave )
+        QVAPOR = numpy.maximum( rh * _sat_mixing_ratio( TEMP, PRES * 0.01 ), 1e-7 )
+        THETA = TEMP * ( 100000. / PRES )**K
+        ## hydrostatic heights of the staggered levels
+        p_w = eta_w[:, None, None] * ( PSFC - ptop ) + ptop
+        Z = numpy.empty( ( nz + 1, ny, nx ) )
+        Z[0] = HGT
+        Tv = TEMP * ( 1. + 0.61 * QVAPOR )
+        Z[1:] = HGT + numpy.cumsum( Rd * Tv / g * numpy.log( p_w[:-1] / numpy.maximum( p_w[1:], 1. ) ), axis=0 )
+        PHB = g * ( Z - 5. * wave )
+        ## a jet at 10 km and a veering low level wind
+        zu = 0.5 * ( z[:, :, 1:] + z[:, :, :-1] )
+        zu = numpy.concatenate( [ zu[:, :, :1], zu, zu[:, :, -1:] ], axis=2 )
+        U = 5. + 30. * numpy.exp( -( ( zu - 10000. ) / 4000. )**2 ) + 2. * rng.randn( nz, ny, nx + 1 )
+        zv = numpy.concatenate( [ z[:, :1], 0.5 * ( z[:, 1:] + z[:, :-1] ), z[:, -1:] ], axis=1 )
+        V = 10. * numpy.exp( -zv / 2000. ) + 2. * rng.randn( nz, ny + 1, nx )
+
+        values = {
+            'XLAT': XLAT, 'XLONG': XLONG, 'HGT': HGT, 'F': 2 * 7.292e-5 * numpy.sin( numpy.radians( XLAT ) ),
+            'MAPFAC_M': numpy.ones( ( ny, nx ) ), 'MAPFAC_U': numpy.ones( ( ny, nx + 1 ) ),
+            'MAPFAC_V': numpy.ones( ( ny + 1, nx ) ), 'SINALPHA': numpy.zeros( ( ny, nx ) ),
+            'COSALPHA': numpy.ones( ( ny, nx ) ), 'MU': PSFC - PSFC0, 'MUB': PSFC0 - ptop,
+            'T2': TEMP[0] + 1., 'Q2': QVAPOR[0], 'PSFC': PSFC, 'TH2': THETA[0] + 1., 'U10': 0.5 * U[0, :, :-1],
+            'V10': 0.5 * V[0, :-1], 'SNOWH': numpy.zeros( ( ny, nx ) ), 'SEAICE': numpy.zeros( ( ny, nx ) ),
+            'RAINNC': numpy.maximum( 10. * wave, 0. ) * t, 'SNOWNC': numpy.zeros( ( ny, nx ) ),
+            'OLR': 240. + 20. * wave, 'T': THETA - 300., 'P': P, 'PB': PB, 'QVAPOR': QVAPOR,
+            'REFL_10CM': numpy.maximum( 60. * rh - 10., -30. ), 'PH': g * 5. * wave * numpy.ones( ( nz + 1, 1, 1 ) ),
+            'PHB': PHB, 'W': 0.1 * rng.randn( nz + 1, ny, nx ), 'U': U, 'V': V,
+        }
+        for name, value in values.items():
+            f.variables[ name ][t] = value
+        f.variables['XTIME'][t] = 60. * t
+    f.close()
+
+def make_mpas( path, ncells=2562, nt=1, seed=0 ):
+    '''
+    Writes a synthetic MPAS mesh and history file with ncells quasi-uniform
+    cells on a Fibonacci lattice. The six nearest cells stand in for the
+    Voronoi neighbors in cellsOnCell.
+    '''
+    i = numpy.arange( ncells ) + 0.5
+    lat = numpy.arcsin( 1. - 2. * i / ncells )
+    lon = numpy.mod( numpy.pi * ( 1. + 5.**0.5 ) * i, 2 * numpy.pi )
+    xyz = numpy.stack( [ numpy.cos( lat ) * numpy.cos( lon ), numpy.cos( lat ) * numpy.sin( lon ), numpy.sin( lat ) ], axis=1 )
+    cellsOnCell = numpy.empty( ( ncells, 6 ), dtype=numpy.int32 )
+    for start in range( 0, ncells, 1024 ):
+        dots = xyz[ start:start + 1024 ].dot( xyz.T )
+        near = numpy.argsort( -dots, axis=1 )[:, 1:7]
+        ## order the neighbors by angle around the cell, as MPAS does
+        rows = xyz[ start:start + 1024 ]
+        east = numpy.cross( [ 0., 0., 1. ], rows )
+        east /= numpy.maximum( numpy.linalg.norm( east, axis=1 ), 1e-12 )[:, None]
+        north = numpy.cross( rows, east )
+        d = xyz[ near ] - rows[:, None]
+        angle = numpy.arctan2( ( d * north[:, None] ).sum( -1 ), ( d * east[:, None] ).sum( -1 ) )
+        near = numpy.take_along_axis( near, numpy.argsort( angle, axis=1 ), axis=1 )
+        cellsOnCell[ start:start + 1024 ] = near + 1
+
+    rng = numpy.random.RandomState( seed )
+    f = Dataset( path, 'w', format='NETCDF4' )
+    f.createDimension( 'Time', None )
+    f.createDimension( 'nCells', ncells )
+    f.createDimension( 'maxEdges', 6 )
+    f.createVariable( 'latCell', 'f8', ( 'nCells', ) )[:] = lat
+    f.createVariable( 'lonCell', 'f8', ( 'nCells', ) )[:] = lon
+    f.createVariable( 'nEdgesOnCell', 'i4', ( 'nCells', ) )[:] = 6
+    f.createVariable( 'cellsOnCell', 'i4', ( 'nCells', 'maxEdges' ) )[:] = cellsOnCell
+    t2m = f.createVariable( 't2m', 'f4', ( 'Time', 'nCells' ) )
+    for t in range( nt ):
+        t2m[t] = 300. - 40. * numpy.sin( lat )**2 + rng.randn( ncells )
+    f.close()
+
+def ensure( datadir, size ):
+    '''
+    Returns the paths of the synthetic WRF file and MPAS mesh of size in
+    datadir, writing them first if they do not exist.
+    '''
+    dims = SIZES[ size ]
+    if not os.path.isdir( datadir ):
+        os.makedirs( datadir )
+    wrf = os.path.join( datadir, 'wrfout_%s.nc' % size )
+    mpas = os.path.join( datadir, 'mpas_%s.nc' % size )
+    if not os.path.exists( wrf ):
+        make_wrf( wrf + '.part', dims['nt'], dims['nz'], dims['ny'], dims['nx'] )
+        os.rename( wrf + '.part', wrf )
+    if not os.path.exists( mpas ):
+        make_mpas( mpas + '.part', dims['ncells'] )
+        os.rename( mpas + '.part', mpas )
+    return wrf, mpas
@@ -10,5 +10,6 @@ setup(
       license = "GPL V2",
       url = "https://github.com/keltonhalbert/wrftools",
       packages=['wrftools', 'wrftools.variables', 'wrftools.interp', 'wrftools.utils'],
+      scripts=['scripts/wrftools'],
       classifiers=["Development Status :: 3 - Alpha"]
       )
\ No newline at end of file
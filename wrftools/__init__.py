@@ -1,4 +1,6 @@
-import interp
-import variables
+from wrftools._lazy import lazy_module
+
 __version__ = '1.5'
-__all__ = [ 'interp', 'utils', 'variables' ]
\ No newline at end of file
+__all__ = [ 'interp', 'utils', 'variables' ]
+
+lazy_module( __name__, globals(), {}, submodules=( 'interp', 'utils', 'variables', 'derive', 'instrument', 'precision', 'pipeline' ) )
@@ -0,0 +1,4 @@
+import sys
+from wrftools.pipeline import main
+
+sys.exit( main() )
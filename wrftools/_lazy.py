@@ -0,0 +1,42 @@
+## Protected under the GPL V2 License
+
+import sys
+import importlib
+
+def lazy_module( name, namespace, members, submodules=() ):
+    '''
+    Makes the package name load its public members on first use instead
+    of when it is imported, so that importing wrftools, or one of its
+    subpackages, only imports the modules that are used.
+
+    Parameters
+    ----------
+    name - the __name__ of the package
+    namespace - the globals() of the package
+    members - a dict of each public name to the module it is defined in,
+        relative to the package
+    submodules - the modules and subpackages of the package
+
+    Python older than 3.7 cannot load module attributes lazily, so the
+    members are imported right away there.
+    '''
+    def __getattr__( attr ):
+        if attr in members:
+            value = getattr( importlib.import_module( '.' + members[ attr ], name ), attr )
+        elif attr in submodules:
+            value = importlib.import_module( '.' + attr, name )
+        else:
+            raise AttributeError( 'module %r has no attribute %r' % ( name, attr ) )
+        ## cache it, so the next lookup does not come back here
+        namespace[ attr ] = value
+        return value
+
+    def __dir__():
+        return sorted( set( namespace ) | set( members ) | set( submodules ) )
+
+    if sys.version_info < ( 3, 7 ):
+        for attr in members:
+            namespace[ attr ] = __getattr__( attr )
+    else:
+        namespace['__getattr__'] = __getattr__
+        namespace['__dir__'] = __dir__
@@ -0,0 +1,289 @@
+## Protected under the GPL V2 License
+
+import re
+import numpy
+from wrftools.utils.session import WRFSession, SessionFile
+from wrftools.utils.attributes import wrf_unstagger
+from wrftools.interp.plan import InterpPlan
+from wrftools.interp.weights import crossing_weights, apply_weights
+from wrftools.interp.vcoord import agl_heights
+from wrftools.variables.thermo import wrf_theta, wrf_temp, wrf_rh, wrf_dewp
+from wrftools.variables.vertical import wrf_pressure, wrf_height
+from wrftools.variables.winds import wrf_pv
+from wrftools.variables.other import wrf_slp_from_sfc
+from wrftools.variables.kinematics import wrf_kinematics
+from wrftools.variables.parcel import wrf_parcel, PARCEL_FIELDS
+from wrftools.variables.shear import wrf_shear
+from wrftools.instrument import timed
+
+__all__ = ['DerivePlan', 'wrf_derive', 'derived', 'DERIVED']
+
+## the registry of derived variables, keyed by output name
+DERIVED = {}
+
+## NAME@850hPa, or NAME@850,700,500hPa for several levels, and likewise
+## NAME@300,310K on isentropic surfaces and NAME@1000m above ground
+_LEVELS = re.compile( r'^(\w*)@([0-9.,]+)(hPa|K|m)$' )
+
+class Derivation( object ):
+    '''
+    One step of a DerivePlan: func is called with the values of inputs, in
+    order, and returns the value of the output, or a dict of values keyed by
+    output name if the step has several outputs. A step with no func reads
+    its output from the WRF file, as a variable or a global attribute.
+    '''
+    def __init__( self, outputs, inputs=(), func=None ):
+        self.outputs = tuple( outputs )
+        self.inputs = tuple( inputs )
+        self.func = func
+
+    def __repr__( self ):
+        return 'Derivation( %r, %r )' % ( self.outputs, self.inputs )
+
+def derived( outputs, *inputs ):
+    '''
+    Registers a function as the derivation of outputs, a name or a tuple of
+    names, from inputs, which are raw WRF variables, global attributes such
+    as DX, or other derived variables. A function with several outputs
+    returns a dict keyed by output name.
+
+    EXAMPLE:
+    @derived( 'WSPD10', 'U10', 'V10' )
+    def wspd10( U10, V10 ):
+        return numpy.hypot( U10, V10 )
+    '''
+    if isinstance( outputs, str ):
+        outputs = ( outputs, )
+    def register( func ):
+        step = Derivation( outputs, inputs, func )
+        for name in outputs:
+            DERIVED[ name ] = step
+        return func
+    return register
+
+class DerivePlan( object ):
+    '''
+    Resolves a set of requested outputs against the registry of derived
+    variables (DERIVED) into the steps that compute them, in the order they
+    must run, so that each intermediate is computed once per time step no
+    matter how many outputs need it. Each intermediate is freed as soon as
+    the last step that needs it has run. Anything that is not registered is
+    read from the WRF file, as a variable or, failing that, a global
+    attribute. A name of the form NAME@850hPa, or NAME@850,700,500hPa, is
+    NAME interpolated to those pressure levels, and every output on the same
+    levels shares one InterpPlan. Likewise NAME@300,310K is NAME on those
+    isentropic surfaces (see wrf_to_isen) and NAME@500,1000m is NAME at
+    those heights above ground (see wrf_to_height), and every output on the
+    same surfaces shares one search for them.
+
+    Parameters
+    ----------
+    outputs: The names of the outputs, e.g. [ 'RH@850hPa', 'PV', 'DEWP2', 'SLP' ]
+    log: If True, interpolate to pressure levels in log pressure.
+    registry: The registry to resolve against. Defaults to DERIVED.
+
+    EXAMPLE:
+    plan = DerivePlan( [ 'TEMP@850,500hPa', 'RH@850hPa', 'SLP', 'SBCAPE' ] )
+    for time, values in plan.iter_times( 'wrfout_d01_2014-05-20_00:00:00' ):
+        print( time, values['SBCAPE'].max() )
+    '''
+    def __init__( self, outputs, log=True, registry=None ):
+        self.outputs = list( outputs )
+        self.log = log
+        self.registry = DERIVED if registry is None else registry
+        self.steps = []
+        self._steps = {}
+        for name in self.outputs:
+            self._resolve( name, () )
+        ## how many steps, and the caller, still need each value
+        self.refs = dict( ( name, 0 ) for step in self.steps for name in step.outputs )
+        for step in self.steps:
+            for name in set( step.inputs ):
+                self.refs[ name ] += 1
+        for name in set( self.outputs ):
+            self.refs[ name ] += 1
+
+    def _resolve( self, name, path ):
+        if name in self._steps:
+            return
+        if name in path:
+            raise ValueError( 'Circular derivation: %s.' % ' -> '.join( path + ( name, ) ) )
+        step = self._step( name )
+        for inp in step.inputs:
+            self._resolve( inp, path + ( name, ) )
+        for output in step.outputs:
+            self._steps[ output ] = step
+        self.steps.append( step )
+
+    def _step( self, name ):
+        if name in self.registry:
+            return self.registry[ name ]
+        match = _LEVELS.match( name )
+        if match is None:
+            return Derivation( ( name, ) )
+        field, levels, unit = match.groups()
+        key = '@%s%s' % ( levels, unit )
+        if field == '':
+            levels = [ float( lev ) for lev in levels.split( ',' ) ]
+            if unit == 'hPa':
+                return Derivation( ( name, ), ( 'PRES', ), lambda PRES: InterpPlan( PRES, levels, log=self.log ).apply )
+            ## the crossing of each surface, from the top down for the
+            ## isentropes as in wrf_to_isen, and bound to apply_weights
+            coord, direction = ( 'THETA', 'topdown' ) if unit == 'K' else ( 'GHT_AGL', 'bottomup' )
+            def search( grid ):
+                lower, weight = crossing_weights( grid, levels, axis=1, direction=direction )[:2]
+                return lambda values: apply_weights( values, lower, weight, axis=1 )
+            return Derivation( ( name, ), ( coord, ), search )
+        return Derivation( ( name, ), ( field, key ), lambda grid, apply: apply( grid ) )
+
+    def _read( self, infile, name, time ):
+        if name in infile.variables:
+            return numpy.asarray( infile.read( name, slice( time, time + 1 ) ) )
+        if name in infile.ncattrs():
+            return infile.getncattr( name )
+        raise KeyError( '%s is neither a derived variable nor in %s.' % ( name, getattr( infile, 'filename', infile ) ) )
+
+    @timed( name='DerivePlan.compute' )
+    def compute( self, infilename, time ):
+        '''
+        Computes the outputs at one time of a WRF output file, given as a
+        filename or a file opened with WRFSession.open. Returns a dict of the
+        outputs keyed by name, each with a leading time dimension of 1.
+        '''
+        infile = self._open( infilename )
+        values = {}
+        refs = dict( self.refs )
+        for step in self.steps:
+            if step.func is None:
+                values[ step.outputs[0] ] = self._read( infile, step.outputs[0], time )
+            else:
+                result = step.func( *[ values[ name ] for name in step.inputs ] )
+                if len( step.outputs ) == 1:
+                    result = { step.outputs[0]: result }
+                for name in step.outputs:
+                    values[ name ] = result[ name ]
+                del result
+            ## free the inputs that nothing else needs, and any outputs nothing needs at all
+            for name in set( step.inputs ) | set( step.outputs ):
+                if name in step.inputs:
+                    refs[ name ] -= 1
+                if refs[ name ] <= 0:
+                    del values[ name ]
+        if infile is not infilename:
+            infile.session.close()
+        return dict( ( name, values[ name ] ) for name in self.outputs )
+
+    def iter_times( self, infilename, times=None ):
+        '''
+        Yields ( time, outputs ) for each time of a WRF output file, or only
+        the times given, where outputs is the dict returned by compute.
+        '''
+        infile = self._open( infilename )
+        try:
+            if times is None:
+                times = range( len( infile.dimensions['Time'] ) )
+            for time in times:
+                yield time, self.compute( infile, time )
+        finally:
+            if infile is not infilename:
+                infile.session.close()
+
+    def _open( self, infilename ):
+        ## a file of a private session, so that compute does not close it
+        if isinstance( infilename, SessionFile ):
+            return infilename
+        return WRFSession( max_bytes=0 ).open( infilename )
+
+@timed
+def wrf_derive( infilename, outputs, times=None, log=True ):
+    '''
+    Computes derived variables from a WRF output file with a DerivePlan, one
+    time step at a time.
+
+    Parameters
+    ----------
+    infilename: The name/path of the WRF output file to be read, or a file
+        opened with WRFSession.open
+    outputs: The names of the outputs. See DerivePlan.
+    times: The times to compute. Defaults to all of them.
+    log: If True, interpolate to pressure levels in log pressure.
+
+    Returns a dict of numpy.ndarray keyed by output name, with a leading
+    time dimension.
+    '''
+    plan = DerivePlan( outputs, log=log )
+    infile = plan._open( infilename )
+    if times is None:
+        times = range( len( infile.dimensions['Time'] ) )
+    times = list( times )
+    result = {}
+    for i, ( time, values ) in enumerate( plan.iter_times( infile, times ) ):
+        for name, value in values.items():
+            value = numpy.asarray( value )
+            if name not in result:
+                result[ name ] = numpy.empty( ( len( times ), ) + value.shape[1:], dtype=value.dtype )
+            result[ name ][ i ] = value[0]
+    if infile is not infilename:
+        infile.session.close()
+    return result
+
+## the registry. Every value carries the leading time dimension of 1 that
+## the raw variables are read with.
+
+derived( 'PRES', 'P', 'PB' )( wrf_pressure )
+derived( 'THETA', 'T' )( wrf_theta )
+derived( 'TEMP', 'THETA', 'PRES' )( wrf_temp )
+derived( 'RH', 'TEMP', 'PRES', 'QVAPOR' )( wrf_rh )
+derived( 'DEWP', 'TEMP', 'PRES', 'QVAPOR' )( wrf_dewp )
+derived( 'GHT_STAG', 'PH', 'PHB' )( wrf_height )
+
+@derived( 'GHT', 'GHT_STAG' )
+def _ght( GHT_STAG ):
+    return wrf_unstagger( GHT_STAG, 'Z' )
+
+@derived( 'GHT_AGL', 'GHT_STAG' )
+def _ght_agl( GHT_STAG ):
+    return wrf_unstagger( agl_heights( GHT_STAG ), 'Z' )
+
+@derived( 'UMASS', 'U' )
+def _umass( U ):
+    return wrf_unstagger( U, 'X' )
+
+@derived( 'VMASS', 'V' )
+def _vmass( V ):
+    return wrf_unstagger( V, 'Y' )
+
+@derived( 'WMASS', 'W' )
+def _wmass( W ):
+    return wrf_unstagger( W, 'Z' )
+
+@derived( 'PSFC_HPA', 'PSFC' )
+def _psfc_hpa( PSFC ):
+    return PSFC * .01
+
+derived( 'RH2', 'T2', 'PSFC_HPA', 'Q2' )( wrf_rh )
+derived( 'DEWP2', 'T2', 'PSFC_HPA', 'Q2' )( wrf_dewp )
+derived( 'SLP', 'T2', 'PSFC', 'HGT' )( wrf_slp_from_sfc )
+
+@derived( 'PV', 'UMASS', 'VMASS', 'F', 'THETA', 'PRES', 'MAPFAC_M', 'DX' )
+def _pv( UMASS, VMASS, F, THETA, PRES, MAPFAC_M, DX ):
+    return wrf_pv( UMASS, VMASS, F[0], THETA, PRES, MAPFAC_M[0], DX )
+
+@derived( ( 'VORT', 'ABSVORT', 'DIV', 'STRETCH', 'SHEAR' ), 'U', 'V', 'MAPFAC_U', 'MAPFAC_V', 'MAPFAC_M', 'F', 'DX', 'DY' )
+def _kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, F, DX, DY ):
+    return wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, DX, DY, F=F[0] )
+
+def _register_parcel( parcel ):
+    prefix = parcel.upper()
+    @derived( tuple( prefix + name for name in PARCEL_FIELDS ), 'TEMP', 'PRES', 'GHT_STAG', 'QVAPOR' )
+    def _parcel( TEMP, PRES, GHT_STAG, QVAPOR ):
+        values = wrf_parcel( TEMP, PRES, GHT_STAG, QVAPOR, parcel=parcel )
+        return dict( ( prefix + name, value ) for name, value in values.items() )
+
+for _kind in ( 'sb', 'ml', 'mu' ):
+    _register_parcel( _kind )
+
+@derived( ( 'UMEAN', 'VMEAN', 'URM', 'VRM', 'ULM', 'VLM', 'USHR1', 'VSHR1', 'SHR1', 'USHR6', 'VSHR6', 'SHR6',
+    'SRH1', 'SRH3' ), 'UMASS', 'VMASS', 'GHT_STAG' )
+def _shear( UMASS, VMASS, GHT_STAG ):
+    return wrf_shear( UMASS, VMASS, GHT_STAG )
@@ -0,0 +1,226 @@
+## Protected under the GPL V2 License
+
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+
+__all__ = ['Profile', 'timed', 'active']
+
+## the profile being recorded, or None when instrumentation is off
+_active = None
+
+def active():
+    '''
+    Returns the Profile being recorded, or None.
+    '''
+    return _active
+
+def _tracemalloc():
+    ## tracemalloc is only in python 3.4 and newer
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    return tracemalloc
+
+class Profile( object ):
+    '''
+    Records the wall time and peak memory allocated by each wrftools
+    function, and the bytes and time of every netCDF variable read through
+    a WRFSession or written through an NCWriter, while it is active. Use it
+    as a context manager, or set the WRFTOOLS_PROFILE environment variable
+    to a file name to profile a whole program and write the report to that
+    file when it exits ({pid} in the name is replaced by the process id).
+    When no profile is active, the instrumented functions only check one
+    global variable.
+
+    Function times are inclusive, so a function that calls another wrftools
+    function includes the time of that call. The peak memory of a function
+    is the largest amount of memory it had allocated at once, over any call,
+    measured with tracemalloc, which numpy reports its arrays to. Memory is
+    traced for the whole process, so calls on other threads, such as the
+    tiles of a parallel interpolation, count towards each other. Tracing
+    memory slows numpy code down noticeably, so it is only done if memory is
+    True, and is skipped where tracemalloc is not available.
+
+    Parameters
+    ----------
+    memory - if True, record the peak memory of each function
+
+    EXAMPLE:
+    with Profile( memory=True ) as prof:
+        process_file( 'wrfout_d01_2014-05-20_00:00:00', 'post.nc' )
+    prof.write( 'profile.json' )
+    prof.attach( 'post.nc' )
+    '''
+    def __init__( self, memory=False ):
+        self.memory = memory
+        self.functions = {}
+        self.reads = {}
+        self.writes = {}
+        self.seconds = 0.
+        self._tracemalloc = _tracemalloc() if memory else None
+        self._started_tracing = False
+        ## each thread has its own stack of calls, and they share the totals
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._previous = None
+        self._start = None
+
+    def __enter__( self ):
+        self.start()
+        return self
+
+    def __exit__( self, *args ):
+        self.stop()
+
+    def start( self ):
+        '''
+        Makes this the active profile.
+        '''
+        global _active
+        self._previous = _active
+        _active = self
+        if self._tracemalloc is not None and not self._tracemalloc.is_tracing():
+            self._tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.time()
+
+    def stop( self ):
+        '''
+        Stops recording, and makes the profile that was active before this
+        one active again.
+        '''
+        global _active
+        self.seconds += time.time() - self._start
+        _active = self._previous
+        if self._started_tracing:
+            self._tracemalloc.stop()
+            self._started_tracing = False
+
+    def _stack( self ):
+        stack = getattr( self._local, 'stack', None )
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter( self ):
+        stack = self._stack()
+        frame = [ time.time(), 0, 0 ]
+        tm = self._tracemalloc
+        if tm is not None and tm.is_tracing():
+            current, peak = tm.get_traced_memory()
+            ## the peak is reset for each call, so hand the peak so far to the caller first
+            if stack:
+                stack[-1][2] = max( stack[-1][2], peak )
+            if hasattr( tm, 'reset_peak' ):
+                tm.reset_peak()
+            frame[1] = frame[2] = current
+        stack.append( frame )
+
+    def _exit( self, name ):
+        stack = self._stack()
+        start, current, peak = stack.pop()
+        seconds = time.time() - start
+        tm = self._tracemalloc
+        with self._lock:
+            stats = self.functions.setdefault( name, { 'calls': 0, 'seconds': 0., 'max_seconds': 0., 'peak_bytes': None } )
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max( stats['max_seconds'], seconds )
+            if tm is not None and tm.is_tracing():
+                peak = max( peak, tm.get_traced_memory()[1] )
+                stats['peak_bytes'] = max( stats['peak_bytes'] or 0, peak - current )
+                if stack:
+                    stack[-1][2] = max( stack[-1][2], peak )
+
+    def _io( self, table, filename, varname, nbytes, seconds ):
+        with self._lock:
+            stats = table.setdefault( filename, {} ).setdefault( varname, { 'calls': 0, 'bytes': 0, 'seconds': 0. } )
+            stats['calls'] += 1
+            stats['bytes'] += int( nbytes )
+            stats['seconds'] += seconds
+
+    def record_read( self, filename, varname, nbytes, seconds ):
+        '''
+        Records a read of nbytes of varname from filename that took seconds.
+        '''
+        self._io( self.reads, filename, varname, nbytes, seconds )
+
+    def record_write( self, filename, varname, nbytes, seconds ):
+        '''
+        Records a write of nbytes of varname to filename that took seconds.
+        '''
+        self._io( self.writes, filename, varname, nbytes, seconds )
+
+    def report( self ):
+        '''
+        Returns the recorded statistics as a dictionary with the keys
+        seconds (the time the profile was active), functions (calls,
+        seconds, max_seconds and peak_bytes by function name), and reads and
+        writes (calls, bytes and seconds by file name and variable name).
+        '''
+        seconds = self.seconds
+        if _active is self:
+            seconds += time.time() - self._start
+        return { 'seconds': seconds, 'functions': self.functions, 'reads': self.reads, 'writes': self.writes }
+
+    def write( self, filename ):
+        '''
+        Writes the report to filename as JSON.
+        '''
+        with open( filename, 'w' ) as f:
+            json.dump( self.report(), f, indent=2, sort_keys=True )
+
+    def attach( self, outfile, name='wrftools_profile' ):
+        '''
+        Writes the report as JSON to the global attribute name of a netCDF
+        file, given as a filename or an NCWriter.
+        '''
+        report = json.dumps( self.report(), sort_keys=True )
+        dataset = getattr( outfile, 'dataset', None )
+        if dataset is not None:
+            dataset.setncattr( name, report )
+            return
+        from netCDF4 import Dataset
+        dataset = Dataset( outfile, 'a' )
+        dataset.setncattr( name, report )
+        dataset.close()
+
+def timed( func=None, name=None ):
+    '''
+    Decorates a wrftools entry point so that its calls are recorded by the
+    active Profile. Use as @timed, or as @timed( name='InterpPlan' ) to
+    record the calls under a different name.
+    '''
+    if func is None:
+        return lambda func: timed( func, name )
+    if name is None:
+        name = getattr( func, '__qualname__', func.__name__ )
+    @functools.wraps( func )
+    def wrapper( *args, **kwargs ):
+        prof = _active
+        if prof is None:
+            return func( *args, **kwargs )
+        prof._enter()
+        try:
+            return func( *args, **kwargs )
+        finally:
+            prof._exit( name )
+    return wrapper
+
+def _profile_from_environment():
+    ## WRFTOOLS_PROFILE=report.json profiles the whole program
+    filename = os.environ.get( 'WRFTOOLS_PROFILE' )
+    if not filename:
+        return
+    prof = Profile( memory=os.environ.get( 'WRFTOOLS_PROFILE_MEMORY', '' ) not in ( '', '0' ) )
+    prof.start()
+    def finish():
+        prof.write( filename.replace( '{pid}', str( os.getpid() ) ) )
+    atexit.register( finish )
+
+_profile_from_environment()
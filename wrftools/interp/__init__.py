@@ -1,4 +1,18 @@
-from pres import *
-from pv import *
+from wrftools._lazy import lazy_module
+
 __version__ = '1.5'
-__all__ = ['wrf_to_pres','wrf_to_pv']
\ No newline at end of file
+__all__ = ['wrf_to_pres','wrf_to_pv', 'pv_surfaces']
+__all__ += ['interp_weights', 'crossing_weights', 'apply_weights']
+__all__ += ['InterpPlan']
+__all__ += ['tile_indices', 'run_tiles']
+__all__ += ['vcoord_surfaces', 'wrf_to_vcoord', 'wrf_to_isen', 'wrf_to_height', 'agl_heights']
+
+lazy_module( __name__, globals(), {
+    'wrf_to_pres': 'pres',
+    'wrf_to_pv': 'pv', 'pv_surfaces': 'pv',
+    'interp_weights': 'weights', 'crossing_weights': 'weights', 'apply_weights': 'weights',
+    'InterpPlan': 'plan',
+    'tile_indices': 'parallel', 'run_tiles': 'parallel',
+    'vcoord_surfaces': 'vcoord', 'wrf_to_vcoord': 'vcoord', 'wrf_to_isen': 'vcoord', 'wrf_to_height': 'vcoord',
+    'agl_heights': 'vcoord',
+}, submodules=( 'pres', 'pv', 'weights', 'plan', 'parallel', 'vcoord' ) )
@@ -0,0 +1,54 @@
+## Protected under the GPL V2 License
+
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['tile_indices', 'run_tiles']
+
+def tile_indices( shape, ntiles ):
+    '''
+    Splits a (time, level, south_north, west_east) array into about ntiles
+    blocks of whole columns, by time and then by rows, and returns the
+    index of each block.
+
+    Parameters
+    ----------
+    shape - the shape of the array, with at least 3 dimensions
+    ntiles - the number of blocks wanted
+
+    Returns
+    -------
+    indices - a list of tuples that select each block from the array, or
+        from any array of the same shape except along the level dimension.
+    '''
+    nt, ny = shape[0], shape[-2]
+    per_time = max( 1, -( -ntiles // nt ) )
+    rows = max( 1, -( -ny // per_time ) )
+    return [ ( slice( t, t + 1 ), Ellipsis, slice( y, min( y + rows, ny ) ), slice( None ) )
+        for t in range( nt ) for y in range( 0, ny, rows ) ]
+
+def run_tiles( func, shape, workers, tiles_per_worker=4 ):
+    '''
+    Calls func( index ) for every block of tile_indices( shape ) on a pool
+    of workers threads. The blocks share the caller's arrays, so nothing is
+    copied or pickled, and func writes its block of the result into an
+    output array allocated by the caller. The numpy operations used by the
+    interpolators release the GIL, so the threads run on separate cores.
+    Each column is computed exactly as it is by the serial path, so the
+    result does not depend on the number of workers.
+
+    Parameters
+    ----------
+    func - a function of the index of one block
+    shape - the shape of the array to split
+    workers - the number of threads
+    tiles_per_worker - blocks per thread, so that the threads stay busy
+        when some blocks take longer than others
+    '''
+    indices = tile_indices( shape, workers * tiles_per_worker )
+    pool = ThreadPoolExecutor( max_workers=workers )
+    try:
+        ## list() so that an exception in any block is raised here
+        list( pool.map( func, indices ) )
+    finally:
+        pool.shutdown()
@@ -0,0 +1,128 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.interp.weights import interp_weights, apply_weights
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype
+
+__all__ = ['InterpPlan']
+
+class InterpPlan( object ):
+    '''
+    Caches the bracketing level indices and weights needed to vertically
+    interpolate from surface to interplevels, so that any number of grids
+    on the same surface can be interpolated without repeating the column
+    search. Indices are stored as int16 and weights in the wrftools
+    precision (float32 by default), one time step at a time, which keeps
+    the plan small next to the grids it is applied to. A plan built from a single time (for instance from the
+    base state pressure PB) is applied to every time of a grid, and can be
+    saved and reused by other files that share that base state.
+
+    Parameters
+    ----------
+    surface - 4D array (time, bottom_top, south_north, west_east) of the
+        vertical coordinate values of the surface to be interpolated to.
+        Must be monotonic in the vertical.
+    interplevels - 1D array of vertical coordinate values that are desired
+        to be interpolated to.
+    log - if True, interpolate linearly in the log of the vertical
+        coordinate (log-pressure).
+    dtype - the precision of the search and of the weights. Defaults to the
+        wrftools precision.
+
+    EXAMPLE:
+    plan = InterpPlan( PRES, numpy.array([ 850., 700., 500., 300. ]) )
+    TEMP_P = plan.apply( TEMP )
+    U_P, V_P = plan.apply_many( [ U, V ] )
+    '''
+    @timed( name='InterpPlan' )
+    def __init__( self, surface, interplevels, log=False, dtype=None ):
+        self.interplevels = numpy.asarray( interplevels, dtype=float )
+        self.log = log
+        self.shape = tuple( surface.shape )
+        nt, nz, ny, nx = self.shape
+        assert nz <= numpy.iinfo( numpy.int16 ).max, 'Too many vertical levels for an int16 plan.'
+        outshape = ( nt, self.interplevels.shape[0], ny, nx )
+        self.lower = numpy.empty( outshape, dtype=numpy.int16 )
+        dtype = resolve_dtype( dtype )
+        self.weight = numpy.empty( outshape, dtype=dtype )
+        ## build one time step at a time so the full precision search
+        ## arrays never exist for more than one time at once
+        for time in range( nt ):
+            lower, weight = interp_weights( surface[time], self.interplevels, axis=0, log=log, dtype=dtype )
+            self.lower[time] = lower
+            self.weight[time] = weight
+
+    def _time( self, time ):
+        ## a single time plan is shared by every time of the grid
+        if self.lower.shape[0] == 1:
+            return 0
+        return time
+
+    @timed( name='InterpPlan.apply' )
+    def apply( self, grid, out=None, dtype=None ):
+        '''
+        Interpolates a grid with the cached weights.
+
+        Parameters
+        ----------
+        grid - 4D array with the same shape as the surface the plan was built
+            from, or a 5D array of several such grids stacked along the first
+            dimension. If the plan was built from a single time, grid may have
+            any number of times.
+        out - optional array to write the result into.
+        dtype - the precision of a new output. Defaults to the wrftools
+            precision.
+
+        Returns
+        -------
+        outgrid - numpy.ndarray of shape
+            (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] ),
+            or with the extra leading dimension for a stacked grid.
+        '''
+        stacked = grid.ndim == 5
+        gshape = grid.shape[1:] if stacked else grid.shape
+        assert gshape[1:] == self.shape[1:], 'Grid does not match the shape of the plan.'
+        assert self.lower.shape[0] in ( 1, gshape[0] ), 'Grid does not match the number of times in the plan.'
+        shape = ( gshape[0], self.interplevels.shape[0] ) + gshape[2:]
+        if stacked:
+            shape = ( grid.shape[0], ) + shape
+        if out is None:
+            out = numpy.empty( shape, dtype=resolve_dtype( dtype ) )
+        for time in range( gshape[0] ):
+            idx = self._time( time )
+            if stacked:
+                apply_weights( grid[:, time], self.lower[idx][None], self.weight[idx][None],
+                    axis=1, out=out[:, time] )
+            else:
+                apply_weights( grid[time], self.lower[idx], self.weight[idx], axis=0, out=out[time] )
+        return out
+
+    def apply_many( self, grids ):
+        '''
+        Interpolates each grid in a sequence of grids with the cached weights.
+        Returns a list of numpy.ndarray in the same order.
+        '''
+        return [ self.apply( grid ) for grid in grids ]
+
+    def save( self, filename ):
+        '''
+        Saves the plan to a numpy .npz file so that it can be reused with
+        InterpPlan.load.
+        '''
+        numpy.savez_compressed( filename, lower=self.lower, weight=self.weight,
+            interplevels=self.interplevels, log=self.log, shape=numpy.array( self.shape ) )
+
+    @classmethod
+    def load( cls, filename ):
+        '''
+        Loads a plan saved with InterpPlan.save.
+        '''
+        plan = cls.__new__( cls )
+        with numpy.load( filename ) as data:
+            plan.lower = data['lower']
+            plan.weight = data['weight']
+            plan.interplevels = data['interplevels']
+            plan.log = bool( data['log'] )
+            plan.shape = tuple( int( n ) for n in data['shape'] )
+        return plan
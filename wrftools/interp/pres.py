@@ -4,43 +4,60 @@
 ## Protected under the GPL V2 License
 
 import numpy
+from wrftools.interp.weights import interp_weights, apply_weights
+from wrftools.interp.parallel import run_tiles
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype
 
-def wrf_to_pres( grid, surface, interplevels ):
+@timed
+def wrf_to_pres( grid, surface, interplevels, log=False, out=None, workers=None, dtype=None ):
     '''
-    Linearly interpolates a grid to interplevels. This uses the 
-    numpy.interp function that requires the function coordinate 
-    values to be monotonically increasing, and this function does 
-    not check for this. See numpy.interp docs for more information. 
-    Grid and surface must be the same shape.
+    Linearly interpolates a grid to interplevels. The bracketing levels
+    for every column and every target level are found in one batched
+    search over the whole (time, level, y, x) array, and the weights are
+    then applied to the whole array at once. Columns of surface may be
+    monotonically increasing or decreasing, but this function does not
+    check that they are monotonic. Grid and surface must be the same shape.
+    To interpolate several grids on the same surface, build an InterpPlan
+    once and apply it to each grid instead. With workers, the columns are
+    split into blocks that are interpolated on that many threads, which
+    gives the same result as the serial path, bit for bit.
 
     Parameters
     ----------
-    grid - 4D array of values to be interpolated onto a vertical surface.  
-        Must be monotonically increasing.
+    grid - 4D array of values to be interpolated onto a vertical surface.
     surface - 4D array of the verical coordinate values of the surface to be 
-        interpolated to. Must be monotonically increasing.
+        interpolated to. Must be monotonic in the vertical.
     interplevels - 1D array of vertical coordinate values that are desired 
         to be interpolated to.
+    log - if True, interpolate linearly in the log of the vertical
+        coordinate (log-pressure) instead of in the coordinate itself.
+    out - optional 4D array of shape
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+        to write the result into.
+    workers - the number of threads to use. None or 1 interpolates on the
+        calling thread.
+    dtype - the precision of the weights and of a new output. Defaults to
+        the wrftools precision.
 
     Returns
     -------
     outgrid - numpy.ndarray of values of shape 
-        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] ).
+        Levels outside the range of a column are NaN.
     '''
-    ## get the shape of the original grid but with the vertical dimension of
-    ## interplevels, and then allocate an empty array based on that shape.
-    shape = ( grid.shape[0], interplevels.shape[0], grid.shape[2], grid.shape[3] )
-    outgrid = numpy.empty( shape )
-    ## loop through the time dimemsion of the array
-    for time in numpy.arange( grid.shape[0] ):
-        ## loop over each gridpoint and get the vertical column
-        for idx, val in numpy.ndenumerate( grid[0][0] ):
-            ## get the column slice of pressure
-            column = surface[ time, :, idx[0], idx[1] ]
-            ## get the column slice of the value to interpolate
-            column_GRID = grid[ time, :, idx[0], idx[1] ]
-            ## interpolate a whole column of valyes and add it to the new array
-            value = numpy.interp( interplevels, column, column_GRID, left=numpy.nan, right=numpy.nan )
-            outgrid[ time, :, idx[0], idx[1] ] = value[:]
-    return outgrid
-
+    assert grid.shape == surface.shape, 'Arrays are different shapes. They must be the same shape.'
+    interplevels = numpy.asarray( interplevels )
+    dtype = resolve_dtype( dtype )
+    if workers is not None and workers > 1:
+        grid = numpy.asarray( grid )
+        surface = numpy.asarray( surface )
+        if out is None:
+            shape = ( grid.shape[0], len( interplevels ) ) + grid.shape[2:]
+            out = numpy.empty( shape, dtype=dtype )
+        def tile( index ):
+            wrf_to_pres( grid[ index ], surface[ index ], interplevels, log=log, out=out[ index ], dtype=dtype )
+        run_tiles( tile, grid.shape, workers )
+        return out
+    lower, weight = interp_weights( surface, interplevels, axis=1, log=log, dtype=dtype )
+    return apply_weights( grid, lower, weight, axis=1, out=out, dtype=dtype )
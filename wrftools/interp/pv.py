@@ -4,45 +4,90 @@
 ## Protected under the GPL V2 License
 
 import numpy
+from wrftools.interp.vcoord import vcoord_surfaces
+from wrftools.instrument import timed
 
-def wrf_to_pv( grid, surface, interplevels ):
+@timed
+def pv_surfaces( grids, surface, interplevels, direction='topdown', pres=None, pmin=None, pmax=None, workers=None,
+    dtype=None ):
+    '''
+    Linearly interpolates any number of grids to interplevels (in potential 
+    vorticity units) in one pass. The level at which each column crosses 
+    each PV surface is found for the whole grid at once, searching from 
+    the top of the column down (or the bottom up), and the same crossing 
+    is then used for every grid. The PV columns do not need to be monotonic.
+    This is vcoord_surfaces with PV as the vertical coordinate.
+    Each grid and surface must be the same shape.
+
+    Parameters
+    ----------
+    grids - a sequence of 4D arrays of values to be interpolated onto the
+        PV surfaces.
+    surface - 4D array of potential vorticity (PVU) on model levels.
+    interplevels - 1D array of PV values that are desired to be interpolated
+        to, e.g. [ 1.5, 2., 3. ].
+    direction - 'topdown' (default) to use the highest crossing of each PV 
+        surface in a column, or 'bottomup' to use the lowest.
+    pres - optional 4D array of pressure the same shape as surface. Required 
+        when pmin or pmax are given.
+    pmin - the lowest pressure at which a crossing is allowed. Levels with 
+        a lower pressure (higher in the atmosphere) are not searched.
+    pmax - the highest pressure at which a crossing is allowed. Levels with
+        a higher pressure (lower in the atmosphere) are not searched.
+    workers - the number of threads to use. The columns are split into
+        blocks that are interpolated on separate threads, which gives the
+        same result as the serial path, bit for bit. None or 1 interpolates
+        on the calling thread.
+    dtype - the precision of the weights and of the outputs. Defaults to
+        the wrftools precision.
+
+    Returns
+    -------
+    outgrids - a list of numpy.ndarray, one per grid, of shape 
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - boolean numpy.ndarray of the same shape, True where a column 
+        never crosses the PV surface. These points are NaN in outgrids.
+    '''
+    mask = None
+    if pmin is not None or pmax is not None:
+        assert pres is not None, 'pres must be given with pmin or pmax.'
+        mask = numpy.ones( surface.shape, dtype=bool )
+        if pmin is not None:
+            mask &= pres >= pmin
+        if pmax is not None:
+            mask &= pres <= pmax
+    return vcoord_surfaces( grids, surface, interplevels, direction=direction, mask=mask, workers=workers, dtype=dtype )
+
+@timed
+def wrf_to_pv( grid, surface, interplevels, direction='topdown', pres=None, pmin=None, pmax=None, return_mask=False,
+    workers=None, dtype=None ):
     '''
     Linearly interpolates a grid to interplevels (in potential 
-    vorticity units). This uses the numpy.interp function that 
-    requires the function coordinate values to be monotonically 
-    increasing, and this function does not check for this. See 
-    numpy.interp docs for more information. Grid and surface must 
-    be the same shape.
+    vorticity units). The crossing of each PV surface is searched for
+    from the top of each column down by default, so the dynamic tropopause
+    is not confused with low level PV anomalies. Columns that never cross 
+    a PV surface are NaN. See pv_surfaces to interpolate several grids 
+    with one search. Grid and surface must be the same shape.
 
     Parameters
     ----------
     grid - 4D array of values to be interpolated onto a vertical surface.  
-        Must be monotonically increasing.
-    surface - 4D array of the verical coordinate values of the surface to be 
-        interpolated to. Must be monotonically increasing.
+    surface - 4D array of potential vorticity (PVU) on model levels.
     interplevels - 1D array of vertical coordinate values that are desired 
         to be interpolated to.
+    direction, pres, pmin, pmax, workers, dtype - see pv_surfaces.
+    return_mask - if True, also return the boolean array of points that 
+        have no crossing.
 
     Returns
     -------
     outgrid - numpy.ndarray of values of shape 
         (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - only if return_mask is True. Boolean numpy.ndarray of the same 
+        shape, True where a column never crosses the PV surface.
     '''
-    shape = ( grid.shape[0], interplevels.shape[0], grid.shape[2], grid.shape[3] )
-    outgrid = numpy.ones( shape )
-    for time in numpy.arange( grid.shape[0] ):
-        for idx, val in numpy.ndenumerate( grid[0][0] ):
-            column = surface[ time, :, idx[0], idx[1] ]
-            column_GRID = grid[ time, :, idx[0], idx[1] ]
-            pvidx = numpy.where( column < interplevels[0] )[0]
-            if len( pvidx ) == 0:
-                pvidx = numpy.where( column < interplevels[1] ) [0]
-            else:
-                pvidx = pvidx
-            try:
-                value = numpy.interp( interplevels, column[ pvidx[-1] : ], column_GRID[ pvidx[-1] : ], left=numpy.nan, right=numpy.nan )
-                outgrid[ time, :, idx[0], idx[1] ] = value[:]
-            except:
-                value = numpy.interp( interplevels, column, column_GRID, left=numpy.nan, right=numpy.nan )
-                outgrid[ time, :, idx[0], idx[1] ] = value[:]
-    return outgrid
+    outgrids, nocross = pv_surfaces( [ grid ], surface, interplevels, direction=direction,
+        pres=pres, pmin=pmin, pmax=pmax, workers=workers, dtype=dtype )
+    if return_mask:
+        return outgrids[0], nocross
+    return outgrids[0]
@@ -0,0 +1,199 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.interp.weights import crossing_weights, apply_weights
+from wrftools.interp.parallel import run_tiles
+from wrftools.precision import resolve_dtype
+from wrftools.instrument import timed
+
+__all__ = ['vcoord_surfaces', 'wrf_to_vcoord', 'wrf_to_isen', 'wrf_to_height', 'agl_heights']
+
+@timed
+def vcoord_surfaces( grids, coord, interplevels, direction='topdown', log=False, mask=None, workers=None, dtype=None ):
+    '''
+    Linearly interpolates any number of grids to interplevels of any
+    vertical coordinate, such as potential temperature or height. The
+    coordinate does not need to be monotonic: where a column crosses a
+    target level more than once, as potential temperature does in a
+    superadiabatic layer, the first crossing found searching from the top
+    of the column down (or the bottom up) is used. The crossings are found
+    for the whole grid at once (see crossing_weights), and the same
+    crossing is used for every grid. A coordinate on the staggered vertical
+    levels, such as the output of wrf_height, is averaged to the mass
+    levels first, and so is a mask on the staggered levels, where a mass
+    level is searched only if the levels above and below it both are. The
+    mass levels are the fewest levels of the grids, the mask, and the
+    coordinate, so with no grids and no mask the coordinate is used on the
+    levels it is given on. Each grid must be on the mass levels, with the
+    shape of the coordinate on them.
+
+    Parameters
+    ----------
+    grids - a sequence of 4D arrays of values to be interpolated.
+    coord - 4D array of the vertical coordinate on the mass or staggered
+        levels, e.g. from wrf_theta or wrf_height.
+    interplevels - 1D array of coordinate values that are desired to be
+        interpolated to.
+    direction - 'topdown' (default) to use the highest crossing of each
+        level in a column, or 'bottomup' to use the lowest.
+    log - if True, interpolate linearly in the log of the coordinate.
+    mask - optional boolean array on the mass or staggered levels. Only
+        pairs of levels that are both True are searched for a crossing.
+    workers - the number of threads to use. The columns are split into
+        blocks that are interpolated on separate threads, which gives the
+        same result as the serial path, bit for bit. None or 1 interpolates
+        on the calling thread.
+    dtype - the precision of the weights and of the outputs. Defaults to
+        the wrftools precision.
+
+    Returns
+    -------
+    outgrids - a list of numpy.ndarray, one per grid, of shape
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - boolean numpy.ndarray of the same shape, True where a column
+        never crosses the level. These points are NaN in outgrids.
+    '''
+    interplevels = numpy.asarray( interplevels )
+    dtype = resolve_dtype( dtype )
+    coord = numpy.asarray( coord, dtype=dtype )
+    if mask is not None:
+        mask = numpy.asarray( mask, dtype=bool )
+    nz = min( [ grid.shape[1] for grid in grids ] + [ arr.shape[1] for arr in ( coord, mask ) if arr is not None ] )
+    if coord.shape[1] == nz + 1:
+        coord = ( coord[:, :-1] + coord[:, 1:] ) / 2.
+    if mask is not None and mask.shape[1] == nz + 1:
+        mask = mask[:, :-1] & mask[:, 1:]
+    if workers is not None and workers > 1:
+        grids = [ numpy.asarray( grid ) for grid in grids ]
+        shape = ( coord.shape[0], len( interplevels ) ) + coord.shape[2:]
+        outgrids = [ numpy.empty( shape, dtype=dtype ) for grid in grids ]
+        nocross = numpy.empty( shape, dtype=bool )
+        def tile( index ):
+            tiled, tilemask = vcoord_surfaces( [ grid[ index ] for grid in grids ], coord[ index ], interplevels,
+                direction=direction, log=log, mask=None if mask is None else mask[ index ], dtype=dtype )
+            for outgrid, result in zip( outgrids, tiled ):
+                outgrid[ index ] = result
+            nocross[ index ] = tilemask
+        run_tiles( tile, coord.shape, workers )
+        return outgrids, nocross
+    lower, weight, nocross = crossing_weights( coord, interplevels, axis=1, direction=direction,
+        mask=mask, log=log, dtype=dtype )
+    outgrids = []
+    for grid in grids:
+        assert grid.shape == coord.shape, 'Arrays are different shapes. They must be the same shape.'
+        outgrids.append( apply_weights( grid, lower, weight, axis=1, dtype=dtype ) )
+    return outgrids, nocross
+
+@timed
+def wrf_to_vcoord( grid, coord, interplevels, direction='topdown', log=False, mask=None, return_mask=False,
+    workers=None, dtype=None ):
+    '''
+    Linearly interpolates a grid to interplevels of the vertical coordinate
+    coord. See vcoord_surfaces to interpolate several grids with one search.
+
+    Parameters
+    ----------
+    grid - 4D array of values to be interpolated onto the coordinate levels.
+    coord - 4D array of the vertical coordinate on the mass or staggered levels.
+    interplevels - 1D array of coordinate values that are desired to be
+        interpolated to.
+    direction, log, mask, workers, dtype - see vcoord_surfaces.
+    return_mask - if True, also return the boolean array of points that
+        have no crossing.
+
+    Returns
+    -------
+    outgrid - numpy.ndarray of values of shape
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - only if return_mask is True. Boolean numpy.ndarray of the same
+        shape, True where a column never crosses the level.
+    '''
+    outgrids, nocross = vcoord_surfaces( [ grid ], coord, interplevels, direction=direction, log=log, mask=mask,
+        workers=workers, dtype=dtype )
+    if return_mask:
+        return outgrids[0], nocross
+    return outgrids[0]
+
+@timed
+def wrf_to_isen( grid, THETA, interplevels, direction='topdown', log=False, mask=None, return_mask=False,
+    workers=None, dtype=None ):
+    '''
+    Linearly interpolates a grid to isentropic surfaces. The crossing of
+    each surface is searched for from the top of each column down by
+    default, so a surface that is crossed more than once in a superadiabatic
+    layer near the ground is placed at its highest crossing. Columns that
+    never cross a surface, where it is below the ground or above the model
+    top, are NaN.
+
+    Parameters
+    ----------
+    grid - 4D array of values to be interpolated onto the isentropic surfaces.
+    THETA - 4D array of potential temperature (K) from wrf_theta.
+    interplevels - 1D array of potential temperatures (K) that are desired
+        to be interpolated to, e.g. numpy.arange( 290., 335., 5. ).
+    direction, log, mask, return_mask, workers, dtype - see wrf_to_vcoord.
+        With log, the interpolation is linear in log potential temperature.
+
+    Returns
+    -------
+    outgrid - numpy.ndarray of values of shape
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - only if return_mask is True.
+    '''
+    return wrf_to_vcoord( grid, THETA, interplevels, direction=direction, log=log, mask=mask,
+        return_mask=return_mask, workers=workers, dtype=dtype )
+
+@timed
+def agl_heights( HGT, TER=None, dtype=None ):
+    '''
+    Returns the heights above ground level of HGT, on the levels HGT is on.
+
+    Parameters
+    ----------
+    HGT - 4D array of geopotential height (m) from wrf_height, on the
+        staggered or the mass levels.
+    TER - the terrain height (m), of shape (time, south_north, west_east) or
+        (south_north, west_east). Defaults to the lowest level of HGT, which
+        is the ground when HGT is on the staggered levels.
+    dtype - the precision of the result. Defaults to the wrftools precision.
+    '''
+    dtype = resolve_dtype( dtype )
+    HGT = numpy.asarray( HGT, dtype=dtype )
+    if TER is None:
+        TER = HGT[..., 0, :, :]
+    TER = numpy.asarray( TER, dtype=dtype )
+    return HGT - TER[..., None, :, :]
+
+@timed
+def wrf_to_height( grid, HGT, interplevels, TER=None, agl=True, direction='bottomup', log=False, return_mask=False,
+    workers=None, dtype=None ):
+    '''
+    Linearly interpolates a grid to heights above ground level, or above
+    sea level. Heights below the lowest mass level or above the highest one
+    are NaN.
+
+    Parameters
+    ----------
+    grid - 4D array of values to be interpolated onto the heights.
+    HGT - 4D array of geopotential height (m) from wrf_height, on the
+        staggered or the mass levels.
+    interplevels - 1D array of heights (m) that are desired to be
+        interpolated to, e.g. [ 500., 1000., 3000. ].
+    TER - the terrain height (m). Only needed for heights above ground when
+        HGT is on the mass levels. See agl_heights.
+    agl - if True (default), interplevels are heights above ground level.
+        Otherwise they are heights above sea level.
+    direction, log, return_mask, workers, dtype - see wrf_to_vcoord.
+        Height increases up every column, so the direction only matters
+        where the heights do not.
+
+    Returns
+    -------
+    outgrid - numpy.ndarray of values of shape
+        (grid.shape[0], len( interplevels ), grid.shape[2], grid.shape[3] )
+    nocross - only if return_mask is True.
+    '''
+    if agl:
+        HGT = agl_heights( HGT, TER, dtype=dtype )
+    return wrf_to_vcoord( grid, HGT, interplevels, direction=direction, log=log, return_mask=return_mask,
+        workers=workers, dtype=dtype )
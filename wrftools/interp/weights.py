@@ -0,0 +1,184 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype
+
+__all__ = ['interp_weights', 'crossing_weights', 'apply_weights']
+
+@timed
+def interp_weights( surface, interplevels, axis=1, log=False, dtype=None ):
+    '''
+    Finds the pair of vertical levels that bracket each of interplevels
+    for every column of surface at once, along with the linear weight
+    between them. Columns may increase or decrease with height, but each
+    column must be monotonic. The search is done one model level at a
+    time over the whole array, so there is no per-column Python loop.
+
+    Parameters
+    ----------
+    surface - ND array of the vertical coordinate values of the surface to be
+        interpolated to. The vertical dimension is given by axis.
+    interplevels - 1D array of vertical coordinate values that are desired
+        to be interpolated to.
+    axis - the vertical dimension of surface. Defaults to 1, the bottom_top
+        dimension of a (time, bottom_top, south_north, west_east) grid.
+    log - if True, the weights are computed in the natural log of the
+        coordinate (for log-pressure interpolation).
+    dtype - the precision of the search and of the weights. Defaults to the
+        wrftools precision.
+
+    Returns
+    -------
+    lower - integer array shaped like surface but with len( interplevels )
+        along axis. The index of the level on the near side of each target.
+    weight - float array of the same shape giving the fractional distance
+        from level lower to level lower + 1. Targets outside the range of a
+        column have a weight of NaN, which propagates into apply_weights.
+    '''
+    dtype = resolve_dtype( dtype )
+    interplevels = numpy.asarray( interplevels, dtype=dtype )
+    coord = numpy.moveaxis( numpy.asarray( surface, dtype=dtype ), axis, 0 )
+    if log:
+        coord = numpy.log( coord )
+        interplevels = numpy.log( interplevels )
+    nz = coord.shape[0]
+    ## target levels broadcast against one model level of the grid
+    levs = interplevels.reshape( (-1,) + (1,) * ( coord.ndim - 1 ) )
+    shape = ( interplevels.shape[0], ) + coord.shape[1:]
+
+    ## count the model levels on the near side of each target level. For
+    ## monotonic columns this is the same answer as a binary search.
+    desc = coord[-1] < coord[0]
+    count = numpy.zeros( shape, dtype=numpy.intp )
+    for k in range( nz ):
+        if not desc.any():
+            below = coord[k] <= levs
+        elif desc.all():
+            below = coord[k] >= levs
+        else:
+            below = numpy.where( desc, coord[k] >= levs, coord[k] <= levs )
+        count += below
+
+    ## the bracketing pair is ( lower, lower + 1 ). Clipping keeps targets
+    ## equal to the first or last level on the end pair of the column.
+    lower = numpy.clip( count - 1, 0, nz - 2, out=count )
+    x0 = numpy.take_along_axis( coord, lower, axis=0 )
+    x1 = numpy.take_along_axis( coord, lower + 1, axis=0 )
+    with numpy.errstate( divide='ignore', invalid='ignore' ):
+        weight = ( levs - x0 ) / ( x1 - x0 )
+    weight[ x1 == x0 ] = 0.
+    ## anything not between the first and last level of the column is NaN,
+    ## as is anything in a column containing NaN at either end
+    valid = ( levs - coord[0] ) * ( levs - coord[-1] ) <= 0
+    weight[ ~valid ] = numpy.nan
+    return numpy.moveaxis( lower, 0, axis ), numpy.moveaxis( weight, 0, axis )
+
+@timed
+def crossing_weights( surface, interplevels, axis=1, direction='topdown', mask=None, log=False, dtype=None ):
+    '''
+    Finds where each column of surface crosses each of interplevels and
+    returns the bracketing indices and weights of that crossing. Unlike
+    interp_weights, the columns do not need to be monotonic: when a column
+    crosses a target level more than once, the first crossing found when
+    searching in the given direction is used. Level 0 is taken to be the
+    bottom of the column, as in WRF output. All columns are searched at
+    once, one pair of model levels at a time.
+
+    Parameters
+    ----------
+    surface - ND array of the vertical coordinate values of the surface to be
+        interpolated to (e.g. potential vorticity in PVU).
+    interplevels - 1D array of vertical coordinate values that are desired
+        to be interpolated to.
+    axis - the vertical dimension of surface. Defaults to 1.
+    direction - 'topdown' to use the highest crossing in each column, or
+        'bottomup' to use the lowest.
+    mask - optional boolean array the same shape as surface. Only pairs of
+        levels that are both True are searched for a crossing.
+    log - if True, the weights are computed in the natural log of the
+        coordinate.
+    dtype - the precision of the search and of the weights. Defaults to the
+        wrftools precision.
+
+    Returns
+    -------
+    lower - integer array shaped like surface but with len( interplevels )
+        along axis. The index of the lower level of the crossing pair.
+    weight - float array of the same shape giving the fractional distance
+        from level lower to level lower + 1. NaN where there is no crossing.
+    nocross - boolean array of the same shape, True for the columns and
+        target levels where no crossing was found.
+    '''
+    if direction not in ( 'topdown', 'bottomup' ):
+        raise ValueError( "direction must be 'topdown' or 'bottomup'" )
+    dtype = resolve_dtype( dtype )
+    interplevels = numpy.asarray( interplevels, dtype=dtype )
+    coord = numpy.moveaxis( numpy.asarray( surface, dtype=dtype ), axis, 0 )
+    if mask is not None:
+        mask = numpy.moveaxis( numpy.asarray( mask, dtype=bool ), axis, 0 )
+    if log:
+        coord = numpy.log( coord )
+        interplevels = numpy.log( interplevels )
+    nz = coord.shape[0]
+    levs = interplevels.reshape( (-1,) + (1,) * ( coord.ndim - 1 ) )
+    shape = ( interplevels.shape[0], ) + coord.shape[1:]
+
+    lower = numpy.zeros( shape, dtype=numpy.intp )
+    found = numpy.zeros( shape, dtype=bool )
+    if direction == 'topdown':
+        pairs = range( nz - 2, -1, -1 )
+    else:
+        pairs = range( nz - 1 )
+    for k in pairs:
+        ## the target lies between levels k and k+1 when they are on
+        ## opposite sides of it (or one of them is equal to it)
+        cross = ( coord[k] - levs ) * ( coord[k+1] - levs ) <= 0
+        if mask is not None:
+            cross &= mask[k] & mask[k+1]
+        cross &= ~found
+        numpy.putmask( lower, cross, k )
+        found |= cross
+
+    x0 = numpy.take_along_axis( coord, lower, axis=0 )
+    x1 = numpy.take_along_axis( coord, lower + 1, axis=0 )
+    with numpy.errstate( divide='ignore', invalid='ignore' ):
+        weight = ( levs - x0 ) / ( x1 - x0 )
+    weight[ x1 == x0 ] = 0.
+    weight[ ~found ] = numpy.nan
+    return ( numpy.moveaxis( lower, 0, axis ), numpy.moveaxis( weight, 0, axis ),
+        numpy.moveaxis( ~found, 0, axis ) )
+
+@timed
+def apply_weights( grid, lower, weight, axis=1, out=None, dtype=None ):
+    '''
+    Applies the bracketing indices and weights from interp_weights to a
+    grid of the same shape as the surface they were computed from.
+
+    Parameters
+    ----------
+    grid - ND array of values to be interpolated onto a vertical surface.
+    lower - integer array of level indices returned by interp_weights.
+    weight - float array of weights returned by interp_weights.
+    axis - the vertical dimension of grid, lower, and weight.
+    out - optional array to write the result into. Must have the shape
+        of lower.
+    dtype - the precision of a new output. Defaults to the wrftools precision.
+
+    Returns
+    -------
+    out - numpy.ndarray of interpolated values, NaN wherever weight is NaN.
+    '''
+    grid = numpy.asarray( grid )
+    if out is None:
+        out = numpy.empty( lower.shape, dtype=resolve_dtype( dtype ) )
+    g = numpy.moveaxis( grid, axis, 0 )
+    lo = numpy.moveaxis( lower, axis, 0 )
+    w = numpy.moveaxis( weight, axis, 0 )
+    g0 = numpy.take_along_axis( g, lo, axis=0 )
+    g1 = numpy.take_along_axis( g, lo + 1, axis=0 )
+    ## g0 + w * ( g1 - g0 ), carried out in the precision of the output
+    delta = numpy.subtract( g1, g0, dtype=out.dtype )
+    numpy.multiply( delta, w, out=delta )
+    numpy.add( g0, delta, out=numpy.moveaxis( out, axis, 0 ) )
+    return out
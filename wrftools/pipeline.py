@@ -0,0 +1,206 @@
+## Protected under the GPL V2 License
+
+import os
+import sys
+import glob
+import argparse
+import multiprocessing
+
+from wrftools.utils.session import WRFSession
+from wrftools.utils.writer import NCWriter
+from wrftools.utils.store import DerivedStore
+from wrftools.utils.attributes import wrf_copy_attributes, wrf_copy_static_fields
+from wrftools.utils.attributes import wrf_copy_sfc_fields, wrf_copy_pres_fields, wrf_append_start, PRES_FIELDS
+from wrftools.instrument import timed, Profile
+
+__all__ = ['run_pipeline', 'process_file', 'main']
+
+DEFAULT_FIELDS = [ 'static', 'sfc', 'TEMP', 'RH', 'GHT', 'U', 'V' ]
+DEFAULT_LEVELS = [ 1000., 925., 850., 700., 500., 300., 250., 200. ]
+
+@timed
+def process_file( infilename, outfilename, fields=DEFAULT_FIELDS, levels=DEFAULT_LEVELS, chunk=1, writer=None, store=None,
+    profile=False, append=False ):
+    '''
+    Post-processes a single WRF output file. The output is written to a
+    temporary file next to outfilename and renamed into place only once
+    it is complete, so outfilename either does not exist or is whole.
+    With append, an existing output is instead extended in place with the
+    times it does not have yet, for runs that WRF is still writing.
+
+    Parameters
+    ----------
+    infilename: The name/path of the WRF output file to be read
+    outfilename: The name/path of the output file to be written
+    fields: 'static' for wrf_copy_static_fields, 'sfc' for
+        wrf_copy_sfc_fields, and any of the pressure level fields accepted
+        by wrf_copy_pres_fields.
+    levels: The pressure levels (hPa) for the pressure level fields.
+    chunk: The number of time steps of surface fields processed at once.
+    writer: A dict of NCWriter options for the output file.
+    store: The directory of a DerivedStore to take the pressure level
+        fields from, and to keep them in for later runs and other tools.
+    profile: If True, profile the file with a Profile that traces memory,
+        which slows the processing down, write the report to
+        outfilename + '.profile.json', and add it to the output file as the
+        global attribute wrftools_profile.
+    append: If True and outfilename exists, only process the times after
+        those already in it (see wrf_append_start), and leave its static
+        fields and earlier times as they are. Needs the 'static' field,
+        whose XTIME is written last to record the times that are done.
+
+    Returns the NCWriter stats of the output file.
+    '''
+    for name in fields:
+        assert name in ( 'static', 'sfc' ) + PRES_FIELDS, 'Unknown field %s.' % name
+    assert not append or 'static' in fields, "append needs the 'static' field."
+    partname = outfilename + '.part'
+    start = 0
+    inplace = append and os.path.exists( outfilename )
+    if inplace:
+        start = wrf_append_start( infilename, outfilename )
+        partname = outfilename
+    prof = Profile( memory=True ) if profile else None
+    if prof is not None:
+        prof.start()
+    try:
+        with WRFSession() as session:
+            infile = session.open( infilename )
+            with NCWriter( partname, 'a' if inplace else 'w', **( writer or {} ) ) as outfile:
+                wrf_copy_attributes( infile, outfile, len( levels ) )
+                if 'sfc' in fields:
+                    wrf_copy_sfc_fields( infile, outfile, chunk=chunk, start=start )
+                pres = [ name for name in fields if name in PRES_FIELDS ]
+                if pres:
+                    if store is not None:
+                        wrf_copy_pres_fields( infile, outfile, pres, levels, store=DerivedStore( store ), start=start )
+                    else:
+                        wrf_copy_pres_fields( infile, outfile, pres, levels, start=start )
+                ## last, so that XTIME only covers the times that are complete
+                if 'static' in fields:
+                    wrf_copy_static_fields( infile, outfile, start=start )
+    finally:
+        if prof is not None:
+            prof.stop()
+    stats = outfile.stats()
+    if prof is not None:
+        prof.attach( partname )
+        prof.write( outfilename + '.profile.json' )
+    if not inplace:
+        os.rename( partname, outfilename )
+    return stats
+
+def _worker( task ):
+    ## runs in the pool, so report failures instead of raising them
+    infilename, outfilename, fields, levels, chunk, writer, store, profile, append = task
+    try:
+        process_file( infilename, outfilename, fields, levels, chunk, writer, store, profile, append )
+    except Exception as err:
+        if os.path.exists( outfilename + '.part' ):
+            os.remove( outfilename + '.part' )
+        return infilename, outfilename, 'failed: %s' % err
+    return infilename, outfilename, 'done'
+
+@timed
+def run_pipeline( patterns, outdir, fields=DEFAULT_FIELDS, levels=DEFAULT_LEVELS, workers=None,
+    suffix='_post.nc', chunk=1, overwrite=False, writer=None, store=None, profile=False, append=False ):
+    '''
+    Post-processes every WRF output file matching patterns, spreading the
+    files across a pool of worker processes. Outputs that already exist
+    are skipped unless overwrite is True, so a run that crashed can be
+    resumed by running it again.
+
+    Parameters
+    ----------
+    patterns: A glob pattern, or a list of glob patterns, of WRF output files
+    outdir: The directory to write the outputs to. Each output is named
+        after its input file with suffix appended.
+    fields: See process_file.
+    levels: The pressure levels (hPa) for the pressure level fields.
+    workers: The number of worker processes. Defaults to the number of CPUs.
+        With 1 worker the files are processed in this process.
+    suffix: The suffix appended to the input file name to name the output.
+    chunk: The number of time steps of surface fields processed at once.
+    overwrite: If True, reprocess files whose output already exists.
+    writer: A dict of NCWriter options for the output files.
+    store: The directory of a DerivedStore shared by every file. See process_file.
+    profile: If True, write a profile of each file. See process_file.
+    append: If True, extend existing outputs with the times they do not
+        have yet instead of skipping them. See process_file.
+
+    Returns
+    -------
+    results - a list of ( infilename, outfilename, status ) tuples, where
+        status is 'done', 'skipped', or 'failed: <reason>'.
+    '''
+    if isinstance( patterns, str ):
+        patterns = [ patterns ]
+    infilenames = sorted( set( name for pattern in patterns for name in glob.glob( pattern ) ) )
+    if not os.path.isdir( outdir ):
+        os.makedirs( outdir )
+    results = []
+    tasks = []
+    for infilename in infilenames:
+        outfilename = os.path.join( outdir, os.path.basename( infilename ) + suffix )
+        if os.path.exists( outfilename ) and not overwrite and not append:
+            results.append( ( infilename, outfilename, 'skipped' ) )
+        else:
+            tasks.append( ( infilename, outfilename, list( fields ), list( levels ), chunk, writer, store, profile,
+                append and not overwrite ) )
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max( 1, min( workers, len( tasks ) ) )
+    if workers == 1:
+        results.extend( _worker( task ) for task in tasks )
+    else:
+        pool = multiprocessing.Pool( workers )
+        try:
+            results.extend( pool.imap_unordered( _worker, tasks ) )
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+def main( argv=None ):
+    '''
+    Command line entry point. Run with --help for the options.
+    '''
+    parser = argparse.ArgumentParser( prog='wrftools',
+        description='Post-process WRF output files in parallel.' )
+    parser.add_argument( 'patterns', nargs='+', help='glob patterns of WRF output files' )
+    parser.add_argument( '-o', '--outdir', default='.', help='directory to write the outputs to' )
+    parser.add_argument( '-f', '--fields', nargs='+', default=DEFAULT_FIELDS,
+        help='fields to write: static, sfc, and any of %s (DEWP on pressure levels is written as DEWP_P)' % ', '.join( PRES_FIELDS ) )
+    parser.add_argument( '-l', '--levels', nargs='+', type=float, default=DEFAULT_LEVELS,
+        help='pressure levels in hPa' )
+    parser.add_argument( '-j', '--workers', type=int, default=None,
+        help='number of worker processes (default: number of CPUs)' )
+    parser.add_argument( '--suffix', default='_post.nc', help='suffix of the output file names' )
+    parser.add_argument( '--chunk', type=int, default=1,
+        help='number of time steps of surface fields processed at once' )
+    parser.add_argument( '--overwrite', action='store_true', help='reprocess existing outputs' )
+    parser.add_argument( '--chunking', choices=( 'time', 'column' ), default='time',
+        help='chunk the outputs for reading by time step or by column (default: time)' )
+    parser.add_argument( '--complevel', type=int, default=1,
+        help='zlib compression level, 0 for no compression (default: 1)' )
+    parser.add_argument( '--significant-digits', type=int, default=None,
+        help='quantize the outputs to this many significant digits (lossy)' )
+    parser.add_argument( '--store', default=None,
+        help='directory of a derived field store to reuse pressure level fields from' )
+    parser.add_argument( '--append', action='store_true',
+        help='add the new times of runs that are still being written to their existing outputs' )
+    parser.add_argument( '--profile', action='store_true',
+        help='write the time, I/O, and memory of each output to <output>.profile.json and its attributes' )
+    args = parser.parse_args( argv )
+
+    writer = { 'chunking': args.chunking, 'zlib': args.complevel > 0, 'complevel': max( args.complevel, 1 ),
+        'significant_digits': args.significant_digits }
+    results = run_pipeline( args.patterns, args.outdir, fields=args.fields, levels=args.levels,
+        workers=args.workers, suffix=args.suffix, chunk=args.chunk, overwrite=args.overwrite, writer=writer,
+        store=args.store, profile=args.profile, append=args.append )
+    failed = 0
+    for infilename, outfilename, status in results:
+        sys.stdout.write( '%s -> %s: %s\n' % ( infilename, outfilename, status ) )
+        if status.startswith( 'failed' ):
+            failed += 1
+    return 1 if failed else 0
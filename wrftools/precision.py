@@ -0,0 +1,83 @@
+## Protected under the GPL V2 License
+
+import os
+import numpy
+
+__all__ = ['get_dtype', 'set_dtype', 'precision', 'resolve_dtype', 'as_dtype']
+
+def _float_dtype( dtype ):
+    dtype = numpy.dtype( dtype )
+    if dtype not in ( numpy.dtype( numpy.float32 ), numpy.dtype( numpy.float64 ) ):
+        raise ValueError( 'The wrftools precision must be float32 or float64, not %s.' % dtype )
+    return dtype
+
+## the precision of every wrftools computation that is not given a dtype
+_dtype = _float_dtype( os.environ.get( 'WRFTOOLS_DTYPE', 'float32' ) )
+
+def get_dtype():
+    '''
+    Returns the precision wrftools computes in when a function is not given
+    a dtype.
+    '''
+    return _dtype
+
+def set_dtype( dtype ):
+    '''
+    Sets the precision of every wrftools computation that is not given a
+    dtype, and returns the one it replaces.
+
+    wrftools computes in float32 by default, which is the precision WRF
+    writes its output in and the precision wrftools writes its own output
+    in, so the thermodynamic, kinematic, vertical and interpolated fields
+    are float32 from the raw variables to the output file, whatever the
+    precision of the arrays or constants they are computed from. float64
+    is there to validate the float32 results against. The default can also
+    be set with the WRFTOOLS_DTYPE environment variable.
+
+    Parameters
+    ----------
+    dtype - numpy.float32 or numpy.float64, or their names
+    '''
+    global _dtype
+    previous = _dtype
+    _dtype = _float_dtype( dtype )
+    return previous
+
+class precision( object ):
+    '''
+    Sets the wrftools precision for the duration of a with block. The
+    setting is shared by every thread, including the worker threads of a
+    parallel interpolation.
+
+    EXAMPLE:
+    with precision( numpy.float64 ):
+        PRES64 = wrf_pressure( P, PB )
+    '''
+    def __init__( self, dtype ):
+        self.dtype = _float_dtype( dtype )
+        self._previous = None
+
+    def __enter__( self ):
+        self._previous = set_dtype( self.dtype )
+        return self.dtype
+
+    def __exit__( self, *args ):
+        set_dtype( self._previous )
+
+def resolve_dtype( dtype=None ):
+    '''
+    Returns the numpy.dtype of the dtype argument of a wrftools function,
+    which is the package precision when it is None.
+    '''
+    if dtype is None:
+        return _dtype
+    return _float_dtype( dtype )
+
+def as_dtype( value, dtype ):
+    '''
+    Returns an array, or a scalar, in dtype, without a copy if it already
+    is. Masked arrays stay masked.
+    '''
+    if numpy.ndim( value ) == 0 and not isinstance( value, numpy.ndarray ):
+        return dtype.type( value )
+    return numpy.asanyarray( value ).astype( dtype, copy=False )
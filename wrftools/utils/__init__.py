@@ -1,12 +1,31 @@
-from attributes import *
-from conversions import *
-from mpas import *
-from grid import *
+from wrftools._lazy import lazy_module
 
 __version__ = '1.5'
 __all__ = ['ft_to_m', 'm_to_ft', 'k_to_c', 'c_to_k', 'c_to_f']
 __all__ += ['f_to_c', 'k_to_f', 'f_to_k', 'ms_to_mh', 'mh_to_ms']
 __all__ += ['mh_to_kts', 'kts_to_mh', 'ms_to_kts', 'kts_to_ms']
 __all__ += ['wrf_copy_attributes', 'wrf_copy_sfc_fields']
-__all__ += ['wrf_copy_static_fields', 'wrf_unstagger']
-__all__ += ['find_cells', 'distSphere', 'xy_to_gridpoint']
+__all__ += ['wrf_copy_static_fields', 'wrf_copy_pres_fields', 'wrf_unstagger', 'wrf_append_start']
+__all__ += ['find_cells', 'CellIndex', 'distSphere', 'xy_to_gridpoint', 'StationIndex']
+__all__ += ['WRFSession', 'open_input']
+__all__ += ['MPASRemapper', 'remap_key']
+__all__ += ['NCWriter', 'open_output', 'chunk_shape']
+__all__ += ['DerivedStore', 'STORE_FIELDS']
+__all__ += ['tile_slices', 'read_tile', 'wrf_tiled_fields', 'TILED_FIELDS']
+
+_members = dict( ( name, 'conversions' ) for name in ( 'ft_to_m', 'm_to_ft', 'k_to_c', 'c_to_k', 'c_to_f',
+    'f_to_c', 'k_to_f', 'f_to_k', 'ms_to_mh', 'mh_to_ms', 'mh_to_kts', 'kts_to_mh', 'ms_to_kts', 'kts_to_ms' ) )
+_members.update( {
+    'wrf_copy_attributes': 'attributes', 'wrf_copy_sfc_fields': 'attributes',
+    'wrf_copy_static_fields': 'attributes', 'wrf_copy_pres_fields': 'attributes', 'wrf_unstagger': 'attributes',
+    'wrf_append_start': 'attributes',
+    'find_cells': 'mpas', 'CellIndex': 'mpas', 'distSphere': 'mpas',
+    'xy_to_gridpoint': 'grid', 'StationIndex': 'grid',
+    'WRFSession': 'session', 'open_input': 'session',
+    'MPASRemapper': 'remap', 'remap_key': 'remap',
+    'NCWriter': 'writer', 'open_output': 'writer', 'chunk_shape': 'writer',
+    'DerivedStore': 'store', 'STORE_FIELDS': 'store',
+    'tile_slices': 'tiling', 'read_tile': 'tiling', 'wrf_tiled_fields': 'tiling', 'TILED_FIELDS': 'tiling',
+} )
+lazy_module( __name__, globals(), _members,
+    submodules=( 'attributes', 'conversions', 'mpas', 'grid', 'session', 'remap', 'writer', 'store', 'tiling' ) )
@@ -3,13 +3,19 @@
 ## http://tempestchasing.com
 ## Protected under the GPL V2 License
 
-from wrftools.variables import *
-from wrftools.utils import *
-from wrftools.interp import *
-from netCDF4 import Dataset
+import os
+from wrftools.variables.thermo import wrf_thermo, wrf_rh, wrf_dewp
+from wrftools.variables.vertical import wrf_height
+from wrftools.variables.other import wrf_slp_from_sfc
+from wrftools.utils.session import open_input
+from wrftools.utils.writer import open_output, NCWriter
+from wrftools.interp.plan import InterpPlan
 import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
 
-def wrf_copy_attributes( infilename, outfilename, nlevs ):
+@timed
+def wrf_copy_attributes( infilename, outfilename, nlevs, **kwargs ):
     '''
     Copies the netCDF attributes of one file into another file
     that is created by this function. This is so that information
@@ -20,124 +26,275 @@ def wrf_copy_attributes( infilename, outfilename, nlevs ):
 
     Parameters
     ----------
-    infilename: The name/path of the input file to be read
-    outfilename: The name/path of the output file to be written
+    infilename: The name/path of the input file to be read, or a file
+        opened with WRFSession.open
+    outfilename: The name/path of the output file to be written, or an
+        NCWriter
     nlevs: The number of vertical levels that the output file should have
+    append: If True and the output file exists, open it to be appended to
+        instead of creating it. See wrf_append_start.
+    Any other keyword arguments are NCWriter options.
 
-
+    Returns the NCWriter stats of the output file.
     '''
+    append = kwargs.pop( 'append', False )
     ## open the files
-    infile = Dataset( infilename )
-    outfile = Dataset( outfilename, 'w', format='NETCDF4' )
-    
+    infile = open_input( infilename )
+    if append and ( isinstance( outfilename, NCWriter ) or os.path.exists( outfilename ) ):
+        outfile = open_output( outfilename, 'a', **kwargs )
+    else:
+        outfile = open_output( outfilename, 'w', **kwargs )
+    ## a file being appended to already has its dimensions and attributes
+    if 'time' in outfile.dataset.dimensions:
+        infile.close()
+        return outfile.close()
+
     ## create dimensions
-    level = outfile.createDimension( 'bottom_top', nlevs )
-    time = outfile.createDimension( 'time', None )
-    lon = outfile.createDimension( 'south_north', infile.getncattr('SOUTH-NORTH_PATCH_END_UNSTAG') )
-    lat = outfile.createDimension( 'west_east', infile.getncattr('WEST-EAST_PATCH_END_UNSTAG') )
+    level = outfile.dataset.createDimension( 'bottom_top', nlevs )
+    time = outfile.dataset.createDimension( 'time', None )
+    lon = outfile.dataset.createDimension( 'south_north', infile.getncattr('SOUTH-NORTH_PATCH_END_UNSTAG') )
+    lat = outfile.dataset.createDimension( 'west_east', infile.getncattr('WEST-EAST_PATCH_END_UNSTAG') )
     
     ## copy the global attributes to the new file
     inattrs = infile.ncattrs()
     for attr in inattrs:
-        outfile.setncattr( attr, infile.getncattr( attr ) )
+        outfile.dataset.setncattr( attr, infile.getncattr( attr ) )
     ## close both files
     infile.close()
-    outfile.close()
+    return outfile.close()
     
+@timed
 def wrf_copy_sfc_fields( infilename, outfilename, **kwargs ):
     '''
+    Copies the surface fields of a WRF output file into a post-processed
+    file created by wrf_copy_attributes, and derives the sea level pressure,
+    2 meter relative humidity and 2 meter dewpoint from them. The file is
+    streamed a chunk of time steps at a time: each source variable is read
+    once per chunk, the derived fields are computed from those reads, and
+    everything is written before the next chunk is read, so memory use
+    depends on the chunk size rather than on the number of times in the file.
 
+    Parameters
+    ----------
+    infilename: The name/path of the input file to be read, or a file
+        opened with WRFSession.open
+    outfilename: The name/path of the output file to be written, or an
+        NCWriter
+    ref: If True, also write the column maximum of REFL_10CM. Defaults to False.
+    chunk: The number of time steps to process at once. Defaults to all of them.
+    start: The first time to process. Earlier times of the output are left
+        as they are, so new times can be appended. See wrf_append_start.
+    Any other keyword arguments are NCWriter options.
+
+    Returns the NCWriter stats of the output file.
     ''' 
-    infile = Dataset( infilename )
-    outfile = Dataset( outfilename, 'a' )
-    ref = kwargs.get('ref', False)
-    T2 = outfile.createVariable( 'T2', 'f4', ('time', 'south_north', 'west_east') )
-    TH2 = outfile.createVariable( 'TH2', 'f4', ('time', 'south_north', 'west_east') )
-    Q2 = outfile.createVariable( 'Q2', 'f4', ('time', 'south_north', 'west_east') )
-    PSFC = outfile.createVariable( 'PSFC', 'f4', ('time', 'south_north', 'west_east') )
-    U10 = outfile.createVariable( 'U10', 'f4', ('time', 'south_north', 'west_east') )
-    V10 = outfile.createVariable( 'V10', 'f4', ('time', 'south_north', 'west_east') )
-    SNOWH = outfile.createVariable( 'SNOWH', 'f4', ('time', 'south_north', 'west_east') )
-    SEAICE = outfile.createVariable( 'SEAICE', 'f4', ('time', 'south_north', 'west_east') )
-    RAINNC = outfile.createVariable( 'RAINNC', 'f4', ('time', 'south_north', 'west_east') )
-    SNOWNC = outfile.createVariable( 'SNOWNC', 'f4', ('time', 'south_north', 'west_east') )
+    ref = kwargs.pop('ref', False)
+    chunk = kwargs.pop('chunk', None)
+    start = kwargs.pop('start', 0)
+    infile = open_input( infilename )
+    outfile = open_output( outfilename, **kwargs )
+    ## fields that are copied over as they are
+    copied = [ 'TH2', 'U10', 'V10', 'SNOWH', 'SEAICE', 'RAINNC', 'SNOWNC', 'OLR' ]
+    names = [ 'T2', 'Q2', 'PSFC', 'DEWP', 'RH2', 'SLP' ] + copied
     if ref:
-        REFL_10CM = outfile.createVariable( 'REFL_10CM', 'f4', ('time', 'south_north', 'west_east') )
-    DEW2 = outfile.createVariable( 'DEWP', 'f4', ('time', 'south_north', 'west_east') )
-    RH2 = outfile.createVariable( 'RH2', 'f4', ('time', 'south_north', 'west_east') )
-    OLR = outfile.createVariable( 'OLR', 'f4', ('time', 'south_north', 'west_east') )
-    ## get the sea level pressure
-    wrf_slp( infilename, outfilename ) 
-    OLR[:] = infile.variables['OLR'][:]
-    T2[:] = infile.variables['T2'][:]
-    TH2[:] = infile.variables['TH2'][:]
-    Q2[:] = infile.variables['Q2'][:]
-    RH2[:] = wrf_rh( infile.variables['T2'][:], infile.variables['PSFC'][:]*.01, infile.variables['Q2'][:] )
-    PSFC[:] = infile.variables['PSFC'][:] * .01
-    U10[:] = infile.variables['U10'][:]
-    V10[:] = infile.variables['V10'][:]
-    SNOWH[:] = infile.variables['SNOWH'][:]
-    SEAICE[:] = infile.variables['SEAICE'][:]
-    RAINNC[:] = infile.variables['RAINNC'][:]
-    SNOWNC[:] = infile.variables['SNOWNC'][:]
-    if ref:
-        REFL_10CM[:] = numpy.amax(infile.variables['REFL_10CM'][:], axis=1)
-    DEW2[:] = wrf_dewp( infile.variables['T2'][:], infile.variables['PSFC'][:]*.01, infile.variables['Q2'][:] )[:]
+        names.append( 'REFL_10CM' )
+    for name in names:
+        outfile.require( name, 'f4', ('time', 'south_north', 'west_east') )
+
+    ntimes = infile.variables['T2'].shape[0]
+    if chunk is None:
+        chunk = max( ntimes - start, 1 )
+    for begin in range( start, ntimes, chunk ):
+        times = slice( begin, min( begin + chunk, ntimes ) )
+        for name in copied:
+            outfile.write( name, times, infile.read( name, times ) )
+        if ref:
+            outfile.write( 'REFL_10CM', times, numpy.amax( infile.read( 'REFL_10CM', times ), axis=1 ) )
+        ## read the fields needed by the derived variables only once per chunk
+        t2 = infile.read( 'T2', times )
+        q2 = infile.read( 'Q2', times )
+        psfc = infile.read( 'PSFC', times )
+        psfc_hpa = psfc * .01
+        outfile.write( 'T2', times, t2 )
+        outfile.write( 'Q2', times, q2 )
+        outfile.write( 'PSFC', times, psfc_hpa )
+        outfile.write( 'RH2', times, wrf_rh( t2, psfc_hpa, q2 ) )
+        outfile.write( 'DEWP', times, wrf_dewp( t2, psfc_hpa, q2 ) )
+        outfile.write( 'SLP', times, wrf_slp_from_sfc( t2, psfc, infile.read( 'HGT', times ) ) )
+        del t2, q2, psfc, psfc_hpa
     
     infile.close()
-    outfile.close()
+    return outfile.close()
 
-def wrf_copy_static_fields( infilename, outfilename, time=True ):
-    
-    infile = Dataset( infilename )
-    outfile = Dataset( outfilename, 'a' )
-    
-    XLONG = outfile.createVariable( 'XLONG', 'f4', ('south_north', 'west_east') )
-    XLAT = outfile.createVariable( 'XLAT', 'f4', ('south_north', 'west_east') )
+@timed
+def wrf_copy_static_fields( infilename, outfilename, time=True, **kwargs ):
+    '''
+    Copies the fields of a WRF output file that do not change in time,
+    such as XLAT, XLONG, and the map factors, into a post-processed file
+    created by wrf_copy_attributes, along with XTIME. Static fields that
+    the output file already has are left as they are.
 
+    Parameters
+    ----------
+    infilename: The name/path of the input file to be read, or a file
+        opened with WRFSession.open
+    outfilename: The name/path of the output file to be written, or an
+        NCWriter
+    time: If True, also write XTIME.
+    start: The first time of XTIME to write. See wrf_append_start.
+    Any other keyword arguments are NCWriter options.
 
-    SINALPHA = outfile.createVariable( 'SINALPHA', 'f4', ('south_north', 'west_east') )
-    COSALPHA = outfile.createVariable( 'COSALPHA', 'f4', ('south_north', 'west_east') )
-    MAPFAC_M = outfile.createVariable( 'MAPFAC_M', 'f4', ('south_north', 'west_east') )
-    F = outfile.createVariable( 'F', 'f4', ('south_north', 'west_east') )
-    MU = outfile.createVariable( 'MU', 'f4', ('south_north', 'west_east') )
-    MUB = outfile.createVariable( 'MUB', 'f4', ('south_north', 'west_east') )
+    Returns the NCWriter stats of the output file.
+    '''
+    start = kwargs.pop( 'start', 0 )
+    infile = open_input( infilename )
+    outfile = open_output( outfilename, **kwargs )
+    static = [ 'XLONG', 'XLAT', 'SINALPHA', 'COSALPHA', 'MAPFAC_M', 'F', 'MU', 'MUB' ]
+    static = [ name for name in static if name not in outfile.variables ]
+    for name in static:
+        outfile.create( name, 'f4', ('south_north', 'west_east') )
+    for name in static:
+        ## WRF writes the static fields with a Time dimension, so read the first time
+        if len( infile.variables[ name ].dimensions ) == 3:
+            outfile.write( name, slice( None ), infile.read( name, 0 ) )
+        else:
+            outfile.write( name, slice( None ), infile.read( name ) )
     if time:
-        XTIME = outfile.createVariable( 'XTIME', 'f4', ('time') )
-    try:
-        XLONG[:] = infile.variables['XLONG'][0][:]
-        XLAT[:] = infile.variables['XLAT'][0][:]
-        F[:] = infile.variables['F'][0][:]
-        MU[:] = infile.variables['MU'][0][:]
-        MUB[:] = infile.variables['MUB'][0][:]
-
-        MAPFAC_M[:] = infile.variables['MAPFAC_M'][0][:]
-        SINALPHA[:] = infile.variables['SINALPHA'][0][:]
-        COSALPHA[:] = infile.variables['COSALPHA'][0][:]
-        if time:
-            XTIME[:] = infile.variables['XTIME'][:]
-
-    except:
-        XLONG[:] = infile.variables['XLONG'][:]
-        XLAT[:] = infile.variables['XLAT'][:]
-        F[:] = infile.variables['F'][:]
-        MU[:] = infile.variables['MU'][:]
-        MUB[:] = infile.variables['MUB'][:]
-
-        MAPFAC_M[:] = infile.variables['MAPFAC_M'][:]
-        SINALPHA[:] = infile.variables['SINALPHA'][:]
-        COSALPHA[:] = infile.variables['COSALPHA'][:]
-        if time:
-            XTIME[:] = infile.variables['XTIME'][:]
+        outfile.require( 'XTIME', 'f4', ('time',) )
+        outfile.write( 'XTIME', slice( start, None ), infile.read( 'XTIME', slice( start, None ) ) )
+    infile.close()
+    return outfile.close()
+
+PRES_FIELDS = ( 'THETA', 'TEMP', 'RH', 'DEWP', 'QVAPOR', 'GHT', 'U', 'V', 'W' )
+
+## the output variables of pressure level fields whose names are taken by
+## the surface fields of wrf_copy_sfc_fields
+PRES_NAMES = { 'DEWP': 'DEWP_P' }
+
+def _pres_name( name ):
+    return PRES_NAMES.get( name, name )
+
+@timed
+def wrf_copy_pres_fields( infilename, outfilename, fields, levels, log=True, **kwargs ):
+    '''
+    Interpolates 3D fields of a WRF output file to pressure levels and
+    writes them to a post-processed file created by wrf_copy_attributes
+    with len( levels ) vertical levels. The file is processed one time
+    step at a time, and the interpolation weights for each time step are
+    computed once and shared by every field.
+
+    Parameters
+    ----------
+    infilename: The name/path of the input file to be read, or a file
+        opened with WRFSession.open
+    outfilename: The name/path of the output file to be written, or an
+        NCWriter
+    fields: The fields to write. Any of THETA (K), TEMP (K), RH (%),
+        DEWP (K), QVAPOR (kg/kg), GHT (geopotential height, m), and the
+        unstaggered U, V, and W winds (m/s). Each is written to the output
+        variable of the same name, except DEWP, which is written to DEWP_P
+        since DEWP is the 2 meter dewpoint of wrf_copy_sfc_fields.
+    levels: The pressure levels (hPa) to interpolate to. These are written
+        to the P_LEVELS variable.
+    log: If True (the default), interpolate linearly in log-pressure.
+    store: A DerivedStore. If given, the interpolated fields are read from
+        the store, and are computed and stored first only if they are not
+        already there.
+    start: The first time to process. Earlier times of the output are left
+        as they are, so new times can be appended. See wrf_append_start.
+    Any other keyword arguments are NCWriter options.
+
+    Returns the NCWriter stats of the output file.
+    '''
+    for name in fields:
+        assert name in PRES_FIELDS, 'Unknown pressure level field %s.' % name
+    store = kwargs.pop( 'store', None )
+    start = kwargs.pop( 'start', 0 )
+    infile = open_input( infilename )
+    outfile = open_output( outfilename, **kwargs )
+    levels = numpy.asarray( levels, dtype=float )
+    if 'P_LEVELS' in outfile.variables:
+        if not numpy.allclose( outfile.variables['P_LEVELS'][:], levels ):
+            infile.close()
+            outfile.close()
+            raise ValueError( 'The output file has different pressure levels than %s.' % list( levels ) )
+    else:
+        P_LEVELS = outfile.create( 'P_LEVELS', 'f4', ('bottom_top',) )
+        P_LEVELS[:] = levels
+    for name in fields:
+        outfile.require( _pres_name( name ), 'f4', ('time', 'bottom_top', 'south_north', 'west_east') )
+    thermo = [ name for name in fields if name in ( 'THETA', 'TEMP', 'RH', 'DEWP', 'QVAPOR' ) ]
+
+    ntimes = infile.variables['T'].shape[0]
+    for time in range( start, ntimes ):
+        t = slice( time, time + 1 )
+        if store is not None:
+            for name in fields:
+                outfile.write( _pres_name( name ), t, store.pres_field( infile, name, time, levels, log )[None] )
+            continue
+        moist = wrf_thermo( infile.read( 'T', t ), infile.read( 'P', t ), infile.read( 'PB', t ),
+            infile.read( 'QVAPOR', t ), fields=thermo + [ 'PRES' ] )
+        plan = InterpPlan( moist['PRES'], levels, log=log )
+        for name in thermo:
+            outfile.write( _pres_name( name ), t, plan.apply( moist[ name ] ) )
+        del moist
+        if 'GHT' in fields:
+            GHT = wrf_unstagger( wrf_height( infile.read( 'PH', t ), infile.read( 'PHB', t ) ), 'Z' )
+            outfile.write( 'GHT', t, plan.apply( GHT ) )
+        for name, dim in ( ( 'U', 'X' ), ( 'V', 'Y' ), ( 'W', 'Z' ) ):
+            if name in fields:
+                outfile.write( name, t, plan.apply( wrf_unstagger( infile.read( name, t ), dim ) ) )
     infile.close()
+    return outfile.close()
+
+@timed
+def wrf_append_start( infilename, outfilename ):
+    '''
+    Returns the first time of a WRF output file that is not yet in a
+    post-processed file made from it, so that a run that WRF is still
+    writing can be post-processed again by passing it as the start of
+    wrf_copy_sfc_fields, wrf_copy_pres_fields, wrf_slp, and
+    wrf_copy_static_fields. The times already in the output are the leading
+    times whose XTIME has been written. wrf_copy_static_fields writes XTIME,
+    so call it last, and a time interrupted part way through is processed
+    again the next time.
+
+    Parameters
+    ----------
+    infilename: The name/path of the WRF output file, or a file opened with
+        WRFSession.open
+    outfilename: The name/path of the post-processed file, or an NCWriter.
+        A file that does not exist has no times yet.
+
+    Raises ValueError if the XTIME of the output file does not match the
+    start of the XTIME of the WRF output file.
+    '''
+    if not isinstance( outfilename, NCWriter ) and not os.path.exists( outfilename ):
+        return 0
+    outfile = open_output( outfilename, 'a' )
+    if 'XTIME' not in outfile.variables or len( outfile.dataset.dimensions['time'] ) == 0:
+        outfile.close()
+        return 0
+    var = outfile.variables['XTIME']
+    written = numpy.ma.getmaskarray( var[:] )
+    done = int( numpy.argmax( written ) ) if written.any() else len( written )
+    out_xtime = numpy.asarray( var[:done] )
     outfile.close()
+    infile = open_input( infilename )
+    in_xtime = numpy.asarray( infile.read( 'XTIME' ), dtype=out_xtime.dtype )
+    infile.close()
+    if done > len( in_xtime ) or not numpy.array_equal( out_xtime, in_xtime[:done] ):
+        raise ValueError( 'The times of the output file do not match those of the WRF output file.' )
+    return done
 
-def wrf_unstagger( grid, dim ):
+@timed
+def wrf_unstagger( grid, dim, dtype=None ):
     """ Unstagger a staggered WRF grid in the X, Y, or Z (U, V, or W) direction.
         ---------------------
         grid (numpy.ndarray): The 2D, 3D, 4D, or 5D array to be unstaggered.
         dim (str): A string specifying what dimension to unstagger. Must be
         X, Y, Z, U, V or W.
+        dtype (numpy.dtype): the precision of the result. Defaults to the wrftools precision.
         ---------------------
         returns:
         numpy.ndarray unstaggered grid (dim-1)
@@ -148,6 +305,7 @@ def wrf_unstagger( grid, dim ):
         arr = np.random.randint( low=1, high=10, size=( 9,10,9 ) ) ## create a random array staggered in the Y direction
         arr_unstaggered = wrf_unstagger( arr, 'Y' )
         """
+    grid = as_dtype( grid, resolve_dtype( dtype ) )
     nd = len( grid.shape )
     if dim == 'X' or dim == 'U':
         if nd == 5:
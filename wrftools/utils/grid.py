@@ -1,8 +1,13 @@
+import numpy as np
+from wrftools.utils.session import open_input
+from wrftools.utils.mpas import CellIndex, _unit_vectors
+from wrftools.instrument import timed
 
 def xy_to_gridpoint( x, y, gridx, gridy ):
     '''
     A function to find the nearest gridpoint to a given
-    x/y coordinate (in meters).
+    x/y coordinate (in meters). To find many points at once,
+    use StationIndex.
 
     Parameters
     ----------
@@ -10,11 +15,138 @@ def xy_to_gridpoint( x, y, gridx, gridy ):
     lat - the y coordiante of a point
     gridx - the array of x values on the grid
     gridx - the array of y values on the grid
-    
+
     Returns
     -------
     idx - the grid index of the nearest point
     '''
-    distance = ( gridx - x )**2 + ( gridy - y )**2  
-    idx = np.where( distance == distance.min() )[0]
+    distance = ( gridx - x )**2 + ( gridy - y )**2
+    idx = np.unravel_index( np.argmin( distance ), distance.shape )
     return idx
+
+class StationIndex( object ):
+    '''
+    Resolves a set of stations to grid indices on a WRF domain once, so
+    that their time series can be read from any number of files on that
+    domain. The nearest gridpoints are found for all stations at once with
+    a spatial index of the grid, and bilinear weights are optionally
+    computed from the local grid spacing. Values are read a tile at a time,
+    only over the bounding box of the gridpoints needed in each tile, so the
+    full 3D or 4D fields are never read.
+
+    Parameters
+    ----------
+    gridlats - 2D array of gridpoint latitudes in degrees (XLAT)
+    gridlons - 2D array of gridpoint longitudes in degrees (XLONG)
+    lats - 1D array of station latitudes in degrees
+    lons - 1D array of station longitudes in degrees
+    bilinear - if True, interpolate bilinearly from the four surrounding
+        gridpoints instead of taking the nearest gridpoint
+    tile - the width of the tiles (in gridpoints) that reads are grouped by
+
+    The inside attribute is False for stations that are off the grid; their
+    values come from the nearest edge of the grid.
+
+    EXAMPLE:
+    stations = StationIndex( XLAT, XLONG, stn_lats, stn_lons, bilinear=True )
+    series = stations.extract_series( sorted( glob.glob( 'wrfout_d01_*' ) ), [ 'T2', 'Q2' ] )
+    '''
+    @timed( name='StationIndex' )
+    def __init__( self, gridlats, gridlons, lats, lons, bilinear=False, tile=64 ):
+        gridlats = np.asarray( gridlats, dtype=float )
+        gridlons = np.asarray( gridlons, dtype=float )
+        self.shape = gridlats.shape
+        self.tile = tile
+        ny, nx = self.shape
+        lats = np.radians( np.ravel( lats ) )
+        lons = np.radians( np.ravel( lons ) )
+
+        ## the largest distance between neighboring gridpoints on the unit
+        ## sphere bounds the distance from any point in the domain to its
+        ## nearest gridpoint, which makes it a good bucket width
+        xyz = _unit_vectors( np.radians( gridlats ), np.radians( gridlons ) )
+        spacing = max( np.sqrt( ( ( xyz[:, 1:] - xyz[:, :-1] )**2 ).sum( axis=-1 ) ).max(),
+            np.sqrt( ( ( xyz[1:] - xyz[:-1] )**2 ).sum( axis=-1 ) ).max() )
+        index = CellIndex( np.radians( gridlats ), np.radians( gridlons ), spacing=spacing )
+        nearest, dist = index.query( lats, lons )
+        j, i = np.unravel_index( nearest, self.shape )
+        ## stations further than a grid length from every gridpoint are off the grid
+        self.inside = dist <= spacing
+
+        if not bilinear:
+            self.jj = j[:, None]
+            self.ii = i[:, None]
+            self.weight = np.ones( self.jj.shape )
+            return
+        ## fractional grid position from the local grid spacing, in a plane
+        ## tangent to the sphere at the nearest gridpoint
+        jm, jp = np.maximum( j - 1, 0 ), np.minimum( j + 1, ny - 1 )
+        im, ip = np.maximum( i - 1, 0 ), np.minimum( i + 1, nx - 1 )
+        coslat = np.cos( np.radians( gridlats[ j, i ] ) )
+        def local( jj, ii ):
+            dlon = ( gridlons[ jj, ii ] - gridlons[ j, i ] + 180. ) % 360. - 180.
+            return dlon * coslat, gridlats[ jj, ii ] - gridlats[ j, i ]
+        xi, yi = local( j, ip )
+        xm, ym = local( j, im )
+        xj, yj = local( jp, i )
+        xjm, yjm = local( jm, i )
+        dxdi, dydi = ( xi - xm ) / ( ip - im ), ( yi - ym ) / ( ip - im )
+        dxdj, dydj = ( xj - xjm ) / ( jp - jm ), ( yj - yjm ) / ( jp - jm )
+        dlon = ( np.degrees( lons ) - gridlons[ j, i ] + 180. ) % 360. - 180.
+        px, py = dlon * coslat, np.degrees( lats ) - gridlats[ j, i ]
+        det = dxdi * dydj - dxdj * dydi
+        fi = i + ( px * dydj - py * dxdj ) / det
+        fj = j + ( py * dxdi - px * dydi ) / det
+        fi = np.clip( fi, 0, nx - 1 )
+        fj = np.clip( fj, 0, ny - 1 )
+        i0 = np.minimum( np.floor( fi ).astype( int ), nx - 2 )
+        j0 = np.minimum( np.floor( fj ).astype( int ), ny - 2 )
+        s, t = fi - i0, fj - j0
+        self.jj = np.stack( [ j0, j0, j0 + 1, j0 + 1 ], axis=1 )
+        self.ii = np.stack( [ i0, i0 + 1, i0, i0 + 1 ], axis=1 )
+        self.weight = np.stack( [ ( 1 - s ) * ( 1 - t ), s * ( 1 - t ), ( 1 - s ) * t, s * t ], axis=1 )
+
+    @timed( name='StationIndex.extract' )
+    def extract( self, infile, varname ):
+        '''
+        Reads the values of varname at every station from infile (a path or a
+        file opened with WRFSession.open). The variable must be on the mass
+        grid, with south_north and west_east as its last two dimensions.
+
+        Returns a numpy.ndarray with the leading dimensions of the variable
+        (e.g. time and level) followed by a station dimension.
+        '''
+        data = open_input( infile )
+        var = data.variables[ varname ]
+        assert var.shape[-2:] == self.shape, 'Variable %s is not on the mass grid.' % varname
+        lead = var.shape[:-2]
+        flatj, flati = self.jj.ravel(), self.ii.ravel()
+        values = np.empty( lead + flatj.shape, dtype=var.dtype )
+        ## group the gridpoints by tile and read each tile's bounding box once
+        ntx = ( self.shape[1] + self.tile - 1 ) // self.tile
+        blocks = ( flatj // self.tile ) * ntx + flati // self.tile
+        order = np.argsort( blocks, kind='mergesort' )
+        bounds = np.flatnonzero( np.diff( blocks[ order ] ) ) + 1
+        for sel in np.split( order, bounds ):
+            if sel.size == 0:
+                continue
+            j0, j1 = flatj[ sel ].min(), flatj[ sel ].max()
+            i0, i1 = flati[ sel ].min(), flati[ sel ].max()
+            box = np.asarray( data.read( varname, ( Ellipsis, slice( j0, j1 + 1 ), slice( i0, i1 + 1 ) ) ) )
+            values[ ..., sel ] = box[ ..., flatj[ sel ] - j0, flati[ sel ] - i0 ]
+        data.close()
+        values = values.reshape( lead + self.jj.shape )
+        return ( values * self.weight ).sum( axis=-1 )
+
+    @timed( name='StationIndex.extract_series' )
+    def extract_series( self, infiles, varnames ):
+        '''
+        Reads station time series of each of varnames from a sequence of files
+        and joins them along the time dimension. Returns a dict of
+        numpy.ndarray keyed by variable name.
+        '''
+        series = dict( ( name, [] ) for name in varnames )
+        for infile in infiles:
+            for name in varnames:
+                series[ name ].append( self.extract( infile, name ) )
+        return dict( ( name, np.concatenate( arrs, axis=0 ) ) for name, arrs in series.items() )
@@ -1,23 +1,32 @@
 import numpy as np
-from netCDF4 import Dataset
+from wrftools.utils.session import open_input
+from wrftools.instrument import timed
 ## functions originally written by Nick Szapiro,
 ## modified by Kelton Halbert.
 
-def find_cells(file, lats_wrf, lons_wrf, degrees=False):
+@timed
+def find_cells(file, lats_wrf, lons_wrf, degrees=False, refine=False, index=None):
   '''
   Function to find the nearest MPAS cell to each gridpoint on a 
-  WRF grid with lat/lon coordinates (in radians). 
+  WRF grid with lat/lon coordinates (in radians). All of the points
+  are looked up at once in a CellIndex of the mesh.
 
   Parameters
   ----------
-  file - the path to the file
+  file - the path to the file, or a file opened with WRFSession.open
   lats_wrf - the array of latitudes on the WRF grid
   lons_wrf - the array of longitudes on the WRF grid
+  degrees - if True, lats_wrf and lons_wrf are in degrees
+  refine - if True, follow the found cells with the greedy neighbor
+  walk over cellsOnCell. The index search is already exact, so this
+  is only a check on meshes with unusual cell spacing.
+  index - a CellIndex already built for the mesh in file, to avoid
+  building it again for each call
 
   Returns
   -------
-  cellIdx - an array containing the indices of the nearest MPAS
-  cell to each WRF gridpoint.
+  cellIdx - an array the same shape as lats_wrf containing the indices
+  of the nearest MPAS cell to each WRF gridpoint.
   
   Original code by Nick Szapiro,
   modified by Kelton Halbert.
@@ -28,31 +37,185 @@ def find_cells(file, lats_wrf, lons_wrf, degrees=False):
     lats_wrf = np.radians(lats_wrf)
     lons_wrf = np.radians(lons_wrf)
   ## open the MPAS file and get the lon/lats of each cell
-  data = Dataset(file, 'r')
-  nEdgesOnCell = data.variables['nEdgesOnCell'][:];
-  cellsOnCell = data.variables['cellsOnCell'][:]-1;
-  latCell = data.variables['latCell'][:];
-  lonCell = data.variables['lonCell'][:];
+  data = open_input(file)
+  if index is None:
+    index = CellIndex(data.read('latCell'), data.read('lonCell'))
+  if refine:
+    nEdgesOnCell = data.read('nEdgesOnCell');
+    cellsOnCell = data.read('cellsOnCell')-1;
   data.close()
   
   #associate to nearest neighbor
-  nPoints = len(lats_wrf)
-  cellIdx = np.empty(nPoints, dtype=int); iCell=0
-  pt_ll = np.empty(2,dtype=float)
-  for iPt in xrange(nPoints):
-    pt_ll[0] = lats_wrf[iPt]; pt_ll[1] = lons_wrf[iPt]
-    ## find the index of the nearest cell to the gridpoint and return the index, then
-    ## save it to the output array.
-    iCell = findOwner_horizNbrs_latLon(pt_ll, iCell, latCell, lonCell, nEdgesOnCell, cellsOnCell)
-    cellIdx[iPt] = iCell
+  cellIdx, dist = index.query(lats_wrf, lons_wrf)
+  if refine:
+    cellIdx = index.walk(cellIdx, lats_wrf, lons_wrf, nEdgesOnCell, cellsOnCell)
   
   return cellIdx
+
+def _unit_vectors(lat, lon):
+  ## cartesian coordinates of lat/lon points (in radians) on the unit sphere
+  lat = np.asarray(lat, dtype=float)
+  lon = np.asarray(lon, dtype=float)
+  coslat = np.cos(lat)
+  return np.stack([coslat*np.cos(lon), coslat*np.sin(lon), np.sin(lat)], axis=-1)
+
+class CellIndex(object):
+  '''
+  A spatial index of MPAS cell centers, built once per mesh from
+  latCell and lonCell (in radians), that finds the nearest cell to
+  millions of points in batch. The cell centers are converted to unit
+  vectors and sorted into cubic buckets of width spacing. A point is
+  compared with the cells in the surrounding buckets, and the search
+  widens for the few points whose nearest cell is not guaranteed to be
+  in that neighborhood, so the answer is always the exact nearest cell.
+
+  Parameters
+  ----------
+  latCell - the array of cell center latitudes (in radians)
+  lonCell - the array of cell center longitudes (in radians)
+  spacing - the bucket width on the unit sphere. Defaults to the mean
+  distance between cell centers.
+
+  EXAMPLE:
+  index = CellIndex.from_file('x1.163842.grid.nc')
+  cellIdx, dist = index.query(XLAT, XLONG, degrees=True)
+  '''
+  @timed(name='CellIndex')
+  def __init__(self, latCell, lonCell, spacing=None):
+    self.xyz = _unit_vectors(np.ravel(latCell), np.ravel(lonCell))
+    if spacing is None:
+      spacing = np.sqrt(4.*np.pi/self.xyz.shape[0])
+    self.spacing = spacing
+    ## the number of buckets along each axis of the [-1, 1] cube
+    self.nb = int(np.ceil(2./spacing)) + 1
+    keys = self._keys(self._buckets(self.xyz))
+    self.order = np.argsort(keys, kind='mergesort')
+    self.keys = keys[self.order]
+
+  @classmethod
+  def from_file(cls, file, spacing=None):
+    '''
+    Builds the index from the latCell and lonCell variables of an MPAS
+    file, given as a path or a file opened with WRFSession.open.
+    '''
+    data = open_input(file)
+    index = cls(data.read('latCell'), data.read('lonCell'), spacing=spacing)
+    data.close()
+    return index
+
+  def _buckets(self, xyz):
+    return np.floor((xyz + 1.)/self.spacing).astype(np.int64)
+
+  def _keys(self, ijk):
+    return (ijk[...,0]*self.nb + ijk[...,1])*self.nb + ijk[...,2]
+
+  def _search(self, q, ijk, reach, best, bestIdx):
+    ## compare the points q with every cell in the buckets within reach of
+    ## their own, keeping the running minimum squared chord distance. Keys
+    ## of buckets outside the cube alias other buckets, which only adds
+    ## candidates that are then rejected by distance.
+    steps = np.arange(-reach, reach+1)
+    for di in steps:
+      for dj in steps:
+        for dk in steps:
+          keys = self._keys(ijk + np.array([di, dj, dk]))
+          start = np.searchsorted(self.keys, keys, side='left')
+          count = np.searchsorted(self.keys, keys, side='right') - start
+          for slot in range(count.max() if count.size else 0):
+            has = np.flatnonzero(count > slot)
+            cand = self.order[start[has] + slot]
+            d = ((self.xyz[cand] - q[has])**2).sum(axis=-1)
+            closer = d < best[has]
+            best[has[closer]] = d[closer]
+            bestIdx[has[closer]] = cand[closer]
+
+  @timed(name='CellIndex.query')
+  def query(self, lats, lons, degrees=False, chunk=65536):
+    '''
+    Finds the nearest cell to each point.
+
+    Parameters
+    ----------
+    lats - array of latitudes of the points
+    lons - array of longitudes of the points, the same shape as lats
+    degrees - if True, lats and lons are in degrees instead of radians
+    chunk - the number of points searched at once
+
+    Returns
+    -------
+    cellIdx - integer array the same shape as lats of the nearest cells
+    dist - array the same shape as lats of the great circle distance to
+    the nearest cell on the unit sphere (multiply by the sphere radius)
+    '''
+    shape = np.shape(lats)
+    if degrees:
+      lats = np.radians(lats)
+      lons = np.radians(lons)
+    q = _unit_vectors(np.ravel(lats), np.ravel(lons))
+    n = q.shape[0]
+    cellIdx = np.zeros(n, dtype=int)
+    best = np.full(n, np.inf)
+    for start in range(0, n, chunk):
+      rows = np.arange(start, min(start+chunk, n))
+      reach = 1
+      while rows.size:
+        if reach*self.spacing >= 2. or (2*reach+1)**3 > self.keys.size:
+          ## the neighborhood covers most of the mesh, so check every cell
+          for row in rows:
+            d = ((self.xyz - q[row])**2).sum(axis=-1)
+            cellIdx[row] = np.argmin(d)
+            best[row] = d[cellIdx[row]]
+          break
+        cbest = best[rows]
+        cidx = cellIdx[rows]
+        self._search(q[rows], self._buckets(q[rows]), reach, cbest, cidx)
+        best[rows] = cbest
+        cellIdx[rows] = cidx
+        ## any cell closer than the best one found lies within reach
+        ## buckets, so these points are done
+        done = cbest <= (reach*self.spacing)**2
+        rows = rows[~done]
+        reach *= 2
+    dist = 2.*np.arcsin(np.minimum(np.sqrt(best), 2.)/2.)
+    return cellIdx.reshape(shape), dist.reshape(shape)
+
+  def walk(self, cellIdx, lats, lons, nEdgesOnCell, cellsOnCell, chunk=65536):
+    '''
+    Refines cellIdx with a greedy walk: each point moves to whichever
+    neighbor of its cell (from cellsOnCell, zero based) is closer until no
+    neighbor is closer. All points walk together, one step at a time.
+    Returns the refined cell indices, the same shape as cellIdx.
+    '''
+    shape = np.shape(cellIdx)
+    cellIdx = np.array(cellIdx, dtype=int).ravel()
+    q = _unit_vectors(np.ravel(lats), np.ravel(lons))
+    nEdgesOnCell = np.asarray(nEdgesOnCell)
+    cellsOnCell = np.asarray(cellsOnCell)
+    slots = np.arange(cellsOnCell.shape[1])
+    for start in range(0, cellIdx.size, chunk):
+      rows = np.arange(start, min(start+chunk, cellIdx.size))
+      cur = cellIdx[rows]
+      dcur = ((self.xyz[cur] - q[rows])**2).sum(axis=-1)
+      while rows.size:
+        nbrs = cellsOnCell[cur]
+        valid = (slots < nEdgesOnCell[cur][:,None]) & (nbrs >= 0)
+        nbrs = np.where(valid, nbrs, 0)
+        d = ((self.xyz[nbrs] - q[rows][:,None,:])**2).sum(axis=-1)
+        d[~valid] = np.inf
+        j = np.argmin(d, axis=1)
+        dmin = d[np.arange(rows.size), j]
+        move = dmin < dcur
+        cellIdx[rows[move]] = nbrs[move, j[move]]
+        rows = rows[move]
+        cur = cellIdx[rows]
+        dcur = dmin[move]
+    return cellIdx.reshape(shape)
   
 def findOwner_horizNbrs_latLon(pt_ll, cellId, latCell, lonCell, nEdgesOnCell, cellsOnCell):
   '''
   Written by Nick Szapiro.
   '''
-  dCell = calc_distSphere(1., pt_ll[0], pt_ll[1], latCell[cellId], lonCell[cellId]);
+  dCell = distSphere(1., pt_ll[0], pt_ll[1], latCell[cellId], lonCell[cellId]);
 
   flag = 1;
   while (flag==1):
@@ -63,7 +226,7 @@ def findOwner_horizNbrs_latLon(pt_ll, cellId, latCell, lonCell, nEdgesOnCell, ce
     #nbrs = getNbrs_cell(cellId, nEdgesOnCell[cellId], cellsOnCell[cellId,:]);
     for i in range(nNbrs):
       nbrId = nbrs[i];
-      dNbr = calc_distSphere(1., pt_ll[0], pt_ll[1], latCell[nbrId], lonCell[nbrId]);
+      dNbr = distSphere(1., pt_ll[0], pt_ll[1], latCell[nbrId], lonCell[nbrId]);
       if (dNbr<dCell):
         dCell = dNbr;
         cellId = nbrId;
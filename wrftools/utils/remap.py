@@ -0,0 +1,188 @@
+## Protected under the GPL V2 License
+
+import os
+import hashlib
+import numpy
+from wrftools.utils.session import open_input
+from wrftools.utils.mpas import CellIndex, _unit_vectors
+from wrftools.instrument import timed
+
+__all__ = ['MPASRemapper', 'remap_key']
+
+def remap_key( latCell, lonCell, lats, lons, method ):
+    '''
+    Returns the hex digest that identifies a remapping: a hash of the mesh
+    cell coordinates, the target coordinates, and the remapping method.
+    '''
+    digest = hashlib.sha1( method.encode( 'ascii' ) )
+    for arr in ( latCell, lonCell, lats, lons ):
+        arr = numpy.ascontiguousarray( arr, dtype=numpy.float64 )
+        digest.update( str( arr.shape ).encode( 'ascii' ) )
+        digest.update( arr.tobytes() )
+    return digest.hexdigest()
+
+def _barycentric( q, cellIdx, xyz, nEdgesOnCell, cellsOnCell, chunk=65536 ):
+    ## weights of the Delaunay triangle ( cell, neighbor i, neighbor i+1 )
+    ## around the nearest cell that contains each point. Points that are in
+    ## no triangle (at the edge of a regional mesh) keep the nearest cell.
+    n = q.shape[0]
+    idx = numpy.zeros( ( n, 3 ), dtype=numpy.int32 )
+    weight = numpy.zeros( ( n, 3 ), dtype=numpy.float32 )
+    idx[:, 0] = cellIdx
+    weight[:, 0] = 1.
+    maxEdges = cellsOnCell.shape[1]
+    for start in range( 0, n, chunk ):
+        rows = numpy.arange( start, min( start + chunk, n ) )
+        cells = cellIdx[rows]
+        nEdges = nEdgesOnCell[cells]
+        found = numpy.zeros( rows.size, dtype=bool )
+        for i in range( maxEdges ):
+            j = numpy.where( i + 1 < nEdges, i + 1, 0 )
+            nb1 = cellsOnCell[cells, i]
+            nb2 = cellsOnCell[cells, j]
+            ok = ~found & ( i < nEdges ) & ( nb1 >= 0 ) & ( nb2 >= 0 )
+            if not ok.any():
+                continue
+            sel = numpy.flatnonzero( ok )
+            tri = numpy.stack( [ cells[sel], nb1[sel], nb2[sel] ], axis=1 )
+            ## solve q = a*A + b*B + c*C; normalized, these are the
+            ## barycentric coordinates of the central projection of q
+            ## onto the plane of the triangle
+            M = numpy.transpose( xyz[tri], ( 0, 2, 1 ) )
+            coef = numpy.linalg.solve( M, q[rows[sel]][..., None] )[..., 0]
+            coef /= coef.sum( axis=1 )[:, None]
+            inside = ( coef >= -1e-9 ).all( axis=1 )
+            sel = sel[inside]
+            idx[rows[sel]] = tri[inside]
+            weight[rows[sel]] = coef[inside]
+            found[sel] = True
+    return idx, weight
+
+class MPASRemapper( object ):
+    '''
+    Remaps MPAS cell fields onto a set of target points, such as a WRF
+    grid, with either the nearest cell or barycentric weights from the
+    Delaunay triangles formed by cellsOnCell. The indices and weights are
+    computed once and saved to cachedir, keyed by a hash of the mesh and
+    target coordinates, so later remappers for the same mesh and grid load
+    them from disk without building a CellIndex. Fields are then remapped
+    with a gather of the cached indices and a weighted sum.
+
+    Parameters
+    ----------
+    latCell, lonCell - the cell center coordinates of the mesh (in radians)
+    lats, lons - the target coordinates, e.g. XLAT and XLONG (in radians
+        unless degrees is True)
+    method - 'nearest' or 'barycentric'
+    nEdgesOnCell, cellsOnCell - the mesh connectivity (cellsOnCell zero
+        based). Only needed for the barycentric method.
+    degrees - if True, lats and lons are in degrees
+    cachedir - a directory to save and load the remapping from. If None,
+        nothing is saved.
+
+    EXAMPLE:
+    remapper = MPASRemapper.from_file( 'x1.163842.init.nc', XLAT, XLONG,
+        method='barycentric', degrees=True, cachedir='remap_cache' )
+    for T2 in remapper.iter_remap( 'history.2014-05-20_00.00.00.nc', 't2m' ):
+        ...
+    '''
+    @timed( name='MPASRemapper' )
+    def __init__( self, latCell, lonCell, lats, lons, method='nearest', nEdgesOnCell=None,
+        cellsOnCell=None, degrees=False, cachedir=None ):
+        assert method in ( 'nearest', 'barycentric' ), "method must be 'nearest' or 'barycentric'"
+        if degrees:
+            lats = numpy.radians( lats )
+            lons = numpy.radians( lons )
+        self.method = method
+        self.shape = numpy.shape( lats )
+        self.key = remap_key( latCell, lonCell, lats, lons, method )
+        self.cachefile = None
+        self.cached = False
+        if cachedir is not None:
+            self.cachefile = os.path.join( cachedir, 'mpas_remap_%s.npz' % self.key )
+            if os.path.exists( self.cachefile ):
+                with numpy.load( self.cachefile ) as data:
+                    self.idx = data['idx']
+                    self.weight = data['weight']
+                self.cached = True
+                return
+
+        index = CellIndex( latCell, lonCell )
+        cellIdx, dist = index.query( lats, lons )
+        cellIdx = cellIdx.ravel()
+        if method == 'nearest':
+            self.idx = cellIdx.astype( numpy.int32 )[:, None]
+            self.weight = numpy.ones( self.idx.shape, dtype=numpy.float32 )
+        else:
+            assert cellsOnCell is not None and nEdgesOnCell is not None, 'The barycentric method needs nEdgesOnCell and cellsOnCell.'
+            q = _unit_vectors( numpy.ravel( lats ), numpy.ravel( lons ) )
+            self.idx, self.weight = _barycentric( q, cellIdx, index.xyz, numpy.asarray( nEdgesOnCell ),
+                numpy.asarray( cellsOnCell ) )
+        if self.cachefile is not None:
+            self.save( self.cachefile )
+
+    @classmethod
+    def from_file( cls, meshfile, lats, lons, method='nearest', degrees=False, cachedir=None ):
+        '''
+        Builds a remapper from the mesh in an MPAS file, given as a path or a
+        file opened with WRFSession.open. The connectivity is only read when
+        the remapping is not already in cachedir.
+        '''
+        if degrees:
+            lats = numpy.radians( lats )
+            lons = numpy.radians( lons )
+        data = open_input( meshfile )
+        latCell = data.read( 'latCell' )
+        lonCell = data.read( 'lonCell' )
+        nEdgesOnCell = cellsOnCell = None
+        if method == 'barycentric':
+            key = remap_key( latCell, lonCell, lats, lons, method )
+            if cachedir is None or not os.path.exists( os.path.join( cachedir, 'mpas_remap_%s.npz' % key ) ):
+                nEdgesOnCell = data.read( 'nEdgesOnCell' )
+                cellsOnCell = data.read( 'cellsOnCell' ) - 1
+        data.close()
+        return cls( latCell, lonCell, lats, lons, method=method, nEdgesOnCell=nEdgesOnCell,
+            cellsOnCell=cellsOnCell, cachedir=cachedir )
+
+    def save( self, filename ):
+        '''
+        Saves the indices and weights to a numpy .npz file.
+        '''
+        dirname = os.path.dirname( filename )
+        if dirname and not os.path.isdir( dirname ):
+            os.makedirs( dirname )
+        ## write then rename, so a crash never leaves half a cache file
+        partname = filename + '.part.npz'
+        numpy.savez( partname, idx=self.idx, weight=self.weight )
+        os.rename( partname, filename )
+
+    @timed( name='MPASRemapper.remap' )
+    def remap( self, field, axis=-1 ):
+        '''
+        Remaps a field with the nCells dimension at axis. The target
+        dimensions replace nCells at the end of the returned array, so a
+        (nCells, nVertLevels) field with axis=0 becomes (nVertLevels, ny, nx).
+        '''
+        field = numpy.moveaxis( numpy.asarray( field ), axis, -1 )
+        gathered = numpy.take( field, self.idx, axis=-1 )
+        out = numpy.einsum( '...nk,nk->...n', gathered, self.weight )
+        return out.reshape( field.shape[:-1] + self.shape )
+
+    @timed( name='MPASRemapper.iter_remap' )
+    def iter_remap( self, infile, varname ):
+        '''
+        Reads varname from an MPAS file (a path or a file opened with
+        WRFSession.open) one time at a time and yields each remapped time.
+        '''
+        data = open_input( infile )
+        var = data.variables[ varname ]
+        dims = var.dimensions
+        axis = dims.index( 'nCells' )
+        try:
+            if dims[0] == 'Time':
+                for time in range( var.shape[0] ):
+                    yield self.remap( data.read( varname, time ), axis=axis - 1 )
+            else:
+                yield self.remap( data.read( varname ), axis=axis )
+        finally:
+            data.close()
@@ -0,0 +1,194 @@
+## Protected under the GPL V2 License
+
+import os
+import time
+import collections
+from wrftools import instrument
+
+__all__ = ['WRFSession', 'open_input']
+
+def _index_key( index ):
+    ## slices are not hashable, so turn an index into a tuple that is
+    if isinstance( index, tuple ):
+        return tuple( _index_key( idx ) for idx in index )
+    if isinstance( index, slice ):
+        return ( 'slice', index.start, index.stop, index.step )
+    if isinstance( index, list ):
+        return ( 'list', ) + tuple( index )
+    return index
+
+def _nbytes( data ):
+    nbytes = getattr( data, 'nbytes', 0 )
+    mask = getattr( data, 'mask', None )
+    if mask is not None:
+        nbytes += getattr( mask, 'nbytes', 0 )
+    return nbytes
+
+class WRFSession( object ):
+    '''
+    Keeps one open netCDF4.Dataset per file and memoizes the variables and
+    hyperslabs read from them in a least recently used cache limited to
+    max_bytes. A file opened through the session can be passed to any
+    wrftools function that takes an input filename, so that a whole
+    post-processing pass opens each file once and decodes each variable
+    once. Arrays returned from the cache are read only.
+
+    Parameters
+    ----------
+    max_bytes - the largest number of bytes of decoded data to keep in the
+        cache. Defaults to 1 GB. A value of 0 disables caching.
+
+    EXAMPLE:
+    with WRFSession( max_bytes=2 * 1024**3 ) as session:
+        infile = session.open( 'wrfout_d01_2014-05-20_00:00:00' )
+        wrf_copy_attributes( infile, 'post.nc', 10 )
+        wrf_copy_static_fields( infile, 'post.nc' )
+        wrf_copy_sfc_fields( infile, 'post.nc' )
+        print( session.stats() )
+    '''
+    def __init__( self, max_bytes=1024**3 ):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._datasets = {}
+        self._cache = collections.OrderedDict()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def open( self, filename ):
+        '''
+        Returns a SessionFile for filename that reads through this session.
+        '''
+        return SessionFile( self, filename )
+
+    def dataset( self, filename ):
+        '''
+        Returns the open netCDF4.Dataset for filename, opening it on first use.
+        '''
+        key = os.path.abspath( filename )
+        if key not in self._datasets:
+            from netCDF4 import Dataset
+            self._datasets[ key ] = Dataset( filename )
+        return self._datasets[ key ]
+
+    def read( self, filename, varname, index=None ):
+        '''
+        Reads varname from filename, or only the hyperslab given by index,
+        returning the cached copy if it has been read before. A hyperslab of
+        a variable that is already cached whole is sliced from the cache.
+        '''
+        path = os.path.abspath( filename )
+        key = ( path, varname, _index_key( index ) )
+        whole = ( path, varname, None )
+        if key in self._cache:
+            self.hits += 1
+            data = self._cache.pop( key )
+            self._cache[ key ] = data
+            return data
+        if index is not None and whole in self._cache:
+            self.hits += 1
+            data = self._cache.pop( whole )
+            self._cache[ whole ] = data
+            return data[ index ]
+        self.misses += 1
+        start = time.time()
+        var = self.dataset( filename ).variables[ varname ]
+        if index is None:
+            data = var[:]
+        else:
+            data = var[ index ]
+        prof = instrument.active()
+        if prof is not None:
+            prof.record_read( path, varname, _nbytes( data ), time.time() - start )
+        self._store( key, data )
+        return data
+
+    def _store( self, key, data ):
+        nbytes = _nbytes( data )
+        if nbytes > self.max_bytes:
+            return
+        if hasattr( data, 'flags' ):
+            data.flags.writeable = False
+        ## evict the least recently used entries until the new one fits
+        while self._cache and self.nbytes + nbytes > self.max_bytes:
+            oldkey, old = self._cache.popitem( last=False )
+            self.nbytes -= _nbytes( old )
+        self._cache[ key ] = data
+        self.nbytes += nbytes
+
+    def clear( self ):
+        '''
+        Empties the cache without closing any files.
+        '''
+        self._cache.clear()
+        self.nbytes = 0
+
+    def stats( self ):
+        '''
+        Returns a dictionary with the number of cache hits and misses, the
+        number of bytes held in the cache, and the number of open files.
+        '''
+        return { 'hits': self.hits, 'misses': self.misses, 'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes, 'entries': len( self._cache ),
+            'files': len( self._datasets ) }
+
+    def close( self ):
+        '''
+        Empties the cache and closes every file opened by the session.
+        '''
+        self.clear()
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+
+class SessionFile( object ):
+    '''
+    A single file of a WRFSession. Exposes the parts of the netCDF4.Dataset
+    interface used by wrftools, plus read for cached reads. Closing a
+    SessionFile only closes the underlying file if it owns its session,
+    so functions can close their input without closing a shared session.
+    '''
+    def __init__( self, session, filename, owner=False ):
+        self.session = session
+        self.filename = filename
+        self.owner = owner
+
+    @property
+    def dataset( self ):
+        return self.session.dataset( self.filename )
+
+    @property
+    def variables( self ):
+        return self.dataset.variables
+
+    @property
+    def dimensions( self ):
+        return self.dataset.dimensions
+
+    def ncattrs( self ):
+        return self.dataset.ncattrs()
+
+    def getncattr( self, name ):
+        return self.dataset.getncattr( name )
+
+    def read( self, varname, index=None ):
+        return self.session.read( self.filename, varname, index )
+
+    def close( self ):
+        if self.owner:
+            self.session.close()
+
+def open_input( infile ):
+    '''
+    Returns a SessionFile for infile, which is either a filename or a file
+    already opened with WRFSession.open. A filename gets a private session
+    with caching disabled, which is closed when the SessionFile is closed.
+    '''
+    if isinstance( infile, SessionFile ):
+        return infile
+    return SessionFile( WRFSession( max_bytes=0 ), infile, owner=True )
@@ -0,0 +1,197 @@
+## Protected under the GPL V2 License
+
+import os
+import json
+import hashlib
+import numpy
+from wrftools.utils.session import open_input, SessionFile
+from wrftools.variables.thermo import wrf_thermo
+from wrftools.variables.vertical import wrf_height
+from wrftools.interp.plan import InterpPlan
+from wrftools.instrument import timed
+
+__all__ = ['DerivedStore', 'STORE_FIELDS']
+
+THERMO_FIELDS = ( 'THETA', 'PRES', 'TEMP', 'RH', 'DEWP', 'QVAPOR' )
+STORE_FIELDS = THERMO_FIELDS + ( 'GHT', 'U', 'V', 'W' )
+
+def _source_name( source ):
+    if isinstance( source, SessionFile ):
+        return source.filename
+    return source
+
+def _unstagger( grid, axis ):
+    lo = [ slice( None ) ] * grid.ndim
+    hi = [ slice( None ) ] * grid.ndim
+    lo[axis] = slice( None, -1 )
+    hi[axis] = slice( 1, None )
+    return ( grid[ tuple( lo ) ] + grid[ tuple( hi ) ] ) / 2.
+
+class DerivedStore( object ):
+    '''
+    A directory of derived fields, so that a field computed from a WRF
+    output file is computed once and then read by every consumer. Each
+    variable of each source file is kept in a flat binary file holding
+    every time, next to a JSON header with its dtype, shape, the times
+    that have been written, and the size and modification time of the
+    source. Reads are numpy.memmap views, so any time or level is read
+    without copying the rest of the field. A header whose source has
+    changed since it was written is treated as missing.
+
+    Parameters
+    ----------
+    root - the directory of the store. It is created if needed.
+
+    The store can compute the fields in STORE_FIELDS itself (see field
+    and pres_field), and fetch stores the result of any other function.
+
+    EXAMPLE:
+    store = DerivedStore( '/scratch/derived' )
+    TEMP = store.field( 'wrfout_d01_2014-05-20_00:00:00', 'TEMP', 3 )
+    T500 = store.pres_field( 'wrfout_d01_2014-05-20_00:00:00', 'TEMP', 3, [ 500. ] )
+    '''
+    def __init__( self, root ):
+        self.root = root
+        if not os.path.isdir( root ):
+            os.makedirs( root )
+        self._maps = {}
+
+    def _paths( self, source, varname ):
+        path = os.path.abspath( _source_name( source ) )
+        key = '%s-%s' % ( os.path.basename( path ), hashlib.sha1( path.encode( 'utf-8' ) ).hexdigest()[:12] )
+        base = os.path.join( self.root, key, varname )
+        return path, base + '.bin', base + '.json'
+
+    def _header( self, source, varname ):
+        path, binname, headname = self._paths( source, varname )
+        if not os.path.exists( headname ):
+            return None
+        with open( headname ) as f:
+            header = json.load( f )
+        stat = os.stat( path )
+        if header['source_size'] != stat.st_size or header['source_mtime'] != stat.st_mtime:
+            return None
+        return header
+
+    def _write_header( self, headname, header ):
+        ## write then rename, so readers never see half a header
+        with open( headname + '.part', 'w' ) as f:
+            json.dump( header, f )
+        os.rename( headname + '.part', headname )
+
+    def _map( self, binname, header ):
+        key = ( binname, tuple( header['shape'] ) )
+        if key not in self._maps:
+            self._maps[ key ] = numpy.memmap( binname, dtype=header['dtype'], mode='r', shape=tuple( header['shape'] ) )
+        return self._maps[ key ]
+
+    def has( self, source, varname, time=None ):
+        '''
+        Returns True if varname has been stored for time of source, or for
+        every time if time is None.
+        '''
+        header = self._header( source, varname )
+        if header is None:
+            return False
+        if time is None:
+            return all( header['written'] )
+        return header['written'][ time ]
+
+    def put( self, source, varname, time, data, ntimes=None ):
+        '''
+        Stores data as varname at time of source. The binary file is created
+        on the first put with room for ntimes times, which defaults to the
+        length of the Time dimension of source. A time can only be written once.
+        '''
+        path, binname, headname = self._paths( source, varname )
+        data = numpy.asarray( data )
+        header = self._header( source, varname )
+        if header is None:
+            if ntimes is None:
+                infile = open_input( source )
+                ntimes = len( infile.dimensions['Time'] )
+                infile.close()
+            stat = os.stat( path )
+            header = { 'source': path, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime,
+                'dtype': data.dtype.str, 'shape': [ ntimes ] + list( data.shape ), 'written': [ False ] * ntimes }
+            if not os.path.isdir( os.path.dirname( binname ) ):
+                os.makedirs( os.path.dirname( binname ) )
+            for key in list( self._maps ):
+                if key[0] == binname:
+                    del self._maps[ key ]
+            mm = numpy.memmap( binname, dtype=data.dtype, mode='w+', shape=tuple( header['shape'] ) )
+        else:
+            assert list( data.shape ) == header['shape'][1:], 'Data for %s is not shaped %s.' % ( varname, header['shape'][1:] )
+            if header['written'][ time ]:
+                raise ValueError( '%s is already stored for time %d of %s.' % ( varname, time, path ) )
+            mm = numpy.memmap( binname, dtype=header['dtype'], mode='r+', shape=tuple( header['shape'] ) )
+        mm[ time ] = data
+        mm.flush()
+        del mm
+        header['written'][ time ] = True
+        self._write_header( headname, header )
+
+    def get( self, source, varname, time=None ):
+        '''
+        Returns a read only numpy.memmap of varname at time of source, or of
+        every time if time is None. Raises KeyError if it is not stored.
+        '''
+        if not self.has( source, varname, time ):
+            raise KeyError( '%s is not stored for %s.' % ( varname, _source_name( source ) ) )
+        path, binname, headname = self._paths( source, varname )
+        mm = self._map( binname, self._header( source, varname ) )
+        return mm if time is None else mm[ time ]
+
+    def fetch( self, source, varname, time, compute ):
+        '''
+        Returns varname at time of source from the store, calling compute
+        with no arguments and storing its result first if it is not stored.
+        '''
+        if not self.has( source, varname, time ):
+            self.put( source, varname, time, compute() )
+        return self.get( source, varname, time )
+
+    @timed( name='DerivedStore.field' )
+    def field( self, source, name, time ):
+        '''
+        Returns one of STORE_FIELDS at time of source, computing and storing
+        it first if needed. THETA (K), PRES (hPa), TEMP (K), RH (%), DEWP (K),
+        and QVAPOR (kg/kg) are computed together by wrf_thermo, so the first
+        of them requested stores all of them. GHT is the geopotential height (m) and
+        U, V, and W are the winds (m/s), all on the mass grid.
+        '''
+        assert name in STORE_FIELDS, 'Unknown field %s.' % name
+        if self.has( source, name, time ):
+            return self.get( source, name, time )
+        infile = open_input( source )
+        t = slice( time, time + 1 )
+        if name in THERMO_FIELDS:
+            missing = [ field for field in THERMO_FIELDS if not self.has( source, field, time ) ]
+            values = wrf_thermo( infile.read( 'T', t ), infile.read( 'P', t ), infile.read( 'PB', t ),
+                infile.read( 'QVAPOR', t ), fields=missing )
+            ntimes = infile.variables['T'].shape[0]
+            for field in missing:
+                self.put( source, field, time, values[ field ][0], ntimes )
+        elif name == 'GHT':
+            GHT = _unstagger( wrf_height( infile.read( 'PH', t ), infile.read( 'PHB', t ) )[0], 0 )
+            self.put( source, name, time, GHT.astype( numpy.float32 ), infile.variables['PH'].shape[0] )
+        else:
+            axis = { 'U': 2, 'V': 1, 'W': 0 }[ name ]
+            grid = _unstagger( infile.read( name, t )[0], axis )
+            self.put( source, name, time, grid.astype( numpy.float32 ), infile.variables[ name ].shape[0] )
+        infile.close()
+        return self.get( source, name, time )
+
+    @timed( name='DerivedStore.pres_field' )
+    def pres_field( self, source, name, time, levels, log=True ):
+        '''
+        Returns one of STORE_FIELDS at time of source interpolated to the
+        pressure levels (hPa), computing and storing it first if needed. It is
+        stored as name@levels, e.g. TEMP@850,700,500hPa.
+        '''
+        levels = numpy.asarray( levels, dtype=float )
+        key = '%s@%shPa%s' % ( name, ','.join( '%g' % lev for lev in levels ), '' if log else '-linear' )
+        def compute():
+            plan = InterpPlan( self.field( source, 'PRES', time )[None], levels, log=log )
+            return plan.apply( self.field( source, name, time )[None] )[0].astype( numpy.float32 )
+        return self.fetch( source, key, time, compute )
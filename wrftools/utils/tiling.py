@@ -0,0 +1,154 @@
+## Protected under the GPL V2 License
+
+import threading
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from wrftools.utils.session import open_input
+from wrftools.utils.writer import open_output
+from wrftools.variables.thermo import wrf_theta
+from wrftools.variables.vertical import wrf_pressure
+from wrftools.variables.winds import wrf_vort, wrf_absvort, wrf_pv
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
+
+__all__ = ['tile_slices', 'read_tile', 'wrf_tiled_fields', 'TILED_FIELDS']
+
+def tile_slices( ny, nx, tile=(512, 512), halo=1 ):
+    '''
+    Splits a south_north by west_east grid into tiles, each read with a
+    halo of extra points on the sides that are not at the edge of the
+    domain, so that centered differences at the edge of a tile see the
+    same neighbors they do in the whole grid.
+
+    Parameters
+    ----------
+    ny, nx - the size of the grid
+    tile - the size ( rows, columns ) of the tiles, without their halos
+    halo - the number of points added on each side of a tile
+
+    Returns
+    -------
+    tiles - a list of ( read, interior, local ) tuples of ( y, x ) slices:
+        the block to read including its halo, the block of the grid it
+        computes, and where that block is within the one read.
+    '''
+    ty, tx = tile
+    tiles = []
+    for y0 in range( 0, ny, ty ):
+        y1 = min( y0 + ty, ny )
+        ry0, ry1 = max( y0 - halo, 0 ), min( y1 + halo, ny )
+        for x0 in range( 0, nx, tx ):
+            x1 = min( x0 + tx, nx )
+            rx0, rx1 = max( x0 - halo, 0 ), min( x1 + halo, nx )
+            tiles.append( ( ( slice( ry0, ry1 ), slice( rx0, rx1 ) ), ( slice( y0, y1 ), slice( x0, x1 ) ),
+                ( slice( y0 - ry0, y1 - ry0 ), slice( x0 - rx0, x1 - rx0 ) ) ) )
+    return tiles
+
+def _stagger( index, name, dims ):
+    ## the slice of a staggered dimension that unstaggers to index
+    if name in dims:
+        return slice( index.start, index.stop + 1 )
+    return index
+
+def read_tile( infile, varname, time, ys, xs ):
+    '''
+    Reads the ys, xs block of a WRF variable at time from the file, on the
+    mass grid. A variable staggered in x, y, or the vertical is read one
+    point wider and averaged to the mass points, which gives the same
+    values as unstaggering the whole grid, in the wrftools precision.
+    '''
+    dims = infile.variables[ varname ].dimensions
+    index = [ time ]
+    if len( dims ) == 4:
+        index.append( slice( None ) )
+    index.append( _stagger( ys, 'south_north_stag', dims[-2:] ) )
+    index.append( _stagger( xs, 'west_east_stag', dims[-1:] ) )
+    grid = as_dtype( numpy.asarray( infile.read( varname, tuple( index ) ) ), resolve_dtype() )
+    if dims[-1] == 'west_east_stag':
+        grid = ( grid[..., :-1] + grid[..., 1:] ) / 2.
+    if dims[-2] == 'south_north_stag':
+        grid = ( grid[..., :-1, :] + grid[..., 1:, :] ) / 2.
+    if dims[1] == 'bottom_top_stag':
+        grid = ( grid[:-1] + grid[1:] ) / 2.
+    return grid
+
+def _pv( read, dx ):
+    U, V, F, MAPFAC_M = read( 'U' ), read( 'V' ), read( 'F' ), read( 'MAPFAC_M' )
+    PRES = wrf_pressure( read( 'P' ), read( 'PB' ) )
+    THETA = wrf_theta( read( 'T' ) )
+    return wrf_pv( U[None], V[None], F, THETA[None], PRES[None], MAPFAC_M, dx )[0]
+
+def _vort( read, dx ):
+    return wrf_vort( read( 'U' ), read( 'V' ), dx )
+
+def _absvort( read, dx ):
+    return wrf_absvort( read( 'U' ), read( 'V' ), read( 'F' ), dx )
+
+## the fields that can be tiled, and the function of one tile that computes each
+TILED_FIELDS = { 'PV': _pv, 'VORT': _vort, 'ABSVORT': _absvort }
+
+@timed
+def wrf_tiled_fields( infilename, outfilename, fields=( 'PV', ), tile=(512, 512), workers=None, **kwargs ):
+    '''
+    Computes derivative based fields on the model levels of a WRF output
+    file one horizontal tile at a time, so that memory use is bounded by
+    the tile size instead of the domain size. Each tile is read from the
+    file with a one point halo, its fields are computed by wrf_pv, wrf_vort,
+    or wrf_absvort, and the interior of the tile is written into the
+    output variables, which match those of the whole grid, bit for bit.
+
+    Parameters
+    ----------
+    infilename: The name/path of the WRF output file to be read, or a file
+        opened with WRFSession.open
+    outfilename: The name/path of the output file to be written, or an
+        NCWriter. The fields are written with the dimensions ( time,
+        model_level, south_north, west_east ), which are created if needed.
+    fields: Any of PV (PVU), VORT (s^-1), and ABSVORT (s^-1).
+    tile: The size ( rows, columns ) of the tiles.
+    workers: The number of tiles computed at once on a thread pool. The
+        file is read and written by one thread at a time. None or 1
+        computes the tiles one after another.
+    Any other keyword arguments are NCWriter options.
+
+    Returns the NCWriter stats of the output file.
+    '''
+    for name in fields:
+        assert name in TILED_FIELDS, 'Unknown tiled field %s.' % name
+    infile = open_input( infilename )
+    outfile = open_output( outfilename, **kwargs )
+    ntimes, nz, ny, nx = infile.variables['T'].shape
+    for dim, size in ( ( 'time', None ), ( 'model_level', nz ), ( 'south_north', ny ), ( 'west_east', nx ) ):
+        if dim not in outfile.dataset.dimensions:
+            outfile.dataset.createDimension( dim, size )
+    for name in fields:
+        outfile.require( name, 'f4', ( 'time', 'model_level', 'south_north', 'west_east' ) )
+    dx = infile.getncattr( 'DX' )
+    io = threading.Lock()
+
+    def run( task ):
+        time, ( read, interior, local ) = task
+        ## the fields of a tile share their reads
+        cache = {}
+        def read_var( varname ):
+            if varname not in cache:
+                with io:
+                    cache[ varname ] = read_tile( infile, varname, time, read[0], read[1] )
+            return cache[ varname ]
+        for name in fields:
+            result = TILED_FIELDS[ name ]( read_var, dx )[ :, local[0], local[1] ]
+            with io:
+                outfile.write( name, ( time, slice( None ), interior[0], interior[1] ), result )
+
+    tasks = [ ( time, block ) for time in range( ntimes ) for block in tile_slices( ny, nx, tile ) ]
+    if workers is None or workers <= 1:
+        for task in tasks:
+            run( task )
+    else:
+        pool = ThreadPoolExecutor( max_workers=workers )
+        try:
+            list( pool.map( run, tasks ) )
+        finally:
+            pool.shutdown()
+    infile.close()
+    return outfile.close()
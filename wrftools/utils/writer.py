@@ -0,0 +1,228 @@
+## Protected under the GPL V2 License
+
+import os
+import time
+import numpy
+from wrftools import instrument
+
+__all__ = ['NCWriter', 'open_output', 'chunk_shape']
+
+def chunk_shape( dims, shape, itemsize, chunking='time', tile=16, times=24, max_bytes=4 * 1024**2 ):
+    '''
+    Picks the chunk shape of a variable for the way it will be read.
+
+    Parameters
+    ----------
+    dims - the dimension names of the variable
+    shape - the dimension sizes of the variable. An unlimited dimension
+        may have a size of 0.
+    itemsize - the number of bytes in one value
+    chunking - 'time' for chunks of one time step, the best shape for
+        reading maps and volumes a time at a time, or 'column' for chunks
+        of tile by tile columns spanning times time steps and every level,
+        the best shape for reading station time series.
+    tile - the horizontal width of column chunks
+    times - the number of time steps in a column chunk
+    max_bytes - the largest chunk of a 'time' chunked variable. Levels,
+        then rows, are split off until a chunk fits.
+
+    Returns
+    -------
+    chunks - a list of chunk sizes, one per dimension
+    '''
+    assert chunking in ( 'time', 'column' ), "chunking must be 'time' or 'column'"
+    chunks = []
+    for dim, size in zip( dims, shape ):
+        size = max( size, 1 )
+        if tuple( dims ) == ( 'time', ):
+            ## a time series such as XTIME is always read whole
+            chunks.append( 1024 )
+        elif dim == 'time':
+            chunks.append( 1 if chunking == 'time' else times )
+        elif chunking == 'column' and dim in ( 'south_north', 'west_east' ):
+            chunks.append( min( size, tile ) )
+        else:
+            chunks.append( size )
+    if chunking == 'time':
+        def nbytes():
+            total = itemsize
+            for size in chunks:
+                total *= size
+            return total
+        for dim in ( 'bottom_top', 'south_north' ):
+            if dim not in dims:
+                continue
+            i = list( dims ).index( dim )
+            while nbytes() > max_bytes and chunks[i] > 1:
+                chunks[i] = ( chunks[i] + 1 ) // 2
+    return chunks
+
+class NCWriter( object ):
+    '''
+    Writes the variables of a post-processed netCDF4 file with chunking,
+    compression, and optional lossy quantization, and buffers the writes
+    to every variable until buffer_bytes of data are waiting, so that the
+    data is written in large blocks. An NCWriter can be passed to any
+    wrftools function that takes an output filename, so that one set of
+    output options applies to a whole file.
+
+    Parameters
+    ----------
+    filename - the name/path of the netCDF file
+    mode - 'w' to create the file, or 'a' to add to an existing file
+    chunking - 'time', 'column', or None for the netCDF default chunks.
+        See chunk_shape.
+    zlib - if True, compress the variables
+    complevel - the zlib compression level, from 1 (fastest) to 9 (smallest)
+    shuffle - if True, apply the HDF5 shuffle filter before compressing,
+        which usually makes floating point data compress much better
+    least_significant_digit - if given, quantize the data so that it keeps
+        this many decimal places (lossy)
+    significant_digits - if given, quantize the data so that it keeps this
+        many significant digits (lossy, needs netCDF4 1.6 or newer)
+    buffer_bytes - the number of bytes of writes held before they are
+        written to the file
+
+    Writes are held by reference, so arrays passed to write must not be
+    changed until the writer is flushed or closed. Every open_output of a
+    writer must be matched by a close, and the file is closed by the last one.
+
+    EXAMPLE:
+    with NCWriter( 'post.nc', 'w', chunking='time', complevel=4, significant_digits=4 ) as writer:
+        wrf_copy_attributes( 'wrfout_d01_2014-05-20_00:00:00', writer, 10 )
+        wrf_copy_sfc_fields( 'wrfout_d01_2014-05-20_00:00:00', writer )
+    print( writer.stats() )
+    '''
+    def __init__( self, filename, mode='a', chunking='time', zlib=True, complevel=1, shuffle=True,
+        least_significant_digit=None, significant_digits=None, buffer_bytes=64 * 1024**2 ):
+        assert chunking in ( 'time', 'column', None ), "chunking must be 'time', 'column', or None"
+        self.filename = filename
+        self.chunking = chunking
+        self.zlib = zlib
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.least_significant_digit = least_significant_digit
+        self.significant_digits = significant_digits
+        self.buffer_bytes = buffer_bytes
+        from netCDF4 import Dataset
+        self.dataset = Dataset( filename, mode, format='NETCDF4' )
+        self.nbytes = 0
+        self.nwrites = 0
+        self.seconds = 0.
+        self._buffer = []
+        self._buffered = 0
+        self._users = 1
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    @property
+    def variables( self ):
+        return self.dataset.variables
+
+    def create( self, name, datatype, dimensions, **kwargs ):
+        '''
+        Creates a variable with the chunking, compression, and quantization
+        of the writer. Any keyword arguments of
+        netCDF4.Dataset.createVariable override those of the writer.
+        '''
+        if isinstance( dimensions, str ):
+            dimensions = ( dimensions, )
+        options = { 'zlib': self.zlib, 'complevel': self.complevel, 'shuffle': self.shuffle }
+        if self.least_significant_digit is not None:
+            options['least_significant_digit'] = self.least_significant_digit
+        if self.significant_digits is not None:
+            options['significant_digits'] = self.significant_digits
+        if self.chunking is not None and len( dimensions ) > 0:
+            var_dims = self.dataset.dimensions
+            shape = [ len( var_dims[ dim ] ) for dim in dimensions ]
+            itemsize = numpy.dtype( datatype ).itemsize
+            options['chunksizes'] = chunk_shape( dimensions, shape, itemsize, self.chunking )
+        options.update( kwargs )
+        return self.dataset.createVariable( name, datatype, dimensions, **options )
+
+    def require( self, name, datatype, dimensions, **kwargs ):
+        '''
+        Returns variable name if the file already has it, and otherwise
+        creates it like create, so that a file can be appended to. Raises
+        ValueError if the variable the file has is on other dimensions.
+        '''
+        if isinstance( dimensions, str ):
+            dimensions = ( dimensions, )
+        if name in self.dataset.variables:
+            var = self.dataset.variables[ name ]
+            if tuple( var.dimensions ) != tuple( dimensions ):
+                raise ValueError( 'Variable %s of %s has the dimensions %s, not %s.' % ( name,
+                    self.dataset.filepath(), tuple( var.dimensions ), tuple( dimensions ) ) )
+            return var
+        return self.create( name, datatype, dimensions, **kwargs )
+
+    def write( self, name, index, data ):
+        '''
+        Queues data to be written to variable name at index, and writes
+        everything queued once buffer_bytes of data are waiting.
+        '''
+        self._buffer.append( ( name, index, data ) )
+        self._buffered += getattr( data, 'nbytes', 0 )
+        if self._buffered >= self.buffer_bytes:
+            self.flush()
+
+    def flush( self ):
+        '''
+        Writes everything queued, one variable at a time.
+        '''
+        start = time.time()
+        buffer, self._buffer, self._buffered = self._buffer, [], 0
+        order = sorted( range( len( buffer ) ), key=lambda i: buffer[i][0] )
+        prof = instrument.active()
+        for i in order:
+            name, index, data = buffer[i]
+            var = self.dataset.variables[ name ]
+            started = time.time()
+            var[ index ] = data
+            nbytes = numpy.size( data ) * var.dtype.itemsize
+            self.nbytes += nbytes
+            self.nwrites += 1
+            if prof is not None:
+                prof.record_write( os.path.abspath( self.filename ), name, nbytes, time.time() - started )
+        self.dataset.sync()
+        self.seconds += time.time() - start
+
+    def stats( self ):
+        '''
+        Returns a dictionary with the number of bytes of data written, the
+        number of writes, the seconds spent writing, the throughput in MB
+        per second, and the size of the file on disk.
+        '''
+        return { 'bytes': self.nbytes, 'writes': self.nwrites, 'seconds': self.seconds,
+            'mb_per_s': self.nbytes / 1e6 / self.seconds if self.seconds > 0 else 0.,
+            'file_bytes': os.path.getsize( self.filename ) }
+
+    def close( self ):
+        '''
+        Writes everything queued, and closes the file if this is the close
+        of the last user of the writer. Returns the stats.
+        '''
+        if not self.dataset.isopen():
+            return self.stats()
+        self.flush()
+        self._users -= 1
+        if self._users <= 0:
+            self.dataset.close()
+        return self.stats()
+
+def open_output( outfile, mode='a', **kwargs ):
+    '''
+    Returns an NCWriter for outfile, which is either a filename or an
+    NCWriter. A filename gets a new writer with the options in kwargs,
+    which closes the file when it is closed. An NCWriter is returned as it
+    is, with one more user, so closing it through a wrftools function only
+    flushes it.
+    '''
+    if isinstance( outfile, NCWriter ):
+        outfile._users += 1
+        return outfile
+    return NCWriter( outfile, mode, **kwargs )
@@ -1,8 +1,20 @@
-from thermo import *
-from winds import *
-from vertical import *
-from other import *
+from wrftools._lazy import lazy_module
+
 __version__ = '1.5'
-__all__ = ['wrf_theta', 'wrf_temp', 'wrf_rh', 'wrf_dewp']
+__all__ = ['wrf_theta', 'wrf_temp', 'wrf_rh', 'wrf_dewp', 'wrf_thermo']
 __all__ += ['wrf_vort', 'wrf_absvort', 'wrf_pv', 'wrf_pressure']
-__all__ += ['wrf_height', 'wrf_slp']
+__all__ += ['wrf_height', 'wrf_slp', 'wrf_slp_from_sfc']
+__all__ += ['wrf_kinematics', 'wrf_cgrid_vort', 'wrf_cgrid_absvort', 'wrf_cgrid_div', 'wrf_cgrid_deformation']
+__all__ += ['wrf_parcel', 'pseudo_adiabat_table']
+__all__ += ['wrf_shear']
+
+lazy_module( __name__, globals(), {
+    'wrf_theta': 'thermo', 'wrf_temp': 'thermo', 'wrf_rh': 'thermo', 'wrf_dewp': 'thermo', 'wrf_thermo': 'thermo',
+    'wrf_vort': 'winds', 'wrf_absvort': 'winds', 'wrf_pv': 'winds',
+    'wrf_pressure': 'vertical', 'wrf_height': 'vertical',
+    'wrf_slp': 'other', 'wrf_slp_from_sfc': 'other',
+    'wrf_kinematics': 'kinematics', 'wrf_cgrid_vort': 'kinematics', 'wrf_cgrid_absvort': 'kinematics',
+    'wrf_cgrid_div': 'kinematics', 'wrf_cgrid_deformation': 'kinematics',
+    'wrf_parcel': 'parcel', 'pseudo_adiabat_table': 'parcel',
+    'wrf_shear': 'shear',
+}, submodules=( 'thermo', 'winds', 'vertical', 'other', 'kinematics', 'parcel', 'shear' ) )
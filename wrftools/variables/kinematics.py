@@ -0,0 +1,139 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
+
+__all__ = ['wrf_kinematics', 'wrf_cgrid_vort', 'wrf_cgrid_absvort', 'wrf_cgrid_div', 'wrf_cgrid_deformation']
+
+KINEMATICS_FIELDS = ( 'VORT', 'ABSVORT', 'DIV', 'STRETCH', 'SHEAR' )
+
+def _map_factor( MAPFAC ):
+    ## map factors do not change in time, so use the first time of a
+    ## map factor read with its Time dimension
+    MAPFAC = numpy.asarray( MAPFAC, dtype=float )
+    while MAPFAC.ndim > 2:
+        MAPFAC = MAPFAC[0]
+    return MAPFAC
+
+@timed
+def wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy, fields=KINEMATICS_FIELDS, F=None, out=None, dtype=None ):
+    """ Calculate any of relative vorticity, absolute vorticity, divergence, and stretching and
+    shearing deformation on the mass grid directly from the staggered WRF U and V winds, without
+    unstaggering them first. U is on the west_east_stag grid and V on the south_north_stag grid,
+    as they are written by WRF, and the derivatives include the map scale factors. Vorticity and
+    shearing deformation use the same stencil as WRF's own absolute vorticity diagnostic, which
+    averages the staggered winds to the mass point and differences across two grid lengths.
+    Divergence and stretching deformation difference the staggered winds across one grid length.
+    Each 2D slab is computed in one pass into the output arrays. The map factor and grid
+    spacing coefficients are formed in float64 and then rounded once to dtype.
+    ---------------------
+    U (numpy.ndarray): ndarray of staggered U values in m/s, shape (..., south_north, west_east_stag)
+    V (numpy.ndarray): ndarray of staggered V values in m/s, shape (..., south_north_stag, west_east)
+    MAPFAC_U (numpy.ndarray): 2D map scale factor on the U grid
+    MAPFAC_V (numpy.ndarray): 2D map scale factor on the V grid
+    MAPFAC_M (numpy.ndarray): 2D map scale factor on the mass grid
+    dx (float): grid spacing in the x direction in meters
+    dy (float): grid spacing in the y direction in meters
+    fields (sequence of str): any of 'VORT', 'ABSVORT', 'DIV', 'STRETCH', and 'SHEAR'
+    F (numpy.ndarray): Coriolis sine latitude values in s^-1 on the mass grid. Needed for 'ABSVORT'.
+        Either 2D, or with the first of the leading dimensions of U, such as the (Time, south_north,
+        west_east) that WRF writes it with.
+    out (dict): optional dict of preallocated arrays on the mass grid, keyed by field name
+    dtype (numpy.dtype): the precision of the computation and of new output arrays. Defaults to
+        the wrftools precision.
+    ---------------------
+    returns:
+        dict of numpy.ndarray in s^-1 keyed by field name, shape (..., south_north, west_east)
+    """
+    for name in fields:
+        assert name in KINEMATICS_FIELDS, 'Unknown field %s.' % name
+    assert 'ABSVORT' not in fields or F is not None, 'F is needed for absolute vorticity.'
+    ny, nx = U.shape[-2], V.shape[-1]
+    lead = U.shape[:-2]
+    assert U.shape[-1] == nx + 1 and V.shape[-2] == ny + 1 and V.shape[:-2] == lead, 'U and V must be on the WRF staggered grids.'
+    shape = lead + ( ny, nx )
+    dtype = resolve_dtype( dtype )
+    if out is None:
+        out = {}
+    outputs = {}
+    for name in fields:
+        outputs[name] = out[name] if name in out else numpy.empty( shape, dtype=dtype )
+
+    ## stencil offsets, clipped to one sided differences at the edges
+    jp1 = numpy.minimum( numpy.arange( ny ) + 1, ny - 1 )
+    jm1 = numpy.maximum( numpy.arange( ny ) - 1, 0 )
+    ip1 = numpy.minimum( numpy.arange( nx ) + 1, nx - 1 )
+    im1 = numpy.maximum( numpy.arange( nx ) - 1, 0 )
+    mm = _map_factor( MAPFAC_M )**2
+    ## 0.5 * mm / ds, which multiplies the sum of the two averaged differences
+    cy = ( 0.5 * mm / ( ( jp1 - jm1 ) * float( dy ) )[:, None] ).astype( dtype )
+    cx = ( 0.5 * mm / ( ( ip1 - im1 ) * float( dx ) )[None, :] ).astype( dtype )
+    mmdx = ( mm / float( dx ) ).astype( dtype )
+    mmdy = ( mm / float( dy ) ).astype( dtype )
+    inv_msfu = ( 1. / _map_factor( MAPFAC_U ) ).astype( dtype )
+    inv_msfv = ( 1. / _map_factor( MAPFAC_V ) ).astype( dtype )
+    vort = [ name for name in fields if name in ( 'VORT', 'ABSVORT', 'SHEAR' ) ]
+    div = [ name for name in fields if name in ( 'DIV', 'STRETCH' ) ]
+    F = None if F is None else numpy.asarray( F, dtype=dtype )
+
+    for idx in numpy.ndindex( *lead ):
+        uu = as_dtype( U[idx], dtype ) * inv_msfu
+        vv = as_dtype( V[idx], dtype ) * inv_msfv
+        if vort:
+            usum = uu[:, :-1] + uu[:, 1:]
+            vsum = vv[:-1] + vv[1:]
+            dudy = ( usum[jp1] - usum[jm1] ) * cy
+            dvdx = ( vsum[:, ip1] - vsum[:, im1] ) * cx
+            if 'VORT' in outputs:
+                numpy.subtract( dvdx, dudy, out=outputs['VORT'][idx] )
+            if 'ABSVORT' in outputs:
+                ## F has none, some, or all of the leading dimensions of U,
+                ## e.g. ( Time, south_north, west_east ) as WRF writes it
+                f = F[ idx[:F.ndim - 2] ]
+                absvort = outputs['ABSVORT'][idx]
+                numpy.subtract( dvdx, dudy, out=absvort )
+                absvort += f
+            if 'SHEAR' in outputs:
+                numpy.add( dvdx, dudy, out=outputs['SHEAR'][idx] )
+        if div:
+            dudx = ( uu[:, 1:] - uu[:, :-1] ) * mmdx
+            dvdy = ( vv[1:] - vv[:-1] ) * mmdy
+            if 'DIV' in outputs:
+                numpy.add( dudx, dvdy, out=outputs['DIV'][idx] )
+            if 'STRETCH' in outputs:
+                numpy.subtract( dudx, dvdy, out=outputs['STRETCH'][idx] )
+    return outputs
+
+@timed
+def wrf_cgrid_vort( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy ):
+    """ Calculate the relative vorticity in s^-1 on the mass grid from the staggered WRF
+    U and V winds. See wrf_kinematics for the arguments.
+    """
+    return wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy, fields=( 'VORT', ) )['VORT']
+
+@timed
+def wrf_cgrid_absvort( U, V, F, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy ):
+    """ Calculate the absolute vorticity in s^-1 on the mass grid from the staggered WRF
+    U and V winds and the Coriolis sine latitude term (F), which is 2D or has the first of the leading
+    dimensions of U, such as Time. See wrf_kinematics for the arguments.
+    """
+    return wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy, fields=( 'ABSVORT', ), F=F )['ABSVORT']
+
+@timed
+def wrf_cgrid_div( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy ):
+    """ Calculate the horizontal divergence in s^-1 on the mass grid from the staggered WRF
+    U and V winds. See wrf_kinematics for the arguments.
+    """
+    return wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy, fields=( 'DIV', ) )['DIV']
+
+@timed
+def wrf_cgrid_deformation( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy ):
+    """ Calculate the stretching and shearing deformation in s^-1 on the mass grid from the
+    staggered WRF U and V winds. See wrf_kinematics for the arguments.
+    ---------------------
+    returns:
+        tuple of numpy.ndarray ( stretching, shearing )
+    """
+    out = wrf_kinematics( U, V, MAPFAC_U, MAPFAC_V, MAPFAC_M, dx, dy, fields=( 'STRETCH', 'SHEAR' ) )
+    return out['STRETCH'], out['SHEAR']
@@ -1,11 +1,52 @@
 import numpy
-from netCDF4 import Dataset
-def wrf_slp( infilename, outfilename ):
-    infile = Dataset( infilename )
-    outfile = Dataset( outfilename, 'a' )            
-    stemps = infile.variables['T2'][:]+6.5*infile.variables['HGT'][:]/1000.
-    SLP_in = infile.variables['PSFC'][:]*numpy.exp(9.81/(287.0*stemps)*infile.variables['HGT'][:])*0.01 + (6.7 * infile.variables['HGT'][:] / 1000)
-    SLP = outfile.createVariable( 'SLP', 'f4', ('time', 'south_north', 'west_east') )
-    SLP[:] = SLP_in    
+from wrftools.utils.session import open_input
+from wrftools.utils.writer import open_output
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
+
+@timed
+def wrf_slp_from_sfc( T2, PSFC, HGT, dtype=None ):
+    """ Calculate the sea level pressure in hPa given the 2 meter temperature (T2) in Kelvin,
+    the surface pressure (PSFC) in Pa, and the terrain height (HGT) in meters.
+    T2, PSFC, and HGT must be the same shape.
+    ---------------------
+    T2 (numpy.ndarray): ndarray of 2 meter temperature in degrees Kelvin
+    PSFC (numpy.ndarray): ndarray of surface pressure in Pa
+    HGT (numpy.ndarray): ndarray of terrain height in meters
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
+    ---------------------
+    returns:
+        numpy.ndarray of sea level pressure in hPa same shape as T2
+    """
+    dtype = resolve_dtype( dtype )
+    T2, PSFC, HGT = as_dtype( T2, dtype ), as_dtype( PSFC, dtype ), as_dtype( HGT, dtype )
+    stemps = T2 + 6.5 * HGT / 1000.
+    return PSFC * numpy.exp( 9.81 / ( 287.0 * stemps ) * HGT ) * 0.01 + ( 6.7 * HGT / 1000 )
+
+@timed
+def wrf_slp( infilename, outfilename, chunk=None, **kwargs ):
+    """ Calculate the sea level pressure from the surface fields of a WRF output file and
+    write it to the SLP variable of a post-processed file created by wrf_copy_attributes.
+    ---------------------
+    infilename (str): The name/path of the WRF output file to be read, or a file opened with WRFSession.open
+    outfilename (str): The name/path of the output file to be written, or an NCWriter
+    chunk (int): number of time steps to read and write at once. Defaults to all of them.
+    start (int): the first time to process, so new times can be appended. Defaults to 0.
+    Any other keyword arguments are NCWriter options.
+    ---------------------
+    returns:
+        dict of the NCWriter stats of the output file
+    """
+    start = kwargs.pop( 'start', 0 )
+    infile = open_input( infilename )
+    outfile = open_output( outfilename, **kwargs )
+    outfile.require( 'SLP', 'f4', ('time', 'south_north', 'west_east') )
+    ntimes = infile.variables['T2'].shape[0]
+    if chunk is None:
+        chunk = max( ntimes - start, 1 )
+    for begin in range( start, ntimes, chunk ):
+        times = slice( begin, min( begin + chunk, ntimes ) )
+        outfile.write( 'SLP', times, wrf_slp_from_sfc( infile.read( 'T2', times ), infile.read( 'PSFC', times ),
+            infile.read( 'HGT', times ) ) )
     infile.close()
-    outfile.close() 
+    return outfile.close() 
\ No newline at end of file
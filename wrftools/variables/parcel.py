@@ -0,0 +1,259 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype
+
+__all__ = ['wrf_parcel', 'pseudo_adiabat_table']
+
+PARCEL_FIELDS = ( 'CAPE', 'CIN', 'LCL', 'LFC', 'EL' )
+
+## constants, with the Poisson constant used by wrf_temp
+K = 0.2854
+Rd = 287.04 ## J K-1 Kg-1
+cp = 1005.7 ## J K-1 Kg-1
+Lv = 2.501 * 10**6 ## J Kg-1
+eps = 0.622
+g = 9.81 ## m s-2
+
+## the pseudo-adiabat table, built on first use
+_TABLE = None
+
+def _sat_mixing_ratio( TEMP, PRES ):
+    ## Bolton (1980) saturation vapor pressure, in mb
+    e_s = 6.112 * numpy.exp( 17.67 * ( TEMP - 273.15 ) / ( TEMP - 29.65 ) )
+    return eps * e_s / numpy.maximum( PRES - e_s, 1e-3 * PRES )
+
+def _theta_e( TEMP, PRES, QVAPOR ):
+    ## Bolton (1980) equivalent potential temperature and the
+    ## temperature and pressure of the lifted condensation level
+    q = numpy.maximum( QVAPOR, 1e-10 )
+    e = q * PRES / ( eps + q )
+    a = numpy.log( e / 6.112 )
+    DEWP = numpy.minimum( 243.5 * a / ( 17.67 - a ) + 273.15, TEMP )
+    T_L = 1. / ( 1. / ( DEWP - 56. ) + numpy.log( TEMP / DEWP ) / 800. ) + 56.
+    P_L = PRES * ( T_L / TEMP )**( 1. / K )
+    r = 1000. * q
+    thetae = TEMP * ( 1000. / PRES )**( K * ( 1. - 0.28e-3 * r ) ) * numpy.exp( ( 3.376 / T_L - 0.00254 ) * r * ( 1. + 0.81e-3 * r ) )
+    return thetae, T_L, P_L
+
+@timed
+def pseudo_adiabat_table( tmin=200., tmax=310., dt=0.2, pmax=1100., pmin=10., dlnp=0.01 ):
+    """ Integrate the pseudo-adiabats through 1000 hPa temperatures from tmin to tmax every dt
+    with a 4th order Runge Kutta scheme in log pressure, from pmax to pmin every dlnp. The
+    default table is built once, on the first call to wrf_parcel, and is reused by every later call.
+    ---------------------
+    tmin, tmax, dt (float): the range and spacing of the 1000 hPa temperatures in degrees Kelvin
+    pmax, pmin (float): the pressure range of the table in hPa
+    dlnp (float): the spacing of the table in log pressure
+    ---------------------
+    returns:
+        tuple ( T1000, lnp, TEMP ) of the 1D 1000 hPa temperatures of the rows, the 1D log
+        pressures of the columns in decreasing order, and the 2D temperatures in degrees Kelvin
+        along each pseudo-adiabat
+    """
+    T1000 = numpy.arange( tmin, tmax + dt / 2., dt )
+    lnp = numpy.log( pmax ) - dlnp * numpy.arange( int( numpy.ceil( numpy.log( pmax / pmin ) / dlnp ) ) + 1 )
+    def lapse( TEMP, lnpres ):
+        ## dT / dlnp along a pseudo-adiabat
+        r_s = _sat_mixing_ratio( TEMP, numpy.exp( lnpres ) )
+        return ( Rd * TEMP + Lv * r_s ) / ( cp + Lv * Lv * r_s * eps / ( Rd * TEMP * TEMP ) )
+    def step( TEMP, lnpres, h ):
+        k1 = lapse( TEMP, lnpres )
+        k2 = lapse( TEMP + 0.5 * h * k1, lnpres + 0.5 * h )
+        k3 = lapse( TEMP + 0.5 * h * k2, lnpres + 0.5 * h )
+        k4 = lapse( TEMP + h * k3, lnpres + h )
+        return TEMP + h * ( k1 + 2. * k2 + 2. * k3 + k4 ) / 6.
+    ## integrate up and down from 1000 hPa to the table levels
+    TEMP = numpy.empty( ( T1000.shape[0], lnp.shape[0] ) )
+    k1000 = numpy.searchsorted( -lnp, -numpy.log( 1000. ) )
+    for levels in ( range( k1000, lnp.shape[0] ), range( k1000 - 1, -1, -1 ) ):
+        T, lnpres = T1000.copy(), numpy.log( 1000. )
+        for k in levels:
+            T = step( T, lnpres, lnp[k] - lnpres )
+            lnpres = lnp[k]
+            TEMP[:, k] = T
+    return T1000, lnp, TEMP
+
+def _columns( table, PRES ):
+    ## fractional column of PRES in the table
+    lnp = table[1]
+    fj = numpy.clip( ( lnp[0] - numpy.log( PRES ) ) / ( lnp[0] - lnp[1] ), 0, lnp.shape[0] - 1 )
+    j0 = numpy.minimum( fj.astype( int ), lnp.shape[0] - 2 )
+    return j0, fj - j0
+
+def _row( table, TEMP, PRES ):
+    ## fractional row of the pseudo-adiabat through TEMP and PRES, found by
+    ## bisection, since the temperatures increase along every column
+    TABLE = table[2]
+    j0, t = _columns( table, PRES )
+    def at( i ):
+        return ( 1 - t ) * TABLE[i, j0] + t * TABLE[i, j0 + 1]
+    lo = numpy.zeros( j0.shape, dtype=int )
+    hi = numpy.full( j0.shape, TABLE.shape[0] - 1 )
+    while ( hi - lo > 1 ).any():
+        mid = ( lo + hi ) // 2
+        below = at( mid ) <= TEMP
+        lo = numpy.where( below, mid, lo )
+        hi = numpy.where( below, hi, mid )
+    T0 = at( lo )
+    return lo + numpy.clip( ( TEMP - T0 ) / ( at( hi ) - T0 ), 0, 1 )
+
+def _moist_temp( table, row, PRES ):
+    ## bilinear lookup of the temperature at PRES on the pseudo-adiabat at row
+    TABLE = table[2]
+    j0, t = _columns( table, PRES )
+    i0 = numpy.minimum( row.astype( int ), TABLE.shape[0] - 2 )
+    s = row - i0
+    return ( ( 1 - s ) * ( ( 1 - t ) * TABLE[i0, j0] + t * TABLE[i0, j0 + 1] )
+        + s * ( ( 1 - t ) * TABLE[i0 + 1, j0] + t * TABLE[i0 + 1, j0 + 1] ) )
+
+def _integrate( HGT, B, lo, hi ):
+    ## integral of the piecewise linear B over heights between lo and hi
+    total = numpy.zeros( lo.shape )
+    for k in range( HGT.shape[0] - 1 ):
+        z0, z1 = HGT[k], HGT[k + 1]
+        slope = ( B[k + 1] - B[k] ) / ( z1 - z0 )
+        a = numpy.maximum( z0, lo )
+        b = numpy.minimum( z1, hi )
+        area = ( B[k] + slope * ( 0.5 * ( a + b ) - z0 ) ) * ( b - a )
+        total += numpy.where( b > a, area, 0. )
+    return total
+
+def _crossing( HGT, B, k ):
+    ## height where B crosses zero between levels k and k + 1
+    B0 = numpy.take_along_axis( B, k[None], axis=0 )[0]
+    B1 = numpy.take_along_axis( B, k[None] + 1, axis=0 )[0]
+    z0 = numpy.take_along_axis( HGT, k[None], axis=0 )[0]
+    z1 = numpy.take_along_axis( HGT, k[None] + 1, axis=0 )[0]
+    with numpy.errstate( divide='ignore', invalid='ignore' ):
+        frac = numpy.clip( numpy.where( ( B0 > 0 ) != ( B1 > 0 ), B0 / ( B0 - B1 ), 0. ), 0, 1 )
+    return z0 + frac * ( z1 - z0 )
+
+def _lift( table, TEMP, PRES, HGT, QVAPOR, parcel, mldepth, mudepth ):
+    ## parcel indices for one time, with arrays of shape ( nz, ny, nx )
+    nz = TEMP.shape[0]
+    levels = numpy.arange( nz )[:, None, None]
+    k0 = numpy.zeros( TEMP.shape[1:], dtype=int )
+    if parcel == 'sb':
+        T0, P0, Q0 = TEMP[0], PRES[0], QVAPOR[0]
+    elif parcel == 'ml':
+        ## pressure weighted mean potential temperature and mixing ratio over the lowest mldepth hPa
+        top = PRES[0] - mldepth
+        edges = numpy.concatenate( [ PRES[:1], 0.5 * ( PRES[:-1] + PRES[1:] ), PRES[-1:] ] )
+        weight = numpy.maximum( edges[:-1] - numpy.maximum( edges[1:], top ), 0. )
+        total = weight.sum( axis=0 )
+        P0 = PRES[0]
+        T0 = ( weight * TEMP * ( 1000. / PRES )**K ).sum( axis=0 ) / total * ( P0 / 1000. )**K
+        Q0 = ( weight * QVAPOR ).sum( axis=0 ) / total
+    else:
+        ## the parcel with the highest equivalent potential temperature in the lowest mudepth hPa
+        search = PRES >= PRES[0] - mudepth
+        nk = max( int( search.any( axis=( 1, 2 ) ).sum() ), 1 )
+        thetae = _theta_e( TEMP[:nk], PRES[:nk], QVAPOR[:nk] )[0]
+        k0 = numpy.argmax( numpy.where( search[:nk], thetae, -numpy.inf ), axis=0 )
+        T0, P0, Q0 = [ numpy.take_along_axis( arr, k0[None], axis=0 )[0] for arr in ( TEMP, PRES, QVAPOR ) ]
+    Z0 = numpy.take_along_axis( HGT, k0[None], axis=0 )[0]
+    T_L, P_L = _theta_e( T0, P0, Q0 )[1:]
+    theta = T0 * ( 1000. / P0 )**K
+    row = _row( table, T_L, P_L )
+
+    ## virtual temperature buoyancy of the parcel, dry below the LCL and
+    ## saturated along the pseudo-adiabat through the LCL above it
+    B = numpy.empty( TEMP.shape )
+    for k in range( nz ):
+        dry = PRES[k] >= P_L
+        Tp = numpy.where( dry, theta * ( PRES[k] / 1000. )**K, _moist_temp( table, row, PRES[k] ) )
+        Qp = numpy.where( dry, Q0, _sat_mixing_ratio( Tp, PRES[k] ) )
+        Tv_env = TEMP[k] * ( 1. + 0.61 * QVAPOR[k] )
+        B[k] = g * ( Tp * ( 1. + 0.61 * Qp ) - Tv_env ) / Tv_env
+
+    ## height of the LCL, interpolated in log pressure
+    count = ( PRES > P_L ).sum( axis=0 )
+    kl = numpy.clip( count - 1, 0, nz - 2 )
+    p0, p1 = [ numpy.take_along_axis( PRES, kk[None], axis=0 )[0] for kk in ( kl, kl + 1 ) ]
+    z0, z1 = [ numpy.take_along_axis( HGT, kk[None], axis=0 )[0] for kk in ( kl, kl + 1 ) ]
+    frac = numpy.clip( numpy.log( p0 / P_L ) / numpy.log( p0 / p1 ), 0, 1 )
+    LCL = numpy.maximum( z0 + frac * ( z1 - z0 ), Z0 )
+
+    ## the EL is the top of the highest positively buoyant layer, and the
+    ## LFC the bottom of the lowest positively buoyant layer above the LCL
+    pos = ( B > 0 ) & ( levels >= k0 )
+    above = pos & ( PRES <= P_L )
+    found = above.any( axis=0 )
+    down = pos[:-1] & ~pos[1:]
+    kel = nz - 2 - numpy.argmax( down[::-1], axis=0 )
+    EL = numpy.where( pos[-1], HGT[-1], _crossing( HGT, B, kel ) )
+    kf = numpy.maximum( numpy.argmax( above, axis=0 ) - 1, 0 )
+    LFC = numpy.maximum( _crossing( HGT, B, kf ), LCL )
+    LFC = numpy.where( found, LFC, numpy.nan )
+    EL = numpy.where( found, EL, numpy.nan )
+    CAPE = numpy.maximum( _integrate( HGT, B, LFC, EL ), 0. )
+    CIN = numpy.where( found, numpy.minimum( _integrate( HGT, B, Z0, LFC ), 0. ), 0. )
+    return { 'CAPE': CAPE, 'CIN': CIN, 'LCL': LCL, 'LFC': LFC, 'EL': EL }
+
+@timed
+def wrf_parcel( TEMP, PRES, HGT, QVAPOR, parcel='sb', TER=None, fields=PARCEL_FIELDS, mldepth=100., mudepth=300., out=None, dtype=None ):
+    """ Lift a surface based ('sb'), mixed layer ('ml'), or most unstable ('mu') parcel in every
+    column at once and calculate its CAPE, CIN, and the heights of its LCL, LFC, and EL. The
+    parcel rises dry adiabatically to its Bolton (1980) LCL, and then along the pseudo-adiabat
+    through its LCL, which is looked up in a precomputed table (see pseudo_adiabat_table) instead
+    of being integrated column by column. Buoyancy uses the
+    virtual temperature of the parcel and environment. CAPE is integrated from the LFC to the EL,
+    and CIN from the parcel's starting level to the LFC. Columns without an LFC have zero CAPE and
+    CIN and NaN LFC and EL. The mixed layer parcel has the mean potential temperature and mixing
+    ratio of the lowest mldepth hPa, and the most unstable parcel is the level with the highest
+    equivalent potential temperature in the lowest mudepth hPa.
+    TEMP, PRES, and QVAPOR must be the same shape, with the vertical dimension third from last.
+    ---------------------
+    TEMP (numpy.ndarray): ndarray of temperature in degrees Kelvin from wrf_temp
+    PRES (numpy.ndarray): ndarray of pressure in hPa from wrf_pressure
+    HGT (numpy.ndarray): ndarray of geopotential height in meters from wrf_height, on either the
+        staggered or the mass levels
+    QVAPOR (numpy.ndarray): ndarray of Water Vapor Mixing Ratio from WRF
+    parcel (str): 'sb', 'ml', or 'mu'
+    TER (numpy.ndarray): terrain height in meters. If given, or if HGT is on the staggered levels,
+        whose lowest level is the ground, the LCL, LFC and EL are heights above ground level.
+        Otherwise they are heights above sea level.
+    fields (sequence of str): any of 'CAPE' (J/kg), 'CIN' (J/kg), 'LCL' (m), 'LFC' (m), and 'EL' (m)
+    mldepth (float): depth of the mixed layer in hPa
+    mudepth (float): depth in hPa searched for the most unstable parcel
+    out (dict): optional dict of preallocated arrays, keyed by field name
+    dtype (numpy.dtype): the precision of new output arrays. Defaults to the wrftools precision.
+        The parcels are lifted in float64 either way.
+    ---------------------
+    returns:
+        dict of numpy.ndarray keyed by field name, shape of TEMP without its vertical dimension
+    """
+    global _TABLE
+    assert TEMP.shape == PRES.shape == QVAPOR.shape, 'Arrays are different shapes. They must be the same shape.'
+    assert parcel in ( 'sb', 'ml', 'mu' ), "parcel must be 'sb', 'ml', or 'mu'"
+    for name in fields:
+        assert name in PARCEL_FIELDS, 'Unknown field %s.' % name
+    nz = TEMP.shape[-3]
+    HGT = numpy.asarray( HGT )
+    if HGT.shape[-3] == nz + 1:
+        if TER is None:
+            TER = HGT[..., 0, :, :]
+        HGT = 0.5 * ( HGT[..., :-1, :, :] + HGT[..., 1:, :, :] )
+    assert HGT.shape == TEMP.shape, 'HGT must be on the mass or staggered levels of TEMP.'
+    if _TABLE is None:
+        _TABLE = pseudo_adiabat_table()
+
+    lead = TEMP.shape[:-3]
+    shape = lead + TEMP.shape[-2:]
+    dtype = resolve_dtype( dtype )
+    if out is None:
+        out = {}
+    outputs = {}
+    for name in fields:
+        outputs[name] = out[name] if name in out else numpy.empty( shape, dtype=dtype )
+    for idx in numpy.ndindex( *lead ):
+        indices = _lift( _TABLE, numpy.asarray( TEMP[idx], dtype=float ), numpy.asarray( PRES[idx], dtype=float ),
+            numpy.asarray( HGT[idx], dtype=float ), numpy.asarray( QVAPOR[idx], dtype=float ), parcel, mldepth, mudepth )
+        for name in fields:
+            values = indices[name]
+            if TER is not None and name in ( 'LCL', 'LFC', 'EL' ):
+                values = values - ( TER if numpy.ndim( TER ) == 2 else TER[idx] )
+            outputs[name][idx] = values
+    return outputs
@@ -0,0 +1,132 @@
+## Protected under the GPL V2 License
+
+import numpy
+from wrftools.interp.weights import interp_weights, apply_weights
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype
+
+__all__ = ['wrf_shear']
+
+def _key( depth ):
+    ## 1000. -> '1', 500. -> '0.5'
+    return '%g' % ( depth / 1000. )
+
+def _layers( U, V, HGT, targets ):
+    ## wind, height, height integral of the wind, and cumulative helicity
+    ## cross term at each of the target heights, for arrays of shape ( nz, ny, nx ),
+    ## in float64 since the layer integrals are differences of running sums
+    lower, weight = interp_weights( HGT, targets, axis=0, dtype=numpy.float64 )
+    ## heights below the lowest level are taken from the lowest level
+    below = numpy.asarray( targets )[:, None, None] <= HGT[0]
+    weight[ below ] = 0.
+    uh = apply_weights( U, lower, weight, axis=0, dtype=numpy.float64 )
+    vh = apply_weights( V, lower, weight, axis=0, dtype=numpy.float64 )
+    zh = apply_weights( HGT, lower, weight, axis=0, dtype=numpy.float64 )
+
+    ## running sums up the column, zero at the lowest level
+    dz = HGT[1:] - HGT[:-1]
+    IU = numpy.zeros( U.shape )
+    IV = numpy.zeros( V.shape )
+    CROSS = numpy.zeros( U.shape )
+    numpy.cumsum( 0.5 * ( U[:-1] + U[1:] ) * dz, axis=0, out=IU[1:] )
+    numpy.cumsum( 0.5 * ( V[:-1] + V[1:] ) * dz, axis=0, out=IV[1:] )
+    numpy.cumsum( U[1:] * V[:-1] - U[:-1] * V[1:], axis=0, out=CROSS[1:] )
+
+    ## add the partial layer from the level below each target to the target
+    def take( arr ):
+        return numpy.take_along_axis( arr, lower, axis=0 )
+    uk, vk, zk = take( U ), take( V ), take( HGT )
+    iu = take( IU ) + 0.5 * ( uk + uh ) * ( zh - zk )
+    iv = take( IV ) + 0.5 * ( vk + vh ) * ( zh - zk )
+    cross = take( CROSS ) + uh * vk - uk * vh
+    return uh, vh, zh, iu, iv, cross
+
+@timed
+def wrf_shear( U, V, HGT, TER=None, shear_depths=(1000., 6000.), srh_depths=(1000., 3000.), storm_motion=None, out=None, dtype=None ):
+    """ Calculate the bulk wind shear, the Bunkers et al. (2000) right and left moving storm motions,
+    and the storm relative helicity for every column at once. The layer bounds of every column
+    are found in one batched search (see interp_weights), and the layer mean winds and helicity
+    integrals come from running sums up the column, so every layer is computed from one pass over
+    the vertical dimension. The lowest model level stands in for the ground, so the 0 km wind is
+    the wind at the lowest model level. The Bunkers motions are 7.5 m/s to either side of the
+    0-6 km mean wind, normal to the shear from the 0-500 m mean wind to the 5.5-6 km mean wind.
+    The helicity is relative to the right moving storm motion unless storm_motion is given.
+    U, V, and HGT must be on the mass grid, with the vertical dimension third from last.
+    ---------------------
+    U (numpy.ndarray): ndarray of unstaggered U wind in m/s
+    V (numpy.ndarray): ndarray of unstaggered V wind in m/s, same shape as U
+    HGT (numpy.ndarray): ndarray of height above ground level in meters, on the mass levels, or
+        of geopotential height from wrf_height on the staggered levels, whose lowest level is the ground
+    TER (numpy.ndarray): terrain height in meters, subtracted from HGT if given
+    shear_depths (sequence of float): depths in meters of the bulk shear layers
+    srh_depths (sequence of float): depths in meters of the helicity layers
+    storm_motion (tuple): optional ( u, v ) storm motion in m/s to compute the helicity with
+    out (dict): optional dict of preallocated arrays, keyed by field name
+    dtype (numpy.dtype): the precision of new output arrays. Defaults to the wrftools precision.
+        The layers are integrated in float64 either way.
+    ---------------------
+    returns:
+        dict of numpy.ndarray, shape of U without its vertical dimension, with the 0-6 km mean wind
+        'UMEAN' and 'VMEAN', the storm motions 'URM', 'VRM', 'ULM' and 'VLM' (m/s), the shear
+        vectors and magnitudes 'USHR1', 'VSHR1' and 'SHR1' for a depth of 1 km (m/s), and the
+        helicity 'SRH1' for a depth of 1 km (m2/s2), and likewise for the other depths.
+    """
+    assert U.shape == V.shape, 'Arrays are different shapes. They must be the same shape.'
+    nz = U.shape[-3]
+    HGT = numpy.asarray( HGT )
+    if HGT.shape[-3] == nz + 1:
+        if TER is None:
+            TER = HGT[..., 0, :, :]
+        HGT = 0.5 * ( HGT[..., :-1, :, :] + HGT[..., 1:, :, :] )
+    assert HGT.shape == U.shape, 'HGT must be on the mass or staggered levels of U.'
+
+    targets = sorted( set( [ 0., 500., 5500., 6000. ] + list( shear_depths ) + list( srh_depths ) ) )
+    index = dict( ( depth, i ) for i, depth in enumerate( targets ) )
+    names = [ 'UMEAN', 'VMEAN', 'URM', 'VRM', 'ULM', 'VLM' ]
+    for depth in shear_depths:
+        names += [ 'USHR' + _key( depth ), 'VSHR' + _key( depth ), 'SHR' + _key( depth ) ]
+    names += [ 'SRH' + _key( depth ) for depth in srh_depths ]
+    lead = U.shape[:-3]
+    shape = lead + U.shape[-2:]
+    dtype = resolve_dtype( dtype )
+    if out is None:
+        out = {}
+    outputs = {}
+    for name in names:
+        outputs[name] = out[name] if name in out else numpy.empty( shape, dtype=dtype )
+
+    for idx in numpy.ndindex( *lead ):
+        z = numpy.asarray( HGT[idx], dtype=float )
+        if TER is not None:
+            z = z - ( TER if numpy.ndim( TER ) == 2 else TER[idx] )
+        uh, vh, zh, iu, iv, cross = _layers( numpy.asarray( U[idx], dtype=float ),
+            numpy.asarray( V[idx], dtype=float ), z, targets )
+        def mean( bottom, top ):
+            b, t = index[bottom], index[top]
+            depth = zh[t] - zh[b]
+            return ( iu[t] - iu[b] ) / depth, ( iv[t] - iv[b] ) / depth
+        umean, vmean = mean( 0., 6000. )
+        ubot, vbot = mean( 0., 500. )
+        utop, vtop = mean( 5500., 6000. )
+        ushr, vshr = utop - ubot, vtop - vbot
+        scale = 7.5 / numpy.hypot( ushr, vshr )
+        outputs['UMEAN'][idx] = umean
+        outputs['VMEAN'][idx] = vmean
+        outputs['URM'][idx] = umean + scale * vshr
+        outputs['VRM'][idx] = vmean - scale * ushr
+        outputs['ULM'][idx] = umean - scale * vshr
+        outputs['VLM'][idx] = vmean + scale * ushr
+        for depth in shear_depths:
+            t = index[depth]
+            key = _key( depth )
+            outputs['USHR' + key][idx] = uh[t] - uh[0]
+            outputs['VSHR' + key][idx] = vh[t] - vh[0]
+            outputs['SHR' + key][idx] = numpy.hypot( uh[t] - uh[0], vh[t] - vh[0] )
+        if storm_motion is None:
+            cx, cy = umean + scale * vshr, vmean - scale * ushr
+        else:
+            cx, cy = storm_motion
+        for depth in srh_depths:
+            t = index[depth]
+            outputs['SRH' + _key( depth )][idx] = cross[t] - cross[0] + cx * ( vh[t] - vh[0] ) - cy * ( uh[t] - uh[0] )
+    return outputs
@@ -3,37 +3,45 @@
 ## http://tempestchasing.com
 ## Protected under the GPL V2 License
 
-from netCDF4 import Dataset
 import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
 
-__all__ = ['wrf_theta', 'wrf_temp', 'wrf_rh', 'wrf_dewp']
+__all__ = ['wrf_theta', 'wrf_temp', 'wrf_rh', 'wrf_dewp', 'wrf_thermo']
 
-def wrf_theta( T ):
+@timed
+def wrf_theta( T, dtype=None ):
     """ Calculate the potential temperature given the Perturbation Potential Temperature (T) in degrees Kelvin.
     ---------------------
     T (numpy.ndarray): ndarray of Perturbation Potential Temperature from WRF
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of potential temperature in degrees Kelvin, same shape as T
         """
-    return T + 300
+    return as_dtype( T, resolve_dtype( dtype ) ) + 300
 
-def wrf_temp( THETA, PRES ):
+@timed
+def wrf_temp( THETA, PRES, dtype=None ):
     """ Calculate the 'normal' temperature in degrees Kelvin given the 
     Potential Temperature (THETA in Kelvin) and Pressure (PRES in hPa or mb).
     PRES and THETA must be the same shape.
     ---------------------
     THETA (numpy.ndarray): ndarray of potential temperature in degrees Kelvin
     PRES (numpy.ndarray): ndarray of pressure in hPa or mb same shape as THETA
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of 'normal' temperature in degrees Kelvin same shape as THETA and PRES
         """
     assert THETA.shape == PRES.shape, 'Arrays are different shapes. They must be the same shape.'
+    dtype = resolve_dtype( dtype )
+    THETA, PRES = as_dtype( THETA, dtype ), as_dtype( PRES, dtype )
     K = 0.2854
     return THETA * ( PRES / 1000 )**K
 
-def wrf_rh( TEMP, PRES, QVAPOR ):
+@timed
+def wrf_rh( TEMP, PRES, QVAPOR, dtype=None ):
     """ Calculate relative humidity given the Temperature in Kelvin (TEMP), 
     Pressure in hPa or mb (PRES), and Water Vapor Mixing Ratio (QVAPOR).
     TEMP, PRES, and QVAPOR must be the same shape.
@@ -41,11 +49,14 @@ def wrf_rh( TEMP, PRES, QVAPOR ):
     TEMP (numpy.ndarray): ndarray of 'normal' temperature in degrees Kelvin
     PRES (numpy.ndarray): ndarray of pressure in hPa or mb same shape as TEMP
     QVAPOR (numpy.ndarray): ndarray of Water Vapor Mixing Ratio from WRF, same shape as PRES and TEMP
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of relative humidity values (%) same shape as TEMP, PRES, and QVAPOR
         """
     assert TEMP.shape == PRES.shape == QVAPOR.shape, 'Arrays are different shapes. They must be the same shape.'
+    dtype = resolve_dtype( dtype )
+    TEMP, PRES, QVAPOR = as_dtype( TEMP, dtype ), as_dtype( PRES, dtype ), as_dtype( QVAPOR, dtype )
     e_0 = 6.1173 ## mb
     t_0 = 273.16 ## K
     Rv = 461.50 ## J K-1 Kg-1
@@ -58,17 +69,21 @@ def wrf_rh( TEMP, PRES, QVAPOR ):
     w_s = ( 0.622 * e_s ) / ( PRES - e_s )
     return ( QVAPOR / w_s ) * 100
 
-def wrf_dewp( TEMP, PRES, QVAPOR ):
+@timed
+def wrf_dewp( TEMP, PRES, QVAPOR, dtype=None ):
     """ Calculate the dewpoint temperature in Celsius given the
 	Temperature (TEMP), Pressure (PRES), and Mixing Ratio
 	(QVAPOR). Arrays must be the same shape.
 
     ---------------------
     TEMP (numpy.ndarray): ndarray of 'normal' temperature in degrees Kelvin
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of dewpoint values (c) same shape as TEMP, PRES, and QVAPOR
 	"""
+    dtype = resolve_dtype( dtype )
+    TEMP, PRES, QVAPOR = as_dtype( TEMP, dtype ), as_dtype( PRES, dtype ), as_dtype( QVAPOR, dtype )
     ## constants for the Clausius Clapeyron Equation
     e_0 = 6.1173 ## mb
     t_0 = 273.16 ## K
@@ -90,3 +105,108 @@ def wrf_dewp( TEMP, PRES, QVAPOR ):
     K4 = numpy.log( e / e_0 )
     term1 = K2 - (K1_inv * K4)
     return 1 / term1
+
+@timed
+def wrf_thermo( T, P, PB, QVAPOR, fields=('THETA', 'TEMP', 'PRES', 'RH', 'DEWP', 'QVAPOR'), out=None, blocksize=65536, dtype=None ):
+    """ Calculate any of potential temperature, temperature, pressure, relative humidity,
+    dewpoint, and mixing ratio from the raw WRF Perturbation Potential Temperature (T),
+    Perturbation Pressure (P), Base State Pressure (PB), and Water Vapor Mixing Ratio (QVAPOR)
+    in one pass. This gives the same values as wrf_theta, wrf_pressure, wrf_temp, wrf_rh and
+    wrf_dewp, but the saturation vapor pressure is computed only once and shared by RH and
+    dewpoint. The arrays are processed blocksize elements at a time in preallocated buffers,
+    so the only full size arrays created are the requested outputs.
+    T, P, PB, and QVAPOR must be the same shape.
+    ---------------------
+    T (numpy.ndarray): ndarray of Perturbation Potential Temperature from WRF
+    P (numpy.ndarray): ndarray of Perturbation Pressure from WRF in Pa
+    PB (numpy.ndarray): ndarray of Base State Pressure from WRF in Pa
+    QVAPOR (numpy.ndarray): ndarray of Water Vapor Mixing Ratio from WRF
+    fields (sequence of str): the outputs to return. Any of 'THETA' (K), 'TEMP' (K),
+        'PRES' (hPa), 'RH' (%), 'DEWP' (K), and 'QVAPOR' (kg/kg).
+    out (dict): optional dict of preallocated, C-contiguous arrays the same shape as T,
+        keyed by field name, to write the outputs into.
+    blocksize (int): number of elements processed at once
+    dtype (numpy.dtype): the precision of the computation and of new output arrays. Defaults to
+        the wrftools precision.
+    ---------------------
+    returns:
+        dict of numpy.ndarray keyed by field name, same shape as T
+    """
+    assert T.shape == P.shape == PB.shape == QVAPOR.shape, 'Arrays are different shapes. They must be the same shape.'
+    for name in fields:
+        assert name in ( 'THETA', 'TEMP', 'PRES', 'RH', 'DEWP', 'QVAPOR' ), 'Unknown field %s.' % name
+    dtype = resolve_dtype( dtype )
+    if out is None:
+        out = {}
+    outputs = {}
+    for name in fields:
+        if name in out:
+            assert out[name].shape == T.shape and out[name].flags.c_contiguous, 'Output arrays must be C-contiguous and the same shape as T.'
+            outputs[name] = out[name]
+        else:
+            outputs[name] = numpy.empty( T.shape, dtype=dtype )
+    flat = dict( ( name, arr.reshape( -1 ) ) for name, arr in outputs.items() )
+    T = numpy.asarray( T ).reshape( -1 )
+    P = numpy.asarray( P ).reshape( -1 )
+    PB = numpy.asarray( PB ).reshape( -1 )
+    QVAPOR = numpy.asarray( QVAPOR ).reshape( -1 )
+
+    ## constants for the Clausius Clapeyron Equation
+    K = 0.2854
+    e_0 = 6.1173 ## mb
+    t_0 = 273.16 ## K
+    Rv = 461.50 ## J K-1 Kg-1
+    Lv_0 = 2.501 * 10**6 ## J Kg-1
+    K1 = Lv_0 / Rv ## K
+    K2 = 1 / t_0 ## K-1
+    K1_inv = Rv / Lv_0
+    moist = 'RH' in fields or 'DEWP' in fields
+
+    ## scratch buffers, reused for every block
+    size = max( 1, min( blocksize, T.shape[0] ) )
+    scratch = dict( ( name, numpy.empty( size, dtype=dtype ) ) for name in ( 'THETA', 'PRES', 'TEMP', 'q', 'e_s', 'w_s', 'e' ) )
+    for start in range( 0, T.shape[0], size ):
+        end = min( start + size, T.shape[0] )
+        n = end - start
+        buf = dict( ( name, arr[:n] ) for name, arr in scratch.items() )
+        for name in ( 'THETA', 'PRES', 'TEMP' ):
+            if name in flat:
+                buf[name] = flat[name][start:end]
+        theta, pres, temp, q = buf['THETA'], buf['PRES'], buf['TEMP'], buf['q']
+
+        numpy.add( T[start:end], 300, out=theta, dtype=dtype )
+        numpy.add( P[start:end], PB[start:end], out=pres, dtype=dtype )
+        pres *= .01
+        if 'TEMP' in fields or moist:
+            numpy.divide( pres, 1000, out=temp )
+            numpy.power( temp, K, out=temp )
+            temp *= theta
+        if 'QVAPOR' in flat:
+            flat['QVAPOR'][start:end] = QVAPOR[start:end]
+        if not moist:
+            continue
+        q[:] = QVAPOR[start:end]
+        ## Clausius Clapeyron Equation, e_s = e_0 * exp( K1 * ( K2 - 1 / TEMP ) )
+        e_s, w_s, e = buf['e_s'], buf['w_s'], buf['e']
+        numpy.reciprocal( temp, out=e_s )
+        numpy.subtract( K2, e_s, out=e_s )
+        e_s *= K1
+        numpy.exp( e_s, out=e_s )
+        e_s *= e_0
+        ## saturation mixing ratio
+        numpy.subtract( pres, e_s, out=w_s )
+        numpy.divide( e_s, w_s, out=w_s )
+        w_s *= 0.622
+        ## q / w_s is the fractional relative humidity
+        numpy.divide( q, w_s, out=e )
+        if 'RH' in flat:
+            numpy.multiply( e, 100, out=flat['RH'][start:end] )
+        if 'DEWP' in flat:
+            ## back out the vapor pressure and solve for Td
+            e *= e_s
+            e /= e_0
+            numpy.log( e, out=e )
+            e *= K1_inv
+            numpy.subtract( K2, e, out=e )
+            numpy.reciprocal( e, out=flat['DEWP'][start:end] )
+    return outputs
@@ -3,30 +3,37 @@
 ## http://tempestchasing.com
 ## Protected under the GPL V2 License
 
-from netCDF4 import Dataset
 import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
 
-def wrf_pressure( P, PB ):
+@timed
+def wrf_pressure( P, PB, dtype=None ):
     """ Calculate the pressure in hPa given Perturbation Pressure (P) and Base State Pressure (PB) in Pa.
         ---------------------
         P (numpy.ndarray): ndarray of Perturbation Pressure from WRF
         PB (numpy.ndarray): ndarray of Base State Pressure from WRF
+        dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
         ---------------------
         returns:
         numpy.ndarray of pressure in hPa the same shape as P and PB
         """
     assert P.shape == PB.shape, 'Arrays are different shapes. They must be the same shape.'
-    return ( P + PB ) * .01
+    dtype = resolve_dtype( dtype )
+    return ( as_dtype( P, dtype ) + as_dtype( PB, dtype ) ) * .01
 
-def wrf_height( PH, PHB ):
+@timed
+def wrf_height( PH, PHB, dtype=None ):
     """ Calculate the geopotential height given the Perturbation Geopotential (PH) and the Base State
         Geopotential (PHB). PH and PHB must be the same shape.
         ---------------------
         PH (numpy.ndarray): ndarray of Perturbation Geopotential from WRF
         PHB (numpy.ndarray): ndarray of Base State Geopotential from WRF
+        dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
         ---------------------
         returns:
         numpy.ndarray of geopotential height in meters in sane shape as PH and PHB
         """
     assert PH.shape == PHB.shape, 'Arrays are different shapes. They must be the same shape.'
-    return ( PH + PHB ) / 9.81
\ No newline at end of file
+    dtype = resolve_dtype( dtype )
+    return ( as_dtype( PH, dtype ) + as_dtype( PHB, dtype ) ) / 9.81
\ No newline at end of file
@@ -3,10 +3,12 @@
 ## http://tempestchasing.com
 ## Protected under the GPL V2 License
 
-from netCDF4 import Dataset
 import numpy
+from wrftools.instrument import timed
+from wrftools.precision import resolve_dtype, as_dtype
 
-def wrf_vort( U, V, dx ):
+@timed
+def wrf_vort( U, V, dx, dtype=None ):
     """Calculate the relative vorticity given the U and V vector components in m/s
     and the grid spacing dx in meters.
     U and V must be the same shape.
@@ -14,17 +16,21 @@ def wrf_vort( U, V, dx ):
     U (numpy.ndarray): ndarray of U vector values in m/s
     V (numpy.ndarray): ndarray of V vector values in m/s
     dx (float or int): float or integer of U and V grispacing in meters
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of vorticity values s^-1 same shape as U and V
     """
     assert U.shape == V.shape, 'Arrays are different shapes. They must be the same shape.'
+    dtype = resolve_dtype( dtype )
+    U, V, dx = as_dtype( U, dtype ), as_dtype( V, dtype ), as_dtype( dx, dtype )
     dy = dx
     du = numpy.gradient( U )
     dv = numpy.gradient( V )
     return ( dv[-1]/dx - du[-2]/dy )
 
-def wrf_absvort( U, V, F, dx ):
+@timed
+def wrf_absvort( U, V, F, dx, dtype=None ):
     """Calculate the absolute vorticity given the U and V vector components in m/s,
     the Coriolis sine latitude term (F) in s^-1, and gridspacing dx in meters. U, V, and F
     must be the same shape.
@@ -33,41 +39,88 @@ def wrf_absvort( U, V, F, dx ):
     V (numpy.ndarray): ndarray of V vector values in m/s
     F (numpy.ndarray): ndarray of Coriolis sine latitude values in s^-1
     dx (float or int): float or integer of U and V grispacing in meters
+    dtype (numpy.dtype): the precision of the computation. Defaults to the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of absolute vorticity values s^-1 same shape as U and V
     
     """
     assert U.shape == V.shape, 'Arrays are different shapes. They must be the same shape.'
-    return wrf_vort( U, V, dx ) + F
+    dtype = resolve_dtype( dtype )
+    return wrf_vort( U, V, dx, dtype=dtype ) + as_dtype( F, dtype )
 
-def wrf_pv( U, V, F, THETA, PRES, MAPFAC_M, dx ):
+@timed
+def wrf_pv( U, V, F, THETA, PRES, MAPFAC_M, dx, out=None, dtype=None ):
     """Calculate the potential vorticity given the U and V vector components in m/s,
     the Coriolis sine latitude term (F) in s^-1, THETA potential temperature in degrees
     Kelvin, PRES pressure in hPa or mb, the map scale factor on mass grid and the gridspacing 
-    dx in meters. U, V, F, THETA, and PRES must be 4D arrays.
+    dx in meters. U, V, THETA, and PRES must be 4D arrays. F and MAPFAC_M may be 2D, or
+    have a leading Time dimension as WRF writes them, or be 4D like U.
+    The computation is done one time step at a time, and only the vertical and
+    horizontal derivatives that appear in the equation are formed, so the memory
+    used beyond the output is a few arrays the size of one time step, in the
+    precision of dtype whatever the precision of the inputs.
     ---------------------
     U (numpy.ndarray): ndarray of U vector values in m/s
     V (numpy.ndarray): ndarray of V vector values in m/s
-    F (numpy.ndarray): ndarray of Coriolis sine latitude values in s^-1
+    F (numpy.ndarray): ndarray of Coriolis sine latitude values in s^-1, shape (south_north, west_east),
+        (Time, south_north, west_east), or the shape of U
     THETA (numpy.ndarray): ndarray of potential temperature in degrees Kelvin
     PRES (numpy.ndarray): ndarray of pressure in hPa or mb same shape as THETA
-    MAPFAC_M (numpy.ndarray): 2D of map scale factor on mass grid. 
+    MAPFAC_M (numpy.ndarray): map scale factor on mass grid, with the same shapes allowed as F
     dx (float or int): float or integer of U and V grispacing in meters
+    out (numpy.ndarray): optional ndarray the same shape as U to write the result into
+    dtype (numpy.dtype): the precision of the computation and of a new output. Defaults to
+        the wrftools precision.
     ---------------------
     returns:
         numpy.ndarray of potential vorticity values in ( K * m^2 * kg^-1 * s^-1 ) * 10^6 
         ( or 1 PVU * 10^6).
     """
     assert U.shape == V.shape == THETA.shape == PRES.shape, 'Arrays are different shapes. They must be the same shape.'
-    ## pres in hPa needs to convert to Pa
-    PRES = PRES * 100
-    dx = dx * MAPFAC_M
-    dy = dx
+    dtype = resolve_dtype( dtype )
+    if out is None:
+        out = numpy.empty( U.shape, dtype=dtype )
     grav = 9.8
+    for time in range( U.shape[0] ):
+        u = numpy.asarray( U[time], dtype=dtype )
+        v = numpy.asarray( V[time], dtype=dtype )
+        theta = numpy.asarray( THETA[time], dtype=dtype )
+        ## F and MAPFAC_M have none, some, or all of the leading dimensions of U
+        index = ( time, )
+        f = as_dtype( F[ index[:numpy.ndim( F ) - 2] ], dtype )
+        mapfac = MAPFAC_M[ index[:numpy.ndim( MAPFAC_M ) - 2] ]
+        ## grid spacing, the same in x and y
+        ds = as_dtype( dx, dtype ) * numpy.asarray( mapfac, dtype=dtype )
+        ## pres in hPa needs to convert to Pa
+        dp = numpy.gradient( numpy.asarray( PRES[time], dtype=dtype ), axis=0 )
+        dp *= 100
+
+        ## ( dV/dx - dU/dy + F ) * dTheta/dp
+        pv = numpy.gradient( v, axis=2 )
+        pv /= ds
+        term = numpy.gradient( u, axis=1 )
+        term /= ds
+        pv -= term
+        pv += f
+        term = numpy.gradient( theta, axis=0 )
+        term /= dp
+        pv *= term
+        ## + dU/dp * dTheta/dy
+        term = numpy.gradient( u, axis=0 )
+        term /= dp
+        dtheta = numpy.gradient( theta, axis=1 )
+        dtheta /= ds
+        term *= dtheta
+        pv += term
+        ## - dV/dp * dTheta/dx
+        term = numpy.gradient( v, axis=0 )
+        term /= dp
+        dtheta = numpy.gradient( theta, axis=2 )
+        dtheta /= ds
+        term *= dtheta
+        pv -= term
+        del term, dtheta, dp
 
-    dVt,dVp,dVy,dVx = numpy.gradient( V )
-    dUt,dUp,dUy,dUx = numpy.gradient( U )
-    dTt,dTp,dTy,dTx = numpy.gradient( THETA )
-    dPt,dp,dPy,dPx = numpy.gradient( PRES )
-    return ( -grav * ( -dVp/dp * dTx/dx + dUp/dp * dTy/dy + ( dVx/dx - dUy/dy + F ) * dTp/dp ) ) * pow(10, 6)
+        numpy.multiply( pv, -grav * pow( 10, 6 ), out=out[time] )
+    return out
\ No newline at end of file